@@ -3,6 +3,7 @@ from fastapi.responses import JSONResponse
 from fastapi import status, FastAPI, Request, Response
 from fastapi.exceptions import RequestValidationError
 from .enum import ErrorEnum
+from utils.rate_limit import ModelBusyError
 import traceback
 import logging
 logger = logging.getLogger(__name__)
@@ -33,6 +34,13 @@ def biz_exception(app: FastAPI):
     async def biz_exception_handler(req: Request, exc: BizException):
         return response_error(exc.code, exc.message)
 
+    # bedrock capacity of the model is used up, the client may retry
+    @app.exception_handler(ModelBusyError)
+    async def model_busy_exception_handler(req: Request, exc: ModelBusyError):
+        logger.warning(exc)
+        return response_error(ErrorEnum.MODEL_BUSY.get_code(), ErrorEnum.MODEL_BUSY.get_message(),
+                              status.HTTP_429_TOO_MANY_REQUESTS)
+
     # system error
     @app.exception_handler(Exception)
     async def exception_handler(req: Request, exc: Exception):
@@ -1,14 +1,18 @@
 import json
 import os
 import traceback
+from typing import Iterable
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 import logging
 
 from nlq.business.profile import ProfileManagement
 from .enum import ContentEnum, ErrorEnum
+from .exception_handler import BizException
+from utils.rate_limit import ModelBusyError
 from .schemas import Question, QuestionSocket, Answer, Option, CustomQuestion, Upvote, SQLSearchResult, \
     AgentSearchResult, KnowledgeSearchResult, TaskSQLSearchResult
 from . import service
+from .offload import run_blocking, iterate_blocking
 from nlq.business.nlq_chain import NLQChain
 from dotenv import load_dotenv
 
@@ -22,10 +26,17 @@ def option():
     return service.get_option()
 
 
+@router.get("/metrics")
+def metrics():
+    return service.get_metrics()
+
+
 @router.get("/get_custom_question", response_model=CustomQuestion)
 def get_custom_question(data_profile: str):
-    all_profiles = ProfileManagement.get_all_profiles_with_info()
-    comments = all_profiles[data_profile]['comments']
+    profile = ProfileManagement.get_profile_info(data_profile)
+    if profile is None:
+        raise BizException(ErrorEnum.PROFILE_NOT_FOUND)
+    comments = profile['comments']
     comments_questions = []
     if len(comments.split("Examples:")) > 1:
         comments_questions_txt = comments.split("Examples:")[1]
@@ -35,8 +46,8 @@ def get_custom_question(data_profile: str):
 
 
 @router.post("/ask", response_model=Answer)
-def ask(question: Question):
-    return service.ask(question)
+async def ask(question: Question):
+    return await run_blocking(service.ask, question)
 
 
 @router.post("/ask/test", response_model=Answer)
@@ -68,27 +79,31 @@ async def websocket_endpoint(websocket: WebSocket):
                     await response_websocket(websocket, session_id, ErrorEnum.INVALID_SESSION_ID.get_message(),
                                              ContentEnum.EXCEPTION)
                     continue
-                current_nlq_chain = service.get_nlq_chain(question)
+                current_nlq_chain = await run_blocking(service.get_nlq_chain, question)
                 if question.use_rag:
                     examples = service.get_example(current_nlq_chain)
                     await response_websocket(websocket, session_id, "Examples:\n```json\n")
                     await response_websocket(websocket, session_id, str(examples))
                     await response_websocket(websocket, session_id, "\n```\n")
-                response = service.ask_with_response_stream(question, current_nlq_chain)
+                response = await run_blocking(service.ask_with_response_stream, question, current_nlq_chain)
                 if os.getenv('SAGEMAKER_ENDPOINT_SQL', ''):
                     await response_sagemaker_sql(websocket, session_id, response, current_nlq_chain)
                     await response_websocket(websocket, session_id, "\n")
-                    explain_response = service.explain_with_response_stream(current_nlq_chain)
+                    explain_response = await run_blocking(service.explain_with_response_stream, current_nlq_chain)
                     await response_sagemaker_explain(websocket, session_id, explain_response)
                 else:
                     await response_bedrock(websocket, session_id, response, current_nlq_chain)
 
                 if question.query_result:
-                    final_sql_query_result = service.get_executed_result(current_nlq_chain)
+                    final_sql_query_result = await run_blocking(service.get_executed_result, current_nlq_chain)
                     await response_websocket(websocket, session_id, "\n\nQuery result:  \n")
                     await response_websocket(websocket, session_id, final_sql_query_result)
                     await response_websocket(websocket, session_id, "\n")
                 await response_websocket(websocket, session_id, "", ContentEnum.END)
+            except ModelBusyError as e:
+                logger.warning(e)
+                await response_websocket(websocket, session_id, ErrorEnum.MODEL_BUSY.get_message(),
+                                         ContentEnum.EXCEPTION)
             except Exception:
                 msg = traceback.format_exc()
                 logger.exception(msg)
@@ -99,7 +114,7 @@ async def websocket_endpoint(websocket: WebSocket):
 
 async def response_sagemaker_sql(websocket: WebSocket, session_id: str, response: dict, current_nlq_chain: NLQChain):
     result_pieces = []
-    for event in response['Body']:
+    async for event in iterate_blocking(response['Body']):
         current_body = event["PayloadPart"]["Bytes"].decode('utf8')
         result_pieces.append(current_body)
         await response_websocket(websocket, session_id, current_body)
@@ -114,23 +129,18 @@ LIMIT 10;</query>'''
 
 
 async def response_sagemaker_explain(websocket: WebSocket, session_id: str, response: dict):
-    for event in response['Body']:
+    async for event in iterate_blocking(response['Body']):
         current_body = event["PayloadPart"]["Bytes"].decode('utf8')
         current_content = json.loads(current_body)
         await response_websocket(websocket, session_id, current_content.get("outputs"))
 
 
-async def response_bedrock(websocket: WebSocket, session_id: str, response: dict, current_nlq_chain: NLQChain):
+async def response_bedrock(websocket: WebSocket, session_id: str, response: Iterable[str],
+                           current_nlq_chain: NLQChain):
     result_pieces = []
-    for event in response['body']:
-        current_body = event["chunk"]["bytes"].decode('utf8')
-        current_content = json.loads(current_body)
-        if current_content.get("type") == "content_block_delta":
-            current_text = current_content.get("delta").get("text")
-            result_pieces.append(current_text)
-            await response_websocket(websocket, session_id, current_text)
-        elif current_content.get("type") == "content_block_stop":
-            break
+    async for current_text in iterate_blocking(response):
+        result_pieces.append(current_text)
+        await response_websocket(websocket, session_id, current_text)
     current_nlq_chain.set_generated_sql_response(''.join(result_pieces))
 
 
@@ -0,0 +1,34 @@
+from functools import partial
+
+import anyio
+from anyio import to_thread
+
+from utils.env_var import API_BLOCKING_THREADS
+
+_END = object()
+
+# own thread budget for the blocking pipeline (boto3, opensearch, database drivers), so long running questions
+# do not use up the default threadpool that also serves the light endpoints
+blocking_limiter = None
+
+
+def get_blocking_limiter() -> anyio.CapacityLimiter:
+    # the limiter must be created inside the running event loop
+    global blocking_limiter
+    if blocking_limiter is None:
+        blocking_limiter = anyio.CapacityLimiter(API_BLOCKING_THREADS)
+    return blocking_limiter
+
+
+async def run_blocking(fn, *args, **kwargs):
+    return await to_thread.run_sync(partial(fn, *args, **kwargs), limiter=get_blocking_limiter())
+
+
+async def iterate_blocking(iterable):
+    """Consume a blocking iterable, e.g. a boto3 event stream, without blocking the event loop"""
+    iterator = await run_blocking(iter, iterable)
+    while True:
+        item = await run_blocking(next, iterator, _END)
+        if item is _END:
+            break
+        yield item
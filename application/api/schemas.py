@@ -1,4 +1,4 @@
-from typing import Any
+from typing import Any, Optional
 from pydantic import BaseModel
 
 
@@ -16,6 +16,8 @@ class Question(BaseModel):
     top_p: float = 0.9
     max_tokens: int = 2048
     temperature: float = 0.01
+    # skip the answer cache and always run the full pipeline
+    bypass_cache_flag: bool = False
 
 
 class QuestionSocket(Question):
@@ -63,6 +65,10 @@ class SQLSearchResult(BaseModel):
     data_show_type: str
     sql_gen_process: str
     data_analyse: str
+    # sql_data holds only the first rows when the result exceeded the row / byte limit
+    truncated: bool = False
+    # rows of the full result, None when it could not be counted
+    total_rows: Optional[int] = None
 
 
 class TaskSQLSearchResult(BaseModel):
@@ -90,3 +96,5 @@ class Answer(BaseModel):
     sql_search_result: SQLSearchResult
     agent_search_result: AgentSearchResult
     suggested_question: list[str]
+    # wall time of each pipeline stage in milliseconds
+    stage_timings: dict[str, int] = {}
@@ -1,5 +1,7 @@
+import copy
 import json
 import os
+from functools import partial
 from typing import Union
 from dotenv import load_dotenv
 import logging
@@ -9,19 +11,31 @@ from nlq.business.nlq_chain import NLQChain
 from nlq.business.profile import ProfileManagement
 from nlq.business.vector_store import VectorStore
 from nlq.business.log_store import LogManagement
-from utils.apis import get_sql_result_tool
+from nlq.data_access.database import RelationDatabase
+from utils.apis import get_sql_result_tool, result_cache
 from utils.database import get_db_url_dialect
-from nlq.business.suggested_question import SuggestedQuestionManagement as sqm
 from utils.llm import text_to_sql, get_query_intent, create_vector_embedding_with_sagemaker, \
     sagemaker_to_sql, sagemaker_to_explain, knowledge_search, get_agent_cot_task, data_analyse_tool, \
-    generate_suggested_question, data_visualization
+    generate_suggested_question, data_visualization, embedding_cache, create_vector_embedding_with_bedrock, \
+    start_usage_tracking, is_usable_intent, is_usable_visualization
 from utils.opensearch import get_retrieve_opensearch
+from utils.prompts.generate_prompt import prompt_cache
+from utils import intent_classifier, rate_limit, schema_linking, single_flight
+from utils.intent_classifier import classify_intent
+from utils.schema_linking import link_profile_schema
+from utils.model_routing import ModelRouter, get_routing_config
 from utils.text_search import normal_text_search, agent_text_search
+from utils.cache import AnswerCache
+from utils.concurrency import StageTimer, run_parallel_tasks
+from utils.lazy import get_initialization_report
+from utils.domain import SearchTextSqlResult
+from utils.env_var import AGENT_TASK_CONCURRENCY, AGENT_TASK_TIMEOUT, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, \
+    ANSWER_CACHE_SIMILARITY_THRESHOLD, ANSWER_CACHE_REUSE_RESULT, RESULT_CACHE_TTL
 from utils.tool import generate_log_id, get_current_time, get_generated_sql_explain
 from .schemas import Question, Answer, Example, Option, SQLSearchResult, AgentSearchResult, KnowledgeSearchResult, \
     TaskSQLSearchResult, ChartEntity
 from .exception_handler import BizException
-from utils.constant import BEDROCK_MODEL_IDS, ACTIVE_PROMPT_NAME
+from utils.constant import BEDROCK_MODEL_IDS, LOCAL_INTENT_MODEL, AGENT_SUB_TASK_MARKER
 from .enum import ErrorEnum
 
 logger = logging.getLogger(__name__)
@@ -36,18 +50,62 @@ for key in opensearch_config:
 datasource_profile = {}
 for i, v in env_vars['data_sources'].items():
     datasource_profile[i] = v
-all_profiles = ProfileManagement.get_all_profiles_with_info()
-all_profiles.update(datasource_profile)
+
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY_THRESHOLD)
+
+
+def get_all_profiles():
+    # profiles come from the ProfileManagement cache, nothing is loaded when this module is imported
+    all_profiles = ProfileManagement.get_all_profiles_with_info()
+    all_profiles.update(datasource_profile)
+    return all_profiles
+
+
+def get_database_profile(profile_name):
+    if profile_name in datasource_profile:
+        return datasource_profile[profile_name]
+    database_profile = ProfileManagement.get_profile_info(profile_name)
+    if database_profile is None:
+        raise BizException(ErrorEnum.PROFILE_NOT_FOUND)
+    return database_profile
+
+
+def get_data_answer_cache_ttl(database_profile):
+    """
+    TTL of a cached answer holding query results, which must not outlive the profile's result freshness.
+    0 means the answer must not be cached.
+    """
+    result_cache_ttl = database_profile.get('result_cache_ttl')
+    result_cache_ttl = RESULT_CACHE_TTL if result_cache_ttl is None else int(result_cache_ttl)
+    if result_cache_ttl <= 0:
+        return 0
+    return min(ANSWER_CACHE_TTL, result_cache_ttl) if ANSWER_CACHE_TTL else result_cache_ttl
 
 
 def get_option() -> Option:
     option = Option(
-        data_profiles=all_profiles.keys(),
+        data_profiles=get_all_profiles().keys(),
         bedrock_model_ids=BEDROCK_MODEL_IDS,
     )
     return option
 
 
+def get_metrics() -> dict:
+    return {
+        'sql_engines': RelationDatabase.get_engine_pool_status(),
+        'embedding_cache': embedding_cache.get_stats(),
+        'answer_cache': answer_cache.get_stats(),
+        'result_cache': result_cache.get_stats(),
+        'query_log': LogManagement.get_stats(),
+        'prompt_cache': prompt_cache.get_stats(),
+        'schema_linking': schema_linking.get_stats(),
+        'rate_limits': rate_limit.get_stats(),
+        'single_flight': single_flight.get_stats(),
+        'intent_classifier': intent_classifier.get_stats(),
+        'lazy_initialization': get_initialization_report(),
+    }
+
+
 def __process_nlq_chain(question: Question) -> NLQChain:
     current_nlq_chain = NLQChain(question.profile_name)
 
@@ -111,9 +169,10 @@ def get_result_from_llm(question: Question, current_nlq_chain: NLQChain, with_re
     logger.info('try to get generated sql from LLM')
 
     entity_slot_retrieve = []
-    database_profile = all_profiles[question.profile_name]
+    database_profile = get_database_profile(question.profile_name)
+    router = ModelRouter(question.bedrock_model_id, get_routing_config(database_profile.get('model_routing')))
     if question.intent_ner_recognition:
-        intent_response = get_query_intent(question.bedrock_model_id, question.keywords, database_profile['prompt_map'])
+        intent_response = get_intent(router, database_profile, question.keywords)
         intent = intent_response.get("intent", "normal_search")
         if intent == "reject_search":
             raise BizException(ErrorEnum.NOT_SUPPORTED)
@@ -144,16 +203,18 @@ def get_result_from_llm(question: Question, current_nlq_chain: NLQChain, with_re
                                     model_provider=None,
                                     with_response_stream=with_response_stream, )  # This does not support streaming
     else:
-        response = text_to_sql(database_profile['tables_info'],
+        tables_info, schema_fingerprint = link_profile_schema(database_profile, question.keywords)
+        response = text_to_sql(tables_info,
                                database_profile['hints'],
                                database_profile['prompt_map'],
                                question.keywords,
-                               model_id=question.bedrock_model_id,
+                               model_id=router.get_model('text_to_sql'),
                                sql_examples=current_nlq_chain.get_retrieve_samples(),
                                ner_example=entity_slot_retrieve,
                                dialect=get_db_url_dialect(database_profile['db_url']),
                                model_provider=None,
-                               with_response_stream=with_response_stream, )
+                               with_response_stream=with_response_stream,
+                               fingerprint=schema_fingerprint)
     return response
 
 
@@ -185,9 +246,12 @@ def ask(question: Question) -> Answer:
     log_id = generate_log_id()
     current_time = get_current_time()
     log_info = ""
+    stage_timer = StageTimer()
+    usage = start_usage_tracking()
 
-    all_profiles = ProfileManagement.get_all_profiles_with_info()
-    database_profile = all_profiles[selected_profile]
+    database_profile = ProfileManagement.get_profile_info(selected_profile)
+    if database_profile is None:
+        raise BizException(ErrorEnum.PROFILE_NOT_FOUND)
 
     current_nlq_chain = NLQChain(selected_profile)
 
@@ -204,19 +268,43 @@ def ask(question: Question) -> Answer:
     agent_sql_search_result = []
 
     generate_suggested_question_list = []
+    suggested_question_future = None
 
     if database_profile['db_url'] == '':
-        conn_name = database_profile['conn_name']
-        db_url = ConnectionManagement.get_db_url_by_name(conn_name)
-        database_profile['db_url'] = db_url
-        database_profile['db_type'] = ConnectionManagement.get_db_type_by_name(conn_name)
+        resolved_connection = ConnectionManagement.get_resolved_connection(database_profile['conn_name'])
+        database_profile['db_url'] = resolved_connection.db_url
+        database_profile['db_type'] = resolved_connection.db_type
     prompt_map = database_profile['prompt_map']
+    router = ModelRouter(model_type, get_routing_config(database_profile.get('model_routing')))
+
+    profile_fingerprint = database_profile['fingerprint']
+    answer_cache_scope = AnswerCache.make_scope(selected_profile, model_type,
+                                                dict(get_answer_cache_flags(question),
+                                                     model_routing=router.routing_key))
+    question_embedding = None
+    similar_answer = None
+    if not question.bypass_cache_flag:
+        cached_answer = answer_cache.get(answer_cache_scope, search_box, profile_fingerprint)
+        if cached_answer is None and answer_cache.similarity_enabled:
+            question_embedding = stage_timer.run('answer_cache', get_question_embedding, search_box)
+            similar_answer = answer_cache.get_similar(answer_cache_scope, search_box, question_embedding,
+                                                     profile_fingerprint)
+            if ANSWER_CACHE_REUSE_RESULT:
+                cached_answer, similar_answer = similar_answer, None
+        if cached_answer is not None:
+            return get_cached_answer(cached_answer, search_box, selected_profile, stage_timer, log_id, current_time,
+                                     get_log_metrics(stage_timer, usage, router,
+                                                     cache_hits={'answer_cache': 'similar' if question_embedding
+                                                                 else 'exact'}))
 
     entity_slot = []
     # Control subsequent logic through flag bits
     # There are 4 main intentions, rejection, query, thought chain, knowledge question and answer
-    if intent_ner_recognition_flag:
-        intent_response = get_query_intent(model_type, search_box, prompt_map)
+    if similar_answer is not None:
+        # a near-duplicate question was answered before, reuse its SQL and only execute it again
+        search_intent_flag = True
+    elif intent_ner_recognition_flag:
+        intent_response = get_intent(router, database_profile, search_box, stage_timer)
         intent = intent_response.get("intent", "normal_search")
         entity_slot = intent_response.get("slot", [])
         if intent == "reject_search":
@@ -238,50 +326,64 @@ def ask(question: Question) -> Answer:
     else:
         search_intent_flag = True
 
+    # suggested questions only need the question text, generate them while the answer is being worked out
+    if gen_suggested_question_flag and (search_intent_flag or agent_intent_flag):
+        suggested_question_future = stage_timer.submit_llm('suggested_question', generate_suggested_question,
+                                                           prompt_map, search_box,
+                                                           model_id=router.get_model('suggested_question'))
+
     if reject_intent_flag:
         answer = Answer(query=search_box, query_intent="reject_search", knowledge_search_result=knowledge_search_result,
                         sql_search_result=sql_search_result, agent_search_result=agent_search_response,
-                        suggested_question=[])
+                        suggested_question=[], stage_timings=stage_timer.get_timings())
         LogManagement.add_log_to_database(log_id=log_id, profile_name=selected_profile, sql="", query=search_box,
-                                          intent="reject_search", log_info="", time_str=current_time)
+                                          intent="reject_search", log_info="", time_str=current_time,
+                                          **get_log_metrics(stage_timer, usage, router))
+        router.log_report(stage_timer.get_timings())
+        answer_cache.set(answer_cache_scope, search_box, profile_fingerprint, copy.deepcopy(answer))
         return answer
     elif search_intent_flag:
-        normal_search_result = normal_text_search(search_box, model_type,
-                                                  database_profile,
-                                                  entity_slot, env_vars,
-                                                  selected_profile, use_rag_flag)
+        if similar_answer is not None:
+            normal_search_result = SearchTextSqlResult(search_query=search_box, entity_slot_retrieve=[],
+                                                       retrieve_result=[],
+                                                       response="",
+                                                       sql=similar_answer.sql_search_result.sql)
+        else:
+            normal_search_result = normal_text_search(search_box, router.get_model('text_to_sql'),
+                                                      database_profile,
+                                                      entity_slot, env_vars,
+                                                      selected_profile, use_rag_flag, stage_timer=stage_timer)
     elif knowledge_search_flag:
-        response = knowledge_search(search_box=search_box, model_id=model_type, prompt_map=prompt_map)
+        response = stage_timer.run('knowledge_search', router.run, 'knowledge_search', knowledge_search, search_box,
+                                   prompt_map, accept=bool)
 
         knowledge_search_result.knowledge_response = response
         answer = Answer(query=search_box, query_intent="knowledge_search",
                         knowledge_search_result=knowledge_search_result,
                         sql_search_result=sql_search_result, agent_search_result=agent_search_response,
-                        suggested_question=[])
+                        suggested_question=[], stage_timings=stage_timer.get_timings())
 
         LogManagement.add_log_to_database(log_id=log_id, profile_name=selected_profile, sql="", query=search_box,
                                           intent="knowledge_search",
                                           log_info=knowledge_search_result.knowledge_response,
-                                          time_str=current_time)
+                                          time_str=current_time, **get_log_metrics(stage_timer, usage, router))
+        router.log_report(stage_timer.get_timings())
+        answer_cache.set(answer_cache_scope, search_box, profile_fingerprint, copy.deepcopy(answer))
         return answer
 
     else:
-        agent_cot_retrieve = get_retrieve_opensearch(env_vars, search_box, "agent",
-                                                     selected_profile, 2, 0.5)
-        agent_cot_task_result = get_agent_cot_task(model_type, prompt_map, search_box,
-                                                   database_profile['tables_info'],
-                                                   agent_cot_retrieve)
-
-        agent_search_result = agent_text_search(search_box, model_type,
-                                                database_profile,
-                                                entity_slot, env_vars,
-                                                selected_profile, use_rag_flag, agent_cot_task_result)
-
-    if gen_suggested_question_flag and (search_intent_flag or agent_intent_flag):
-        active_prompt = sqm.get_prompt_by_name(ACTIVE_PROMPT_NAME).prompt
-        generated_sq = generate_suggested_question(prompt_map, search_box, model_id=model_type)
-        split_strings = generated_sq.split("[generate]")
-        generate_suggested_question_list = [s.strip() for s in split_strings if s.strip()]
+        agent_cot_retrieve = stage_timer.run('agent_retrieval', get_retrieve_opensearch, env_vars, search_box,
+                                             "agent", selected_profile, 2, 0.5)
+        agent_cot_task_result = stage_timer.run('agent_task', get_agent_cot_task, router.get_model('agent_task'),
+                                                prompt_map, search_box,
+                                                database_profile['tables_info'],
+                                                agent_cot_retrieve, profile_fingerprint)
+
+        agent_search_result = stage_timer.run('text_to_sql', agent_text_search, search_box,
+                                              router.get_model('text_to_sql'),
+                                              database_profile,
+                                              entity_slot, env_vars,
+                                              selected_profile, use_rag_flag, agent_cot_task_result)
 
     # Connect to the database, execute SQL, record and display history
     if search_intent_flag:
@@ -294,22 +396,27 @@ def ask(question: Question) -> Answer:
         else:
             sql_search_result.sql = "-1"
 
-        search_intent_result = get_sql_result_tool(database_profile,
-                                                   current_nlq_chain.get_generated_sql())
+        search_intent_result = stage_timer.run('sql_execution', get_sql_result_tool, database_profile,
+                                               current_nlq_chain.get_generated_sql())
         if search_intent_result["status_code"] == 500:
             sql_search_result.data_analyse = "The query results are temporarily unavailable, please switch to debugging webpage to try the same query and check the log file for more information."
         else:
             if search_intent_result["data"] is not None and len(search_intent_result["data"]) > 0:
+                # insights and chart selection both only need the result set
+                data_analyse_future = None
                 if answer_with_insights:
-                    search_intent_analyse_result = data_analyse_tool(model_type, prompt_map, search_box,
-                                                                     search_intent_result["data"].to_json(
-                                                                         orient='records', force_ascii=False), "query")
+                    data_analyse_future = stage_timer.submit_llm('data_analyse', router.run, 'data_analyse',
+                                                                 data_analyse_tool, prompt_map, search_box,
+                                                                 search_intent_result["data"].to_json(
+                                                                     orient='records', force_ascii=False), "query",
+                                                                 accept=bool)
 
-                    sql_search_result.data_analyse = search_intent_analyse_result
+                model_select_type, show_select_data, select_chart_type, show_chart_data = stage_timer.run(
+                    'data_visualization', router.run, 'data_visualization', data_visualization, search_box,
+                    search_intent_result["data"], database_profile['prompt_map'], accept=is_usable_visualization)
 
-                model_select_type, show_select_data, select_chart_type, show_chart_data = data_visualization(model_type, search_box,
-                                                                                          search_intent_result["data"],
-                                                                                          database_profile['prompt_map'])
+                if data_analyse_future is not None:
+                    sql_search_result.data_analyse = data_analyse_future.result()
 
                 if select_chart_type != "-1":
                     sql_chart_data = ChartEntity(chart_type="", chart_data=[])
@@ -319,39 +426,66 @@ def ask(question: Question) -> Answer:
 
                 sql_search_result.sql_data = show_select_data
                 sql_search_result.data_show_type = model_select_type
+                sql_search_result.truncated = search_intent_result["truncated"]
+                sql_search_result.total_rows = search_intent_result["total_rows"]
 
+        generate_suggested_question_list = get_suggested_question_list(suggested_question_future)
         log_info = search_intent_result["error_info"] + ";" + sql_search_result.data_analyse
+        cache_hits = {'answer_cache': 'similar_sql' if similar_answer is not None else '',
+                      'result_cache': search_intent_result["cache_hit"]}
         LogManagement.add_log_to_database(log_id=log_id, profile_name=selected_profile, sql=sql_search_result.sql,
                                           query=search_box,
                                           intent="normal_search",
                                           log_info=log_info,
-                                          time_str=current_time)
+                                          time_str=current_time,
+                                          **get_log_metrics(stage_timer, usage, router,
+                                                            rows=len(search_intent_result["data"]),
+                                                            cache_hits=cache_hits))
+        router.log_report(stage_timer.get_timings())
         answer = Answer(query=search_box, query_intent="normal_search", knowledge_search_result=knowledge_search_result,
                         sql_search_result=sql_search_result, agent_search_result=agent_search_response,
-                        suggested_question=generate_suggested_question_list)
+                        suggested_question=generate_suggested_question_list,
+                        stage_timings=stage_timer.get_timings())
+        # only answers whose SQL ran fine are worth serving again, and only ones the model generated the SQL for,
+        # so reuse does not drift from one near-duplicate to the next
+        data_answer_cache_ttl = get_data_answer_cache_ttl(database_profile)
+        if search_intent_result["status_code"] == 200 and sql_search_result.sql != "-1" and similar_answer is None \
+                and data_answer_cache_ttl:
+            answer_cache.set(answer_cache_scope, search_box, profile_fingerprint, copy.deepcopy(answer),
+                             embedding=question_embedding, ttl=data_answer_cache_ttl)
         return answer
     else:
         sub_search_task = []
+        sub_task_logs = []
+        # execute and visualize the sub tasks concurrently, a failed or timed out sub task is reported as a SQL error
+        sub_task_results = stage_timer.run('sql_execution', run_parallel_tasks,
+                                           [partial(execute_agent_sub_task, database_profile, router, each_task)
+                                            for each_task in agent_search_result],
+                                           AGENT_TASK_CONCURRENCY, AGENT_TASK_TIMEOUT)
         for i in range(len(agent_search_result)):
-            each_task_res = get_sql_result_tool(database_profile, agent_search_result[i]["sql"])
+            sub_task_result, sub_task_error = sub_task_results[i]
+            if sub_task_error is not None:
+                logger.error(f"agent sub task {agent_search_result[i]['query']} is error: {sub_task_error}")
+                each_task_res = {"data": None, "sql": agent_search_result[i]["sql"], "status_code": 500,
+                                 "error_info": str(sub_task_error), "truncated": False, "total_rows": 0,
+                                 "cache_hit": False}
+            else:
+                each_task_res, each_task_visualization = sub_task_result
             if each_task_res["status_code"] == 200 and len(each_task_res["data"]) > 0:
                 agent_search_result[i]["data_result"] = each_task_res["data"].to_json(
                     orient='records')
                 filter_deep_dive_sql_result.append(agent_search_result[i])
                 each_task_sql_res = [list(each_task_res["data"].columns)] + each_task_res["data"].values.tolist()
 
-                model_select_type, show_select_data, select_chart_type, show_chart_data = data_visualization(model_type,
-                                                                                          agent_search_result[i][
-                                                                                              "query"],
-                                                                                          each_task_res["data"],
-                                                                                          database_profile[
-                                                                                              'prompt_map'])
+                model_select_type, show_select_data, select_chart_type, show_chart_data = each_task_visualization
 
                 each_task_sql_response = get_generated_sql_explain(agent_search_result[i]["response"])
                 sub_task_sql_result = SQLSearchResult(sql_data=show_select_data, sql=each_task_res["sql"],
                                                       data_show_type=model_select_type,
                                                       sql_gen_process=each_task_sql_response,
-                                                      data_analyse="", sql_data_chart=[])
+                                                      data_analyse="", sql_data_chart=[],
+                                                      truncated=each_task_res["truncated"],
+                                                      total_rows=each_task_res["total_rows"])
                 if select_chart_type != "-1":
                     sub_sql_chart_data = ChartEntity(chart_type="", chart_data=[])
                     sub_sql_chart_data.chart_type = select_chart_type
@@ -366,26 +500,123 @@ def ask(question: Question) -> Answer:
                 log_info = ""
             else:
                 log_info = agent_search_result[i]["query"] + "The SQL error Info: "
-            log_id = generate_log_id()
-            LogManagement.add_log_to_database(log_id=log_id, profile_name=selected_profile, sql=each_task_res["sql"],
-                                              query=search_box + "; The sub task is " + agent_search_result[i]["query"],
-                                              intent="agent_search",
-                                              log_info=log_info,
-                                              time_str=current_time)
-        agent_data_analyse_result = data_analyse_tool(model_type, prompt_map, search_box,
-                                                      json.dumps(filter_deep_dive_sql_result, ensure_ascii=False),
-                                                      "agent")
+            sub_task_logs.append((each_task_res, agent_search_result[i]["query"], log_info))
+        agent_data_analyse_result = stage_timer.run('data_analyse', router.run, 'data_analyse', data_analyse_tool,
+                                                    prompt_map, search_box,
+                                                    json.dumps(filter_deep_dive_sql_result, ensure_ascii=False),
+                                                    "agent", accept=bool)
         logger.info("agent_data_analyse_result")
         logger.info(agent_data_analyse_result)
         agent_search_response.agent_summary = agent_data_analyse_result
         agent_search_response.agent_sql_search_result = agent_sql_search_result
+        generate_suggested_question_list = get_suggested_question_list(suggested_question_future)
 
+        # written once the summary is done, the first sub task log carries the timings and usage of the whole question
+        for sub_task_index, (each_task_res, sub_task_query, log_info) in enumerate(sub_task_logs):
+            LogManagement.add_log_to_database(log_id=generate_log_id(), profile_name=selected_profile,
+                                              sql=each_task_res["sql"],
+                                              query=search_box + AGENT_SUB_TASK_MARKER + sub_task_query,
+                                              intent="agent_search",
+                                              log_info=log_info,
+                                              time_str=current_time,
+                                              **get_log_metrics(stage_timer, usage, router,
+                                                                rows=len(each_task_res["data"])
+                                                                if each_task_res["data"] is not None else 0,
+                                                                cache_hits={'result_cache': each_task_res["cache_hit"]},
+                                                                question_row=sub_task_index == 0))
+
+        router.log_report(stage_timer.get_timings())
         answer = Answer(query=search_box, query_intent="agent_search", knowledge_search_result=knowledge_search_result,
                         sql_search_result=sql_search_result, agent_search_result=agent_search_response,
-                        suggested_question=generate_suggested_question_list)
+                        suggested_question=generate_suggested_question_list,
+                        stage_timings=stage_timer.get_timings())
+        data_answer_cache_ttl = get_data_answer_cache_ttl(database_profile)
+        if agent_sql_search_result and data_answer_cache_ttl:
+            answer_cache.set(answer_cache_scope, search_box, profile_fingerprint, copy.deepcopy(answer),
+                             ttl=data_answer_cache_ttl)
         return answer
 
 
+def get_answer_cache_flags(question: Question) -> dict:
+    return {
+        'use_rag': question.use_rag_flag,
+        'visualize_results': question.visualize_results_flag,
+        'intent_ner_recognition': question.intent_ner_recognition_flag,
+        'agent_cot': question.agent_cot_flag,
+        'explain_gen_process': question.explain_gen_process_flag,
+        'gen_suggested_question': question.gen_suggested_question_flag,
+    }
+
+
+def get_question_embedding(search_box):
+    try:
+        return create_vector_embedding_with_bedrock(search_box, index_name="")['vector_field']
+    except Exception as e:
+        logger.error(f"get question embedding for answer cache is error: {e}")
+        return None
+
+
+def get_cached_answer(cached_answer: Answer, search_box, selected_profile, stage_timer, log_id, current_time,
+                      log_metrics) -> Answer:
+    answer = copy.deepcopy(cached_answer)
+    answer.query = search_box
+    answer.stage_timings = stage_timer.get_timings()
+    LogManagement.add_log_to_database(log_id=log_id, profile_name=selected_profile, sql=answer.sql_search_result.sql,
+                                      query=search_box, intent=answer.query_intent, log_info="answer cache hit",
+                                      time_str=current_time, **log_metrics)
+    return answer
+
+
+def get_intent(router: ModelRouter, database_profile, search_box, stage_timer: StageTimer = None) -> dict:
+    """Intent of the question from the profile's local classifier, or from the LLM when the classifier is not sure"""
+    stage_timer = stage_timer or StageTimer()
+    intent_response = stage_timer.run('intent_classifier', classify_intent, database_profile, search_box)
+    if intent_response is not None:
+        router.record('intent', LOCAL_INTENT_MODEL)
+        return intent_response
+    return stage_timer.run('intent', router.run, 'intent', get_query_intent, search_box,
+                           database_profile['prompt_map'], accept=is_usable_intent)
+
+
+def get_log_metrics(stage_timer: StageTimer, usage, router: ModelRouter, rows=0, cache_hits=None,
+                    question_row=True) -> dict:
+    """question_row is false for the extra log rows of one question, they only carry their own rows and cache hits"""
+    metrics = {'model_id': router.default_model_id, 'rows': rows, 'cache_hits': cache_hits or {},
+               'question_row': question_row}
+    if question_row:
+        metrics.update({
+            'stage_models': router.get_report(),
+            'stage_timings': stage_timer.get_timings(),
+            'model_ids': list(usage['model_ids']),
+            'input_tokens': usage['input_tokens'],
+            'output_tokens': usage['output_tokens'],
+            'model_tokens': {model_id: dict(tokens) for model_id, tokens in usage['model_tokens'].items()},
+        })
+    return metrics
+
+
+def execute_agent_sub_task(database_profile, router: ModelRouter, agent_sub_task):
+    each_task_res = get_sql_result_tool(database_profile, agent_sub_task["sql"])
+    each_task_visualization = None
+    if each_task_res["status_code"] == 200 and len(each_task_res["data"]) > 0:
+        each_task_visualization = router.run('data_visualization', data_visualization, agent_sub_task["query"],
+                                             each_task_res["data"], database_profile['prompt_map'],
+                                             accept=is_usable_visualization)
+    return each_task_res, each_task_visualization
+
+
+def get_suggested_question_list(suggested_question_future) -> list[str]:
+    if suggested_question_future is None:
+        return []
+    try:
+        generated_sq = suggested_question_future.result()
+    except Exception as e:
+        logger.error(f"generate suggested question is error: {e}")
+        return []
+    split_strings = generated_sq.split("[generate]")
+    return [s.strip() for s in split_strings if s.strip()]
+
+
 def user_feedback_upvote(data_profiles: str, query: str, query_intent: str, query_answer):
     try:
         if query_intent == "normal_search":
@@ -442,6 +673,6 @@ def explain_with_response_stream(current_nlq_chain: NLQChain) -> dict:
 
 
 def get_executed_result(current_nlq_chain: NLQChain) -> str:
-    sql_query_result = current_nlq_chain.get_executed_result_df(all_profiles[current_nlq_chain.profile])
+    sql_query_result = current_nlq_chain.get_executed_result_df(get_database_profile(current_nlq_chain.profile))
     final_sql_query_result = sql_query_result.to_markdown()
     return final_sql_query_result
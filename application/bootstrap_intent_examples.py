@@ -0,0 +1,82 @@
+import argparse
+import logging
+from collections import Counter
+
+from dotenv import load_dotenv
+
+from nlq.business.profile import ProfileManagement
+from nlq.data_access.dynamo_query_log import DynamoQueryLogDao
+from utils.cache import AnswerCache
+from utils.constant import QUERY_INTENTS, LOCAL_INTENT_MODEL, AGENT_SUB_TASK_MARKER
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+
+def collect_intent_examples(logs, max_per_intent=200):
+    """
+    Labelled questions per profile from the query logs: the intent the LLM gave most often to each question.
+    Intents answered by the local classifier are skipped so it is not trained on its own answers.
+    """
+    labels = {}
+    for item in logs:
+        question = item.get('query') or ''
+        if item.get('intent') not in QUERY_INTENTS or not question or AGENT_SUB_TASK_MARKER in question:
+            continue
+        if item.get('stage_models', {}).get('intent') == LOCAL_INTENT_MODEL:
+            continue
+        questions = labels.setdefault(item['profile_name'], {})
+        key = AnswerCache.normalize_query(question)
+        questions.setdefault(key, (question, Counter()))[1][item['intent']] += 1
+
+    examples = {}
+    for profile_name, questions in labels.items():
+        per_intent = Counter()
+        profile_examples = []
+        # questions asked most often first, they matter most for the cap per intent
+        for question, intents in sorted(questions.values(), key=lambda item: -sum(item[1].values())):
+            intent = intents.most_common(1)[0][0]
+            if per_intent[intent] < max_per_intent:
+                per_intent[intent] += 1
+                profile_examples.append({'question': question, 'intent': intent})
+        examples[profile_name] = profile_examples
+    return examples
+
+
+def merge_examples(existing_examples, new_examples):
+    """Existing labels win, they may have been corrected by hand"""
+    merged = {AnswerCache.normalize_query(example['question']): example for example in new_examples}
+    merged.update({AnswerCache.normalize_query(example['question']): example for example in existing_examples})
+    return list(merged.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the labelled questions of the local intent classifier from '
+                                                 'the query logs')
+    parser.add_argument('--profile', action='append', help='profile to update, may be repeated, default all')
+    parser.add_argument('--max-per-intent', type=int, default=200, help='labelled questions kept per intent')
+    parser.add_argument('--replace', action='store_true', help='replace the existing examples instead of merging')
+    parser.add_argument('--dry-run', action='store_true', help='only print what would be stored')
+    parser.add_argument('--table-prefix', default='', help='prefix of the NlqQueryLogging table')
+    args = parser.parse_args()
+
+    examples = collect_intent_examples(DynamoQueryLogDao(args.table_prefix).iter_logs(), args.max_per_intent)
+    for profile_name, profile_examples in sorted(examples.items()):
+        if args.profile and profile_name not in args.profile:
+            continue
+        profile = ProfileManagement.get_profile_by_name(profile_name)
+        if profile is None:
+            print(f'{profile_name}: profile not found, skipped')
+            continue
+        if not args.replace:
+            profile_examples = merge_examples(profile.intent_examples or [], profile_examples)
+        counts = Counter(example['intent'] for example in profile_examples)
+        print(f'{profile_name}: {len(profile_examples)} examples '
+              f'({", ".join(f"{intent} {counts[intent]}" for intent in QUERY_INTENTS)})')
+        if not args.dry_run:
+            ProfileManagement.update_intent_examples(profile_name, profile_examples)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import argparse
+import logging
+
+from dotenv import load_dotenv
+
+from nlq.data_access.dynamo_connection import ConnectConfigDao
+from nlq.data_access.dynamo_profile import ProfileConfigDao
+from nlq.data_access.dynamo_query_log import DynamoQueryLogDao
+from nlq.data_access.dynamo_suggested_question import SuggestedQuestionDao
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+TABLE_DAOS = [ConnectConfigDao, ProfileConfigDao, DynamoQueryLogDao, SuggestedQuestionDao]
+
+
+def bootstrap_tables(table_name_prefix=''):
+    """Create the DynamoDB tables the application needs, existing tables are left untouched"""
+    for dao_class in TABLE_DAOS:
+        dao = dao_class(table_name_prefix)
+        if dao.exists():
+            print(f'table {dao.table_name} already exists')
+        else:
+            dao.create_table()
+            print(f'table {dao.table_name} created')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create the DynamoDB tables of the application')
+    parser.add_argument('--table-prefix', default='', help='prefix of the table names')
+    args = parser.parse_args()
+    bootstrap_tables(args.table_prefix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import subprocess
+import sys
+
+DEFAULT_MODULES = ['main', 'utils.llm', 'nlq.business.profile']
+
+
+def measure_import(module):
+    """
+    Import the module in a fresh interpreter with -X importtime.
+    Returns (total_ms, [(package, cumulative_ms)]) for the modules imported directly at the top level.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'importing {module} failed:\n{result.stderr[-2000:]}')
+    top_level = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # nested imports are indented under the module that imported them
+        if not name[1:].startswith(' '):
+            top_level.append((name.strip(), int(cumulative) / 1000))
+    return sum(ms for _, ms in top_level), top_level
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report how long importing the application modules takes')
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help='modules to import')
+    parser.add_argument('--top', type=int, default=15, help='number of slowest packages to list per module')
+    parser.add_argument('--budget-ms', type=float, default=0,
+                        help='exit with an error when a module takes longer to import, 0 disables the check')
+    args = parser.parse_args()
+
+    over_budget = []
+    for module in args.modules:
+        total_ms, top_level = measure_import(module)
+        print(f'\n{module}: {total_ms:.0f} ms')
+        for name, ms in sorted(top_level, key=lambda item: item[1], reverse=True)[:args.top]:
+            print(f'  {ms:8.1f} ms  {name}')
+        if args.budget_ms and total_ms > args.budget_ms:
+            over_budget.append(module)
+    if over_budget:
+        print(f'\nover the {args.budget_ms:.0f} ms budget: {", ".join(over_budget)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
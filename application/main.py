@@ -1,3 +1,8 @@
+import logging
+import time
+
+started_at = time.perf_counter()
+
 from fastapi import FastAPI, status
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse
@@ -5,7 +10,11 @@ from api.exception_handler import biz_exception
 from api.main import router
 from fastapi.middleware.cors import CORSMiddleware
 from api import service
+from nlq.business.log_store import LogManagement
 from api.schemas import Option
+from utils.lazy import get_initialization_report
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title='GenBI')
 
@@ -23,6 +32,19 @@ biz_exception(app)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.include_router(router)
 
+
+@app.on_event("startup")
+def report_startup():
+    # DAOs and clients are built on first use, requests pay for those not listed here
+    logger.info(f'API started in {int((time.perf_counter() - started_at) * 1000)} ms, '
+                f'initialized: {get_initialization_report()}')
+
+
+@app.on_event("shutdown")
+def flush_query_logs():
+    LogManagement.flush()
+
+
 @app.get("/", status_code=status.HTTP_302_FOUND)
 def index():
     return RedirectResponse("static/WebSocket.html")
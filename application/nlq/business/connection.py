@@ -1,17 +1,24 @@
 import logging
 from nlq.data_access.dynamo_connection import ConnectConfigDao, ConnectConfigEntity
 from nlq.data_access.database import RelationDatabase
+from utils.cache import LRUCache
+from utils.database import get_db_url_dialect
+from utils.domain import ResolvedConnection
+from utils.env_var import CONNECTION_CACHE_TTL
+from utils.lazy import LazySingleton
 
 logger = logging.getLogger(__name__)
 
 
 class ConnectionManagement:
-    connection_config_dao = ConnectConfigDao()
+    connection_config_dao = LazySingleton(ConnectConfigDao)
+    # connection name -> ResolvedConnection, the TTL picks up changes made by other processes
+    resolved_connections = LRUCache(max_size=256, ttl=CONNECTION_CACHE_TTL)
 
     @classmethod
     def get_all_connections(cls):
         logger.info('get all connections...')
-        return [conn.conn_name for conn in cls.connection_config_dao.get_db_list()]
+        return cls.connection_config_dao.get_conn_names()
 
     @classmethod
     def add_connection(cls, conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name, comment):
@@ -24,17 +31,27 @@ class ConnectionManagement:
 
     @classmethod
     def update_connection(cls, conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name, comment):
+        old_conn_config = cls.get_conn_config_by_name(conn_name)
         cls.connection_config_dao.update_db_info(conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name,
                                                  comment)
+        cls.evict_engine(old_conn_config)
         logger.info(f"Connection {conn_name} updated")
 
     @classmethod
     def delete_connection(cls, conn_name):
+        old_conn_config = cls.get_conn_config_by_name(conn_name)
         if cls.connection_config_dao.delete(conn_name):
+            cls.evict_engine(old_conn_config)
             logger.info(f"Connection {conn_name} deleted")
         else:
             logger.warning(f"Failed to delete Connection {conn_name}")
 
+    @classmethod
+    def evict_engine(cls, conn_config: ConnectConfigEntity):
+        if conn_config is not None:
+            cls.resolved_connections.delete(conn_config.conn_name)
+            RelationDatabase.dispose_engine(RelationDatabase.get_db_url_by_connection(conn_config))
+
     @classmethod
     def get_table_name_by_config(cls, conn_config: ConnectConfigEntity, schema_names):
         return RelationDatabase.get_all_tables_by_connection(conn_config, schema_names)
@@ -47,12 +64,24 @@ class ConnectionManagement:
     def get_table_definition_by_config(cls, conn_config: ConnectConfigEntity, schema_names, table_names):
         return RelationDatabase.get_table_definition_by_connection(conn_config, schema_names, table_names)
 
+    @classmethod
+    def get_resolved_connection(cls, conn_name) -> ResolvedConnection:
+        resolved_connection = cls.resolved_connections.get(conn_name)
+        if resolved_connection is None:
+            conn_config = cls.get_conn_config_by_name(conn_name)
+            if conn_config is None:
+                raise ValueError(f"{conn_name} not found")
+            db_url = RelationDatabase.get_db_url_by_connection(conn_config)
+            resolved_connection = ResolvedConnection(conn_name=conn_name, db_url=db_url, db_type=conn_config.db_type,
+                                                     dialect=get_db_url_dialect(db_url),
+                                                     engine=RelationDatabase.get_engine(db_url))
+            cls.resolved_connections.set(conn_name, resolved_connection)
+        return resolved_connection
+
     @classmethod
     def get_db_url_by_name(cls, conn_name):
-        conn_config = cls.get_conn_config_by_name(conn_name)
-        return RelationDatabase.get_db_url_by_connection(conn_config)
+        return cls.get_resolved_connection(conn_name).db_url
 
     @classmethod
     def get_db_type_by_name(cls, conn_name):
-        conn_config = cls.get_conn_config_by_name(conn_name)
-        return conn_config.db_type
+        return cls.get_resolved_connection(conn_name).db_type
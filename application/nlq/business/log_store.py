@@ -0,0 +1,92 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from nlq.data_access.dynamo_helper import BATCH_WRITE_MAX_ITEMS
+from nlq.data_access.dynamo_query_log import DynamoQueryLogDao, DynamoQueryLog
+from utils.env_var import QUERY_LOG_QUEUE_SIZE, QUERY_LOG_FLUSH_INTERVAL
+from utils.lazy import LazySingleton
+
+logger = logging.getLogger(__name__)
+
+
+class LogManagement:
+    """
+    Query logs are queued in memory and written in batches by a background thread, so logging never blocks an answer.
+    When the queue is full new entries are dropped and counted.
+    """
+    query_log_dao = LazySingleton(DynamoQueryLogDao)
+    _queue = queue.Queue(maxsize=QUERY_LOG_QUEUE_SIZE)
+    _writer = None
+    _writer_lock = threading.Lock()
+    _stats = {'enqueued': 0, 'written': 0, 'dropped': 0, 'failed': 0}
+    _stats_lock = threading.Lock()
+
+    @classmethod
+    def add_log_to_database(cls, log_id, profile_name, sql, query, intent, log_info, time_str, **metrics):
+        """metrics are the optional DynamoQueryLog fields: model_id, stage_timings, model_ids, tokens, rows..."""
+        cls._start_writer()
+        try:
+            cls._queue.put_nowait(DynamoQueryLog(log_id, profile_name, sql, query, intent, log_info, time_str,
+                                                 **metrics))
+            cls._count('enqueued')
+        except queue.Full:
+            cls._count('dropped')
+            logger.warning(f'query log queue is full, log {log_id} dropped')
+
+    @classmethod
+    def _count(cls, stat, n=1):
+        # request threads and the writer thread count concurrently
+        with cls._stats_lock:
+            cls._stats[stat] += n
+
+    @classmethod
+    def _start_writer(cls):
+        if cls._writer is None:
+            with cls._writer_lock:
+                if cls._writer is None:
+                    cls._writer = threading.Thread(target=cls._write_logs, name='query-log-writer', daemon=True)
+                    cls._writer.start()
+
+    @classmethod
+    def _write_logs(cls):
+        while True:
+            batch = [cls._queue.get()]
+            deadline = time.monotonic() + QUERY_LOG_FLUSH_INTERVAL
+            while len(batch) < BATCH_WRITE_MAX_ITEMS:
+                try:
+                    batch.append(cls._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                cls.query_log_dao.add_batch(batch)
+                cls._count('written', len(batch))
+            except Exception as e:
+                cls._count('failed', len(batch))
+                logger.error(f'write query logs is error: {e}')
+            finally:
+                for _ in batch:
+                    cls._queue.task_done()
+
+    @classmethod
+    def flush(cls, timeout=10):
+        """Wait up to timeout seconds for the queued logs to be written, returns whether the queue drained"""
+        deadline = time.monotonic() + timeout
+        while cls._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if cls._queue.unfinished_tasks:
+            logger.warning(f'{cls._queue.unfinished_tasks} query logs not written before shutdown')
+            return False
+        return True
+
+    @classmethod
+    def get_stats(cls):
+        with cls._stats_lock:
+            stats = dict(cls._stats)
+        stats['queued'] = cls._queue.qsize()
+        return stats
+
+
+atexit.register(LogManagement.flush)
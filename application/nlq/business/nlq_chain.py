@@ -1,4 +1,3 @@
-import pandas as pd
 import re
 import logging
 from nlq.business.connection import ConnectionManagement
@@ -12,7 +11,7 @@ class NLQChain:
         self.profile = profile
         self.retrieve_samples = []
         self.generated_sql_response = ''
-        self.executed_result_df: pd.DataFrame | None = None
+        self.executed_result_df = None
         self.visualization_config_change: bool = False
         self.sql = ''
 
@@ -72,10 +71,13 @@ class NLQChain:
                 db_url = ConnectionManagement.get_db_url_by_name(conn_name)
             sql = self.get_generated_sql()
             if sql == "":
+                import pandas as pd
                 return pd.DataFrame()
             self.executed_result_df = query_from_sql_pd(
                 p_db_url=db_url,
-                query=self.get_generated_sql())
+                query=self.get_generated_sql(),
+                cache_ttl=profile.get('result_cache_ttl'),
+                sql_guard=profile.get('sql_guard'))
 
         return self.executed_result_df
 
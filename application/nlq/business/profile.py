@@ -1,38 +1,117 @@
 import logging
+import threading
+import time
 from nlq.data_access.dynamo_profile import ProfileConfigDao, ProfileConfigEntity
+from utils.lazy import LazySingleton
+from utils.env_var import PROFILE_CACHE_REFRESH_INTERVAL
+from utils.tool import get_profile_fingerprint
 
 logger = logging.getLogger(__name__)
 
 class ProfileManagement:
-    profile_config_dao = ProfileConfigDao()
+    profile_config_dao = LazySingleton(ProfileConfigDao)
+    # profile name -> profile info as returned by get_profile_info, with its updated_at version
+    _profile_cache = {}
+    _profile_versions = {}
+    _profile_cache_loaded_at = 0
+    _profile_cache_lock = threading.Lock()
 
     @classmethod
     def get_all_profiles(cls):
         logger.info('get all profiles...')
-        return [conn.profile_name for conn in cls.profile_config_dao.get_profile_list()]
+        return cls.profile_config_dao.get_profile_names()
 
     @classmethod
     def get_all_profiles_with_info(cls):
         logger.info('get all profiles with info...')
-        profile_list = cls.profile_config_dao.get_profile_list()
-        profile_map = {}
-        for profile in profile_list:
-            profile_map[profile.profile_name] = {
-                'db_url': '',
-                'conn_name': profile.conn_name,
-                'tables_info': profile.tables_info,
-                'hints': '',
-                'search_samples': [],
-                'comments':  profile.comments,
-                'prompt_map': profile.prompt_map
-            }
-
-        return profile_map
+        cls._check_profile_cache()
+        return {profile_name: dict(profile) for profile_name, profile in cls._profile_cache.items()}
 
     @classmethod
-    def add_profile(cls, profile_name, conn_name, schemas, tables, comment):
-        entity = ProfileConfigEntity(profile_name, conn_name, schemas, tables, comment)
+    def get_profile_info(cls, profile_name):
+        """
+        Profile info of one profile from the in-memory cache, None if it does not exist.
+        The result is a shallow copy: callers may set top level keys but must not modify nested values.
+        """
+        cls._check_profile_cache()
+        profile = cls._profile_cache.get(profile_name)
+        if profile is None:
+            # created by another process since the last refresh
+            entity = cls.profile_config_dao.get_by_name(profile_name)
+            if entity is None:
+                return None
+            profile = cls._cache_profile(entity)
+        return dict(profile)
+
+    @classmethod
+    def _to_profile_info(cls, entity):
+        profile = {
+            'db_url': '',
+            'conn_name': entity.conn_name,
+            'tables_info': entity.tables_info,
+            'hints': '',
+            'search_samples': [],
+            'comments': entity.comments,
+            'prompt_map': entity.prompt_map,
+            'result_cache_ttl': entity.result_cache_ttl,
+            'sql_guard': entity.sql_guard,
+            'model_routing': entity.model_routing,
+            'intent_examples': entity.intent_examples or [],
+            'updated_at': entity.updated_at
+        }
+        profile['fingerprint'] = get_profile_fingerprint(profile)
+        return profile
+
+    @classmethod
+    def _cache_profile(cls, entity):
+        profile = cls._to_profile_info(entity)
+        with cls._profile_cache_lock:
+            cls._profile_cache[entity.profile_name] = profile
+            cls._profile_versions[entity.profile_name] = entity.updated_at
+        return profile
+
+    @classmethod
+    def _check_profile_cache(cls):
+        if not cls._profile_cache_loaded_at:
+            cls.refresh_profile_cache()
+        elif time.time() - cls._profile_cache_loaded_at > PROFILE_CACHE_REFRESH_INTERVAL:
+            # serve the cached profiles while checking for changes in the background
+            cls._profile_cache_loaded_at = time.time()
+            threading.Thread(target=cls.refresh_profile_cache, name='profile-cache-refresh', daemon=True).start()
+
+    @classmethod
+    def refresh_profile_cache(cls):
+        """Reload the profiles whose updated_at changed, the first call loads all of them with a single scan"""
+        try:
+            if not cls._profile_cache_loaded_at:
+                for entity in cls.profile_config_dao.iter_profiles():
+                    cls._cache_profile(entity)
+            else:
+                versions = cls.profile_config_dao.get_profile_versions()
+                changed_profile_names = [profile_name for profile_name, updated_at in versions.items()
+                                         if profile_name not in cls._profile_cache
+                                         or cls._profile_versions.get(profile_name) != updated_at]
+                for entity in cls.profile_config_dao.get_by_names(changed_profile_names):
+                    cls._cache_profile(entity)
+                    logger.info(f'profile {entity.profile_name} reloaded')
+                for profile_name in set(cls._profile_cache) - set(versions):
+                    cls.invalidate_profile(profile_name)
+            cls._profile_cache_loaded_at = time.time()
+        except Exception as e:
+            logger.error(f'refresh profile cache is error: {e}')
+
+    @classmethod
+    def invalidate_profile(cls, profile_name):
+        with cls._profile_cache_lock:
+            cls._profile_cache.pop(profile_name, None)
+            cls._profile_versions.pop(profile_name, None)
+
+    @classmethod
+    def add_profile(cls, profile_name, conn_name, schemas, tables, comment, result_cache_ttl=None):
+        entity = ProfileConfigEntity(profile_name, conn_name, schemas, tables, comment,
+                                     result_cache_ttl=result_cache_ttl)
         cls.profile_config_dao.add(entity)
+        cls.invalidate_profile(profile_name)
         logger.info(f"Profile {profile_name} added")
 
     @classmethod
@@ -40,14 +119,19 @@ class ProfileManagement:
         return cls.profile_config_dao.get_by_name(profile_name)
 
     @classmethod
-    def update_profile(cls, profile_name, conn_name, schemas, tables, comment, tables_info):
-        entity = ProfileConfigEntity(profile_name, conn_name, schemas, tables, comment, tables_info)
+    def update_profile(cls, profile_name, conn_name, schemas, tables, comment, tables_info, result_cache_ttl=None,
+                       sql_guard=None, model_routing=None, intent_examples=None):
+        entity = ProfileConfigEntity(profile_name, conn_name, schemas, tables, comment, tables_info,
+                                     result_cache_ttl=result_cache_ttl, sql_guard=sql_guard,
+                                     model_routing=model_routing, intent_examples=intent_examples)
         cls.profile_config_dao.update(entity)
+        cls.invalidate_profile(profile_name)
         logger.info(f"Profile {profile_name} updated")
 
     @classmethod
     def delete_profile(cls, profile_name):
         cls.profile_config_dao.delete(profile_name)
+        cls.invalidate_profile(profile_name)
         logger.info(f"Profile {profile_name} updated")
 
     @classmethod
@@ -66,9 +150,17 @@ class ProfileManagement:
                 logger.info('tables info merged', tables_info)
 
         cls.profile_config_dao.update_table_def(profile_name, tables_info)
+        cls.invalidate_profile(profile_name)
         logger.info(f"Table definition updated")
 
+    @classmethod
+    def update_intent_examples(cls, profile_name, intent_examples):
+        cls.profile_config_dao.update_intent_examples(profile_name, intent_examples)
+        cls.invalidate_profile(profile_name)
+        logger.info(f"{len(intent_examples)} intent examples of profile {profile_name} updated")
+
     @classmethod
     def update_table_prompt_map(cls, profile_name, prompt_map):
         cls.profile_config_dao.update_table_prompt_map(profile_name, prompt_map)
+        cls.invalidate_profile(profile_name)
         logger.info(f"System and user prompt updated")
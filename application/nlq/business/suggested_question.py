@@ -2,11 +2,12 @@ import logging
 from nlq.data_access.dynamo_suggested_question import SuggestedQuestionDao, SuggestedQuestionEntity
 from datetime import datetime, timezone
 from utils.constant import PROFILE_QUESTION_TABLE_NAME, ACTIVE_PROMPT_NAME, DEFAULT_PROMPT_NAME
+from utils.lazy import LazySingleton
 
 logger = logging.getLogger(__name__)
 
 class SuggestedQuestionManagement:
-    sq_dao = SuggestedQuestionDao()
+    sq_dao = LazySingleton(SuggestedQuestionDao)
 
     @classmethod
     def get_prompt_by_name(cls, prompt_name: str):
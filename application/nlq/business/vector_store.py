@@ -1,15 +1,17 @@
 import logging 
 import os
-import boto3
 import json
 from nlq.data_access.opensearch import OpenSearchDao
-from utils.env_var import BEDROCK_REGION, AOS_HOST, AOS_PORT, AOS_USER, AOS_PASSWORD
+from utils.llm import embedding_cache
+from utils.env_var import AOS_HOST, AOS_PORT, AOS_USER, AOS_PASSWORD
+from utils.lazy import LazySingleton
+from utils.model_adapter import get_bedrock_client
 
 logger = logging.getLogger(__name__)
 
 class VectorStore:
-    opensearch_dao = OpenSearchDao(AOS_HOST, AOS_PORT, AOS_USER, AOS_PASSWORD)
-    bedrock_client = boto3.client("bedrock-runtime", region_name=BEDROCK_REGION)
+    opensearch_dao = LazySingleton(lambda: OpenSearchDao(AOS_HOST, AOS_PORT, AOS_USER, AOS_PASSWORD), 'OpenSearchDao')
+    bedrock_client = LazySingleton(get_bedrock_client, 'bedrock runtime client')
 
     @classmethod
     def get_all_samples(cls, profile_name):
@@ -85,9 +87,14 @@ class VectorStore:
 
     @classmethod
     def create_vector_embedding_with_bedrock(cls, text):
+        modelId = "amazon.titan-embed-text-v1"
+        return embedding_cache.get_or_create(modelId, text,
+                                             lambda: cls.invoke_bedrock_embedding(text, modelId))
+
+    @classmethod
+    def invoke_bedrock_embedding(cls, text, modelId):
         payload = {"inputText": f"{text}"}
         body = json.dumps(payload)
-        modelId = "amazon.titan-embed-text-v1"
         accept = "application/json"
         contentType = "application/json"
 
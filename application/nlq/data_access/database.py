@@ -1,8 +1,10 @@
 import logging
+import threading
 import sqlalchemy as db
 from sqlalchemy import text, Column, inspect
 
 from nlq.data_access.dynamo_connection import ConnectConfigEntity
+from utils.env_var import SQL_POOL_SIZE, SQL_MAX_OVERFLOW, SQL_POOL_RECYCLE, SQL_POOL_PRE_PING
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +15,47 @@ class RelationDatabase():
         'redshift': 'postgresql+psycopg2'
         # Add more mappings here for other databases
     }
+    # process-wide engines keyed by resolved db url, so every request reuses the same connection pool
+    _engines = {}
+    _engine_lock = threading.Lock()
+
+    @classmethod
+    def get_engine(cls, db_url):
+        engine = cls._engines.get(db_url)
+        if engine is None:
+            with cls._engine_lock:
+                engine = cls._engines.get(db_url)
+                if engine is None:
+                    engine = db.create_engine(db_url,
+                                              pool_size=SQL_POOL_SIZE,
+                                              max_overflow=SQL_MAX_OVERFLOW,
+                                              pool_recycle=SQL_POOL_RECYCLE,
+                                              pool_pre_ping=SQL_POOL_PRE_PING)
+                    cls._engines[db_url] = engine
+                    logger.info(f'created engine for {engine.url!r}')
+        return engine
+
+    @classmethod
+    def dispose_engine(cls, db_url):
+        with cls._engine_lock:
+            engine = cls._engines.pop(db_url, None)
+        if engine is not None:
+            engine.dispose()
+            logger.info(f'disposed engine for {engine.url!r}')
+
+    @classmethod
+    def get_engine_pool_status(cls):
+        status = {}
+        for engine in list(cls._engines.values()):
+            pool = engine.pool
+            # the password is masked by repr(url)
+            status[repr(engine.url)] = {
+                'pool_size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow(),
+            }
+        return status
 
     @classmethod
     def get_db_url(cls, db_type, user, password, host, port, db_name):
@@ -22,8 +65,11 @@ class RelationDatabase():
     @classmethod
     def test_connection(cls, db_type, user, password, host, port, db_name) -> bool:
         try:
+            # use a throwaway engine, unverified credentials should not end up in the shared registry
             engine = db.create_engine(cls.get_db_url(db_type, user, password, host, port, db_name))
-            connection = engine.connect()
+            with engine.connect():
+                pass
+            engine.dispose()
             return True
         except Exception as e:
             logger.exception(e)
@@ -36,7 +82,7 @@ class RelationDatabase():
         if connection.db_type == 'postgresql':
             db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
                                     connection.db_port, connection.db_name)
-            engine = db.create_engine(db_url)
+            engine = cls.get_engine(db_url)
             with engine.connect() as conn:
                 query = text("""
                     SELECT nspname AS schema_name
@@ -52,7 +98,7 @@ class RelationDatabase():
         elif connection.db_type == 'redshift':
             db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
                                     connection.db_port, connection.db_name)
-            engine = db.create_engine(db_url)
+            engine = cls.get_engine(db_url)
             inspector = inspect(engine)
             schemas = inspector.get_schema_names()
         return schemas
@@ -68,7 +114,7 @@ class RelationDatabase():
     def get_metadata_by_connection(cls, connection, schemas):
         db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
                                 connection.db_port, connection.db_name)
-        engine = db.create_engine(db_url)
+        engine = cls.get_engine(db_url)
         # connection = engine.connect()
         metadata = db.MetaData()
         for s in schemas:
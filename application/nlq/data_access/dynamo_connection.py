@@ -3,6 +3,7 @@ import boto3
 import logging
 from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
+from nlq.data_access.dynamo_helper import scan_items
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -47,8 +48,9 @@ class ConnectConfigDao:
     def __init__(self, table_name_prefix=''):
         self.dynamodb = boto3.resource('dynamodb', region_name=DYNAMODB_AWS_REGION)
         self.table_name = table_name_prefix + CONNECT_CONFIG_TABLE_NAME
+        # tables are created by bootstrap_tables.py, not on first use
         if not self.exists():
-            self.create_table()
+            logger.warning(f"DynamoDB table {self.table_name} does not exist, run bootstrap_tables.py to create it")
         self.table = self.dynamodb.Table(self.table_name)
 
     def exists(self):
@@ -148,5 +150,7 @@ class ConnectConfigDao:
             raise ValueError(f"{conn_name} not found")
 
     def get_db_list(self):
-        response = self.table.scan()
-        return [ConnectConfigEntity(**item) for item in response['Items']]
+        return [ConnectConfigEntity(**item) for item in scan_items(self.table)]
+
+    def get_conn_names(self):
+        return [item['conn_name'] for item in scan_items(self.table, projection='conn_name')]
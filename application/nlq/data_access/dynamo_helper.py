@@ -0,0 +1,60 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# DynamoDB limit of keys per BatchGetItem request
+BATCH_GET_MAX_KEYS = 100
+
+
+def scan_items(table, projection=None, **kwargs):
+    """
+    Yield every item of a table, following LastEvaluatedKey across the 1 MB pages of a scan.
+    projection is a ProjectionExpression limiting the attributes read, e.g. 'profile_name'.
+    """
+    if projection:
+        kwargs['ProjectionExpression'] = projection
+    while True:
+        response = table.scan(**kwargs)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def batch_get_items(dynamodb, table_name, key_name, keys, projection=None, max_retries=5):
+    """Yield the items of the given hash keys, in batches of 100 and retrying unprocessed keys with backoff"""
+    keys = list(dict.fromkeys(keys))
+    for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+        request = {'Keys': [{key_name: key} for key in keys[start:start + BATCH_GET_MAX_KEYS]]}
+        if projection:
+            request['ProjectionExpression'] = projection
+        request_items = {table_name: request}
+        for attempt in range(max_retries + 1):
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            yield from response['Responses'].get(table_name, [])
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                break
+            if attempt == max_retries:
+                raise RuntimeError(f'{table_name}: keys still unprocessed after {max_retries} retries')
+            time.sleep(min(0.05 * 2 ** attempt, 2))
+
+
+# DynamoDB limit of put / delete requests per BatchWriteItem request
+BATCH_WRITE_MAX_ITEMS = 25
+
+
+def batch_write_items(dynamodb, table_name, items, max_retries=5):
+    """Put items in batches of 25, retrying unprocessed items with exponential backoff"""
+    for start in range(0, len(items), BATCH_WRITE_MAX_ITEMS):
+        request_items = {table_name: [{'PutRequest': {'Item': item}}
+                                      for item in items[start:start + BATCH_WRITE_MAX_ITEMS]]}
+        for attempt in range(max_retries + 1):
+            response = dynamodb.batch_write_item(RequestItems=request_items)
+            request_items = response.get('UnprocessedItems')
+            if not request_items:
+                break
+            if attempt == max_retries:
+                raise RuntimeError(f'{table_name}: items still unprocessed after {max_retries} retries')
+            time.sleep(min(0.05 * 2 ** attempt, 2))
@@ -1,8 +1,10 @@
 import boto3
 import logging
+from datetime import datetime, timezone
 from typing import List
 from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
+from nlq.data_access.dynamo_helper import scan_items, batch_get_items
 from utils.prompts.generate_prompt import prompt_map_dict
 
 logger = logging.getLogger(__name__)
@@ -11,10 +13,16 @@ logger = logging.getLogger(__name__)
 PROFILE_CONFIG_TABLE_NAME = 'NlqProfileConfig'
 
 
+def get_updated_at():
+    return datetime.now(timezone.utc).isoformat()
+
+
 class ProfileConfigEntity:
 
     def __init__(self, profile_name: str, conn_name: str, schemas: List[str], tables: List[str], comments: str,
-                 tables_info: dict = None, prompt_map: dict = prompt_map_dict):
+                 tables_info: dict = None, prompt_map: dict = prompt_map_dict, result_cache_ttl: int = None,
+                 sql_guard: dict = None, updated_at: str = None, model_routing: dict = None,
+                 intent_examples: List[dict] = None):
         self.profile_name = profile_name
         self.conn_name = conn_name
         self.schemas = schemas
@@ -22,6 +30,16 @@ class ProfileConfigEntity:
         self.comments = comments
         self.tables_info = tables_info
         self.prompt_map = prompt_map
+        # seconds SQL results of this profile may be served from cache, None uses the global default
+        self.result_cache_ttl = int(result_cache_ttl) if result_cache_ttl is not None else None
+        # overrides of the generated sql guard: limit, explain, max_cost, max_scan_rows
+        self.sql_guard = sql_guard
+        # pipeline stage -> bedrock model id, overrides of the global MODEL_ROUTING
+        self.model_routing = model_routing
+        # labelled questions of the local intent classifier: [{'question': ..., 'intent': ...}]
+        self.intent_examples = intent_examples
+        # changes on every write, lets readers tell whether a cached copy is current
+        self.updated_at = updated_at
 
     def to_dict(self):
         """Convert to DynamoDB item format"""
@@ -35,6 +53,16 @@ class ProfileConfigEntity:
         }
         if self.tables_info:
             base_props['tables_info'] = self.tables_info
+        if self.result_cache_ttl is not None:
+            base_props['result_cache_ttl'] = self.result_cache_ttl
+        if self.sql_guard:
+            base_props['sql_guard'] = self.sql_guard
+        if self.model_routing:
+            base_props['model_routing'] = self.model_routing
+        if self.intent_examples:
+            base_props['intent_examples'] = self.intent_examples
+        if self.updated_at:
+            base_props['updated_at'] = self.updated_at
         return base_props
 
 
@@ -43,8 +71,9 @@ class ProfileConfigDao:
     def __init__(self, table_name_prefix=''):
         self.dynamodb = boto3.resource('dynamodb')
         self.table_name = table_name_prefix + PROFILE_CONFIG_TABLE_NAME
+        # tables are created by bootstrap_tables.py, not on first use
         if not self.exists():
-            self.create_table()
+            logger.warning(f"DynamoDB table {self.table_name} does not exist, run bootstrap_tables.py to create it")
         self.table = self.dynamodb.Table(self.table_name)
 
     def exists(self):
@@ -110,9 +139,11 @@ class ProfileConfigDao:
             return ProfileConfigEntity(**response['Item'])
 
     def add(self, entity):
+        entity.updated_at = get_updated_at()
         self.table.put_item(Item=entity.to_dict())
 
     def update(self, entity):
+        entity.updated_at = get_updated_at()
         self.table.put_item(Item=entity.to_dict())
 
     def delete(self, profile_name):
@@ -120,15 +151,50 @@ class ProfileConfigDao:
         return True
 
     def get_profile_list(self):
-        response = self.table.scan()
-        return [ProfileConfigEntity(**item) for item in response['Items']]
+        return list(self.iter_profiles())
+
+    def iter_profiles(self):
+        for item in scan_items(self.table):
+            yield ProfileConfigEntity(**item)
+
+    def get_profile_names(self):
+        return [item['profile_name'] for item in scan_items(self.table, projection='profile_name')]
+
+    def get_profile_versions(self):
+        """Map of profile name to updated_at, reading only those two attributes"""
+        return {item['profile_name']: item.get('updated_at')
+                for item in scan_items(self.table, projection='profile_name, updated_at')}
+
+    def get_by_names(self, profile_names):
+        return [ProfileConfigEntity(**item)
+                for item in batch_get_items(self.dynamodb, self.table_name, 'profile_name', profile_names)]
 
     def update_table_def(self, profile_name, tables_info):
         try:
             response = self.table.update_item(
                 Key={"profile_name": profile_name},
-                UpdateExpression="set tables_info=:info",
-                ExpressionAttributeValues={":info": tables_info},
+                UpdateExpression="set tables_info=:info, updated_at=:ts",
+                ExpressionAttributeValues={":info": tables_info, ":ts": get_updated_at()},
+                ReturnValues="UPDATED_NEW",
+            )
+        except ClientError as err:
+            logger.error(
+                "Couldn't update profile %s in table %s. Here's why: %s: %s",
+                profile_name,
+                self.table.name,
+                err.response["Error"]["Code"],
+                err.response["Error"]["Message"],
+            )
+            raise
+        else:
+            return response["Attributes"]
+
+    def update_intent_examples(self, profile_name, intent_examples):
+        try:
+            response = self.table.update_item(
+                Key={"profile_name": profile_name},
+                UpdateExpression="set intent_examples=:ie, updated_at=:ts",
+                ExpressionAttributeValues={":ie": intent_examples, ":ts": get_updated_at()},
                 ReturnValues="UPDATED_NEW",
             )
         except ClientError as err:
@@ -147,8 +213,8 @@ class ProfileConfigDao:
         try:
             response = self.table.update_item(
                 Key={"profile_name": profile_name},
-                UpdateExpression="set prompt_map=:pm",
-                ExpressionAttributeValues={":pm": prompt_map},
+                UpdateExpression="set prompt_map=:pm, updated_at=:ts",
+                ExpressionAttributeValues={":pm": prompt_map, ":ts": get_updated_at()},
                 ReturnValues="UPDATED_NEW",
             )
         except ClientError as err:
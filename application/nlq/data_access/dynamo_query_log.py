@@ -3,6 +3,7 @@ import os
 
 import boto3
 from botocore.exceptions import ClientError
+from nlq.data_access.dynamo_helper import batch_write_items, scan_items
 
 logger = logging.getLogger(__name__)
 
@@ -12,7 +13,9 @@ DYNAMODB_AWS_REGION = os.environ.get('DYNAMODB_AWS_REGION')
 
 
 class DynamoQueryLog:
-    def __init__(self, log_id, profile_name, sql, query, intent, log_info, time_str):
+    def __init__(self, log_id, profile_name, sql, query, intent, log_info, time_str, model_id=None,
+                 stage_timings=None, model_ids=None, input_tokens=0, output_tokens=0, rows=0, cache_hits=None,
+                 stage_models=None, model_tokens=None, question_row=True):
         self.log_id = log_id
         self.profile_name = profile_name
         self.sql = sql
@@ -20,6 +23,23 @@ class DynamoQueryLog:
         self.intent = intent
         self.log_info = log_info
         self.time_str = time_str
+        # the requested model, model_ids lists every bedrock model the question actually invoked
+        self.model_id = model_id
+        # stage name -> wall time in milliseconds, see utils.concurrency.StageTimer
+        self.stage_timings = stage_timings or {}
+        self.model_ids = model_ids or []
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.rows = rows
+        # e.g. {'answer_cache': 'exact', 'result_cache': True}
+        self.cache_hits = cache_hits or {}
+        # stage name -> model id that answered it, see utils.model_routing.ModelRouter
+        self.stage_models = stage_models or {}
+        # model id -> {'input_tokens': n, 'output_tokens': n}, priced by query_log_report.py
+        self.model_tokens = model_tokens or {}
+        # false on the sub task rows of an agent question after the first, the question level timings, tokens and
+        # models are only on the first one
+        self.question_row = question_row
 
     def to_dict(self):
         """Convert to DynamoDB item format"""
@@ -30,7 +50,17 @@ class DynamoQueryLog:
             'query': self.query,
             'intent': self.intent,
             'log_info': self.log_info,
-            'time_str': self.time_str
+            'time_str': self.time_str,
+            'model_id': self.model_id,
+            'stage_timings': self.stage_timings,
+            'model_ids': self.model_ids,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'rows': self.rows,
+            'cache_hits': self.cache_hits,
+            'stage_models': self.stage_models,
+            'model_tokens': self.model_tokens,
+            'question_row': self.question_row
         }
 
 
@@ -39,8 +69,9 @@ class DynamoQueryLogDao:
     def __init__(self, table_name_prefix=''):
         self.dynamodb = boto3.resource('dynamodb', region_name=DYNAMODB_AWS_REGION)
         self.table_name = table_name_prefix + QUERY_LOG_TABLE_NAME
+        # tables are created by bootstrap_tables.py, not on first use
         if not self.exists():
-            self.create_table()
+            logger.warning(f"DynamoDB table {self.table_name} does not exist, run bootstrap_tables.py to create it")
         self.table = self.dynamodb.Table(self.table_name)
 
     def exists(self):
@@ -104,3 +135,10 @@ class DynamoQueryLogDao:
 
     def update(self, entity):
         self.table.put_item(Item=entity.to_dict())
+
+    def iter_logs(self):
+        for item in scan_items(self.table):
+            yield item
+
+    def add_batch(self, entities):
+        batch_write_items(self.dynamodb, self.table_name, [entity.to_dict() for entity in entities])
@@ -28,8 +28,9 @@ class SuggestedQuestionDao:
     def __init__(self, table_name_prefix=''):
         self.dynamodb = boto3.resource('dynamodb')
         self.table_name = table_name_prefix + PROFILE_QUESTION_TABLE_NAME
+        # tables are created by bootstrap_tables.py, not on first use
         if not self.exists():
-            self.create_table()
+            logger.warning(f"DynamoDB table {self.table_name} does not exist, run bootstrap_tables.py to create it")
         self.table = self.dynamodb.Table(self.table_name)
 
     def exists(self):
@@ -2,7 +2,6 @@ import json
 import os
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 from dotenv import load_dotenv
 import logging
 import random
@@ -48,6 +47,9 @@ def clean_st_history(selected_profile):
 
 
 def do_visualize_results(nlq_chain, sql_result):
+    # plotly is only needed once there is something to chart
+    import plotly.express as px
+
     sql_query_result = sql_result
     if sql_query_result is not None:
         nlq_chain.set_visualization_config_change(False)
@@ -255,10 +257,10 @@ def main():
                 with st.spinner('Connecting to database...'):
                     # fix db url is Empty
                     if database_profile['db_url'] == '':
-                        conn_name = database_profile['conn_name']
-                        db_url = ConnectionManagement.get_db_url_by_name(conn_name)
-                        database_profile['db_url'] = db_url
-                        database_profile['db_type'] = ConnectionManagement.get_db_type_by_name(conn_name)
+                        resolved_connection = ConnectionManagement.get_resolved_connection(
+                            database_profile['conn_name'])
+                        database_profile['db_url'] = resolved_connection.db_url
+                        database_profile['db_type'] = resolved_connection.db_type
                     prompt_map = database_profile['prompt_map']
                 intent_response = {
                     "intent": "normal_search",
@@ -319,7 +321,8 @@ def main():
                                                                      selected_profile, 2, 0.5)
                         agent_cot_task_result = get_agent_cot_task(model_type, prompt_map, search_box,
                                                                    database_profile['tables_info'],
-                                                                   agent_cot_retrieve)
+                                                                   agent_cot_retrieve,
+                                                                   database_profile.get('fingerprint'))
                         with st.expander(f'Agent Query Retrieve : {len(agent_cot_retrieve)}'):
                             st.write(agent_cot_retrieve)
                         with st.expander(f'Agent Task : {len(agent_cot_task_result)}'):
@@ -401,6 +404,9 @@ def main():
                         with st.expander("The SQL Error Info"):
                             st.markdown(search_intent_result["error_info"])
                     else:
+                        if search_intent_result["truncated"]:
+                            st.warning(f'Only the first {len(search_intent_result["data"])} of '
+                                       f'{search_intent_result["total_rows"] or "more"} rows are shown.')
                         if search_intent_result["data"] is not None and len(search_intent_result["data"]) > 0:
                             with st.spinner('Generating data summarize...'):
                                 search_intent_analyse_result = data_analyse_tool(model_type, prompt_map, search_box,
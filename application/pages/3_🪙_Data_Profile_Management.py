@@ -4,7 +4,11 @@ from dotenv import load_dotenv
 import logging 
 from nlq.business.connection import ConnectionManagement
 from nlq.business.profile import ProfileManagement
+from utils.env_var import RESULT_CACHE_TTL
 from utils.navigation import make_sidebar
+from utils.sql_guard import get_guard_config
+from utils.constant import BEDROCK_MODEL_IDS
+from utils.model_routing import ROUTED_STAGES
 
 
 logger = logging.getLogger(__name__)
@@ -44,13 +48,16 @@ def main():
             print(tables_from_db)
             selected_tables = st.multiselect("Select tables included in this profile", tables_from_db)
             comments = st.text_input("Comments")
+            result_cache_ttl = st.number_input("Result cache TTL in seconds (0 disables caching)", min_value=0,
+                                               value=RESULT_CACHE_TTL, step=60)
 
             if st.button('Create Profile', type='primary'):
                 if not selected_tables:
                     st.error('Please select at least one table.')
                     return
                 with st.spinner('Creating profile...'):
-                    ProfileManagement.add_profile(profile_name, selected_conn_name, schema_names, selected_tables, comments)
+                    ProfileManagement.add_profile(profile_name, selected_conn_name, schema_names, selected_tables, comments,
+                                                  result_cache_ttl)
                     st.success('Profile created.')
                     st.session_state.profile_page_mode = 'default'
 
@@ -80,6 +87,30 @@ def main():
                                 "Example:\n"
                                 "Your sample question 1\n"
                                 "Your sample question 2")
+        result_cache_ttl = st.number_input("Result cache TTL in seconds (0 disables caching)", min_value=0,
+                                           value=current_profile.result_cache_ttl if current_profile.result_cache_ttl
+                                           is not None else RESULT_CACHE_TTL, step=60)
+        sql_guard = get_guard_config(current_profile.sql_guard)
+        with st.expander("SQL guard for generated queries"):
+            sql_guard['limit'] = st.number_input("Max rows (LIMIT injected into queries, 0 disables)", min_value=0,
+                                                 value=sql_guard['limit'])
+            sql_guard['explain'] = st.checkbox("Check EXPLAIN estimates before running queries",
+                                               value=sql_guard['explain'])
+            sql_guard['max_cost'] = st.number_input("Max estimated cost (0 is unlimited)", min_value=0,
+                                                    value=sql_guard['max_cost'])
+            sql_guard['max_scan_rows'] = st.number_input("Max estimated scanned rows (0 is unlimited)", min_value=0,
+                                                         value=sql_guard['max_scan_rows'])
+        model_routing = dict(current_profile.model_routing or {})
+        with st.expander("Model of each pipeline stage"):
+            model_options = [''] + BEDROCK_MODEL_IDS
+            for stage in ROUTED_STAGES:
+                current_model_id = model_routing.get(stage, '')
+                model_routing[stage] = st.selectbox(stage, model_options,
+                                                    index=model_options.index(current_model_id)
+                                                    if current_model_id in model_options else 0,
+                                                    format_func=lambda model_id: model_id or 'Model of the question',
+                                                    key=f'model_routing_{stage}')
+            model_routing = {stage: model_id for stage, model_id in model_routing.items() if model_id}
 
         if st.button('Update Profile', type='primary'):
             if not selected_tables:
@@ -88,7 +119,8 @@ def main():
             with st.spinner('Updating profile...'):
                 old_tables_info = ProfileManagement.get_profile_by_name(profile_name).tables_info
                 ProfileManagement.update_profile(profile_name, selected_conn_name, schema_names, selected_tables,
-                                                 comments, old_tables_info)
+                                                 comments, old_tables_info, result_cache_ttl, sql_guard,
+                                                 model_routing, current_profile.intent_examples)
                 st.success('Profile updated. Please click "Fetch table definition" button to continue.')
 
         if st.button('Fetch table definition'):
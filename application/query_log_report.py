@@ -0,0 +1,136 @@
+import argparse
+import logging
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from nlq.data_access.dynamo_query_log import DynamoQueryLogDao
+from utils.constant import LOCAL_INTENT_MODEL, AGENT_SUB_TASK_MARKER, BEDROCK_MODEL_PRICES
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+PERCENTILES = [0.5, 0.95, 0.99]
+# metrics of the whole question, only counted once per question
+QUESTION_COLUMNS = ['input_tokens', 'output_tokens', 'cost']
+NUMERIC_COLUMNS = QUESTION_COLUMNS + ['rows']
+
+
+def get_cost(item):
+    """USD of a logged question from its tokens per model, None when a model has no price or tokens are unknown"""
+    model_tokens = item.get('model_tokens')
+    if not model_tokens and len(item.get('model_ids', [])) == 1:
+        # logged before the tokens were split per model
+        model_tokens = {item['model_ids'][0]: {'input_tokens': item.get('input_tokens', 0),
+                                               'output_tokens': item.get('output_tokens', 0)}}
+    if not model_tokens or any(model_id not in BEDROCK_MODEL_PRICES for model_id in model_tokens):
+        return None
+    cost = 0
+    for model_id, tokens in model_tokens.items():
+        input_price, output_price = BEDROCK_MODEL_PRICES[model_id]
+        cost += (float(tokens['input_tokens']) * input_price + float(tokens['output_tokens']) * output_price) / 1000
+    return round(cost, 6)
+
+
+def mark_question_rows(logs):
+    """
+    Rows logged before question_row existed repeat the question's metrics on every agent sub task, the first row of
+    each question is kept as its question row
+    """
+    question = logs['query'].fillna('').str.split(AGENT_SUB_TASK_MARKER, regex=False).str[0]
+    first_rows = ~pd.DataFrame({'profile_name': logs['profile_name'], 'time_str': logs['time_str'],
+                                'question': question}).duplicated()
+    if 'question_row' not in logs.columns:
+        return first_rows
+    return logs['question_row'].where(logs['question_row'].notna(), first_rows).astype(bool)
+
+
+def load_query_logs(table_name_prefix=''):
+    """
+    Read the whole query log table into a flat DataFrame, one stage_<name>_ms column per pipeline stage.
+    question_row marks the one row per question whose timings, tokens and cost count.
+    """
+    records = []
+    for item in DynamoQueryLogDao(table_name_prefix).iter_logs():
+        record = {key: value for key, value in item.items()
+                  if key not in ('stage_timings', 'cache_hits', 'model_ids', 'stage_models', 'model_tokens')}
+        record['model_ids'] = ','.join(item.get('model_ids', []))
+        record['cost'] = get_cost(item)
+        for stage, elapsed_ms in item.get('stage_timings', {}).items():
+            record[f'stage_{stage}_ms'] = elapsed_ms
+        for cache, hit in item.get('cache_hits', {}).items():
+            record[f'{cache}_hit'] = str(hit)
+        for stage, model_id in item.get('stage_models', {}).items():
+            record[f'model_{stage}'] = model_id
+        records.append(record)
+    logs = pd.DataFrame(records)
+    if logs.empty:
+        return logs
+    logs['question_row'] = mark_question_rows(logs)
+    logs.loc[~logs['question_row'], 'cost'] = None
+    # DynamoDB returns numbers as Decimal
+    for column in NUMERIC_COLUMNS + [column for column in logs.columns if column.startswith('stage_')]:
+        if column in logs.columns:
+            logs[column] = pd.to_numeric(logs[column], errors='coerce')
+    return logs
+
+
+def get_percentiles(logs, group_by, columns):
+    percentiles = logs.groupby(group_by)[columns].quantile(PERCENTILES).unstack()
+    percentiles.columns = [f'{column}_p{int(q * 100)}' for column, q in percentiles.columns]
+    return percentiles
+
+
+def stage_percentiles(logs, group_by):
+    """
+    p50 / p95 / p99 of every stage duration, the token counts and the cost per question, and of the rows per log row,
+    per value of group_by
+    """
+    question_logs = logs[logs['question_row']]
+    question_columns = [column for column in logs.columns if column.startswith('stage_')] + QUESTION_COLUMNS
+    question_columns = [column for column in question_columns if column in logs.columns]
+    percentiles = get_percentiles(question_logs, group_by, question_columns)
+    if 'rows' in logs.columns:
+        percentiles = percentiles.join(get_percentiles(logs, group_by, ['rows']))
+    percentiles['questions'] = question_logs.groupby(group_by).size()
+    if 'cost' in logs.columns:
+        percentiles['cost_total'] = question_logs.groupby(group_by)['cost'].sum()
+    return percentiles
+
+
+def intent_sources(logs):
+    """Per profile, how many questions had their intent from the local classifier instead of the LLM"""
+    intent_logs = logs[logs['question_row'] & logs['model_intent'].notna()]
+    sources = intent_logs.groupby('profile_name')['model_intent'].agg(
+        questions='size', local=lambda models: int((models == LOCAL_INTENT_MODEL).sum()))
+    sources['llm_calls_avoided'] = (sources['local'] / sources['questions']).round(4)
+    return sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the query logs to Parquet and report stage percentiles')
+    parser.add_argument('--output', default='query_logs.parquet', help='path of the exported Parquet file')
+    parser.add_argument('--table-prefix', default='', help='prefix of the NlqQueryLogging table')
+    args = parser.parse_args()
+
+    logs = load_query_logs(args.table_prefix)
+    if logs.empty:
+        print('no query logs found')
+        return
+    logs.to_parquet(args.output, index=False)
+    print(f'{len(logs)} query logs exported to {args.output}')
+
+    pd.set_option('display.width', 200)
+    pd.set_option('display.max_columns', None)
+    for group_by in ['profile_name', 'model_id']:
+        if group_by in logs.columns:
+            print(f'\nPercentiles per {group_by}:')
+            print(stage_percentiles(logs, group_by).T.to_string())
+    if 'model_intent' in logs.columns:
+        print('\nIntent answered by the local classifier:')
+        print(intent_sources(logs).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,30 @@
-import sqlalchemy as db
+import io
+import json
 from sqlalchemy import text
-from utils.env_var import RDS_MYSQL_HOST, RDS_MYSQL_PORT, RDS_MYSQL_USERNAME, RDS_MYSQL_PASSWORD, RDS_MYSQL_DBNAME, RDS_PQ_SCHEMA
-import pandas as pd
 import logging
 import sqlparse
 from nlq.business.connection import ConnectionManagement
+from nlq.data_access.database import RelationDatabase
+from utils.cache import ResultCache
+from utils.database import get_resolved_db_url, get_db_url_dialect
+from utils.sql_guard import guard_sql, ALLOWED_QUERY_TYPES
+from utils.env_var import RESULT_CACHE_TTL, RESULT_CACHE_MEMORY_BYTES, RESULT_CACHE_SPILL_PATH, \
+    RESULT_CACHE_DISK_BYTES, SQL_RESULT_MAX_ROWS, SQL_RESULT_MAX_BYTES, SQL_FETCH_CHUNK_ROWS, SQL_RESULT_COUNT_TOTAL
 
 logger = logging.getLogger(__name__)
 
-ALLOWED_QUERY_TYPES = ['SELECT']
+# pandas is imported inside the functions that need it, it is the slowest import of the API process
+
+# result sets kept as parquet bytes, keyed by resolved database url and normalized sql
+result_cache = ResultCache(RESULT_CACHE_MEMORY_BYTES, RESULT_CACHE_SPILL_PATH, RESULT_CACHE_DISK_BYTES)
+
+
 def query_from_database(p_db_url: str, query, schema=None):
     """
     Query the database
     """
     try:
-        if '{RDS_MYSQL_USERNAME}' in p_db_url:
-            engine = db.create_engine(p_db_url.format(
-                RDS_MYSQL_HOST=RDS_MYSQL_HOST,
-                RDS_MYSQL_PORT=RDS_MYSQL_PORT,
-                RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
-                RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
-                RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
-            ))
-        else:
-            engine = db.create_engine(p_db_url)
+        engine = RelationDatabase.get_engine(get_resolved_db_url(p_db_url))
         with engine.connect() as connection:
             logger.info(f'{query=}')
             sanitized_query = sqlparse.format(query, strip_comments=True)
@@ -46,56 +47,122 @@ def query_from_database(p_db_url: str, query, schema=None):
     }
 
 
-def query_from_sql_pd(p_db_url: str, query, schema=None):
+def query_from_sql_pd(p_db_url: str, query, schema=None, cache_ttl=None, sql_guard=None):
     """
     Query the database
     """
-    if '{RDS_MYSQL_USERNAME}' in p_db_url:
-        engine = db.create_engine(p_db_url.format(
-            RDS_MYSQL_HOST=RDS_MYSQL_HOST,
-            RDS_MYSQL_PORT=RDS_MYSQL_PORT,
-            RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
-            RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
-            RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
-        ))
-    else:
-        engine = db.create_engine(p_db_url)
+    import pandas as pd
 
-    with engine.connect() as connection:
-        logger.info(f'{query=}')
-        res = pd.DataFrame()
+    res = pd.DataFrame()
+    try:
+        res, _, _, _ = read_sql_with_cache(p_db_url, query, cache_ttl, sql_guard)
+    except Exception as e:
+        logger.error("query_from_sql_pd is error")
+        logger.error(e)
+    return res
+
+
+def get_result_cache_key(db_url, sql):
+    normalized_sql = sqlparse.format(sql, strip_comments=True, strip_whitespace=True).strip().rstrip(';')
+    return ResultCache.make_key(db_url, normalized_sql)
+
+
+def read_sql_with_cache(p_db_url, sql, cache_ttl=None, sql_guard=None):
+    """
+    Execute the sql and return (DataFrame, truncated, total_rows, cache_hit), serving repeated queries from the
+    result cache.
+    cache_ttl is the freshness in seconds, None falls back to RESULT_CACHE_TTL and 0 always queries the database.
+    sql_guard holds the profile's overrides of the pre-execution guard settings.
+    """
+    import pandas as pd
+
+    db_url = get_resolved_db_url(p_db_url)
+    cache_ttl = RESULT_CACHE_TTL if cache_ttl is None else int(cache_ttl)
+    cache_key = get_result_cache_key(db_url, sql) if cache_ttl > 0 else None
+    if cache_key:
+        cached_result = result_cache.get(cache_key)
+        if cached_result is not None:
+            logger.info('sql result served from cache')
+            header, parquet_data = cached_result.split(b'\n', 1)
+            header = json.loads(header)
+            return pd.read_parquet(io.BytesIO(parquet_data)), header['truncated'], header['total_rows'], True
+
+    guarded_sql = guard_sql(RelationDatabase.get_engine(db_url), get_db_url_dialect(db_url), sql, sql_guard)
+    result_df, truncated, total_rows = fetch_sql_result(db_url, guarded_sql, count_sql=sql)
+    if cache_key:
         try:
-            res = pd.read_sql_query(text(query), connection)
+            header = json.dumps({'truncated': truncated, 'total_rows': total_rows}).encode('utf-8')
+            result_cache.set(cache_key, header + b'\n' + result_df.to_parquet(index=False), cache_ttl)
         except Exception as e:
-            logger.error("query_from_sql_pd is error")
-            logger.error(e)
-        return res
+            # e.g. duplicated column names cannot be stored as parquet
+            logger.warning(f'sql result not cached: {e}')
+    return result_df, truncated, total_rows, False
+
+
+def fetch_sql_result(db_url, sql, max_rows=SQL_RESULT_MAX_ROWS, max_bytes=SQL_RESULT_MAX_BYTES, count_sql=None):
+    """
+    Stream the result through a server side cursor in chunks and stop at max_rows rows or about max_bytes bytes,
+    so memory stays bounded whatever the query returns.
+    Returns (DataFrame, truncated, total_rows), total_rows is None when it could not be counted.
+    count_sql is the query to count when truncated, e.g. the one before a LIMIT was injected.
+    """
+    import pandas as pd
+
+    engine = RelationDatabase.get_engine(db_url)
+    chunks = []
+    row_count = 0
+    byte_count = 0
+    truncated = False
+    with engine.connect() as connection:
+        connection = connection.execution_options(stream_results=True)
+        logger.info(f'{sql=}')
+        for chunk in pd.read_sql_query(text(sql), connection, chunksize=SQL_FETCH_CHUNK_ROWS):
+            if row_count + len(chunk) > max_rows:
+                chunk = chunk.iloc[:max_rows - row_count]
+                truncated = True
+            chunks.append(chunk)
+            row_count += len(chunk)
+            byte_count += int(chunk.memory_usage(index=False, deep=True).sum())
+            if truncated or byte_count > max_bytes:
+                truncated = True
+                break
+        if truncated and get_db_url_dialect(db_url) == 'mysql':
+            # closing an unbuffered mysql cursor reads the remaining rows, drop the connection instead
+            connection.invalidate()
+    result_df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    total_rows = len(result_df)
+    if truncated:
+        total_rows = count_sql_rows(engine, count_sql or sql) if SQL_RESULT_COUNT_TOTAL else None
+        logger.warning(f'sql result truncated to {len(result_df)} rows, {total_rows=}')
+    return result_df, truncated, total_rows
+
+
+def count_sql_rows(engine, sql):
+    count_sql = f"SELECT COUNT(*) FROM ({sqlparse.format(sql, strip_comments=True).strip().rstrip(';')}) AS genbi_count"
+    try:
+        with engine.connect() as connection:
+            return connection.execute(text(count_sql)).scalar()
+    except Exception as e:
+        logger.warning(f'failed to count sql result rows: {e}')
+        return None
 
 
 def get_sql_result_tool(profile, sql):
-    result_dict = {"data": pd.DataFrame(), "sql": sql, "status_code": 200, "error_info": ""}
+    import pandas as pd
+
+    result_dict = {"data": pd.DataFrame(), "sql": sql, "status_code": 200, "error_info": "", "truncated": False,
+                   "total_rows": 0, "cache_hit": False}
     try:
         p_db_url = profile['db_url']
         if not p_db_url:
             conn_name = profile['conn_name']
             p_db_url = ConnectionManagement.get_db_url_by_name(conn_name)
 
-        if '{RDS_MYSQL_USERNAME}' in p_db_url:
-            engine = db.create_engine(p_db_url.format(
-                RDS_MYSQL_HOST=RDS_MYSQL_HOST,
-                RDS_MYSQL_PORT=RDS_MYSQL_PORT,
-                RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
-                RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
-                RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
-            ))
-        else:
-            engine = db.create_engine(p_db_url)
-        with engine.connect() as connection:
-            logger.info(f'{sql=}')
-            executed_result_df = pd.read_sql_query(text(sql), connection)
-            result_dict["data"] = executed_result_df
+        result_dict["data"], result_dict["truncated"], result_dict["total_rows"], result_dict["cache_hit"] = \
+            read_sql_with_cache(
+            p_db_url, sql, profile.get('result_cache_ttl'), profile.get('sql_guard'))
     except Exception as e:
         logger.error("get_sql_result is error: {}".format(e))
-        result_dict["error_info"] = e
+        result_dict["error_info"] = str(e)
         result_dict["status_code"] = 500
     return result_dict
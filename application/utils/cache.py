@@ -0,0 +1,371 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# numbers and quoted strings of a question, near-duplicates differing in them ask for different data
+LITERAL_PATTERN = re.compile(r"\d+(?:[.,]\d+)*|'[^']*'|\"[^\"]*\"")
+
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional TTL and hit/miss counters"""
+
+    def __init__(self, max_size=1024, ttl=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expire_at = item
+            if expire_at and expire_at < time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = time.time() + ttl if ttl else 0
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_stats(self):
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of embeddings keyed by (model id, normalized text).
+    The in-process LRU tier is always on; when a path is given, vectors are also kept in a memory-mapped
+    SQLite file so they survive restarts.
+    """
+
+    def __init__(self, max_size=2048, ttl=0, path=''):
+        self.ttl = ttl
+        self.memory = LRUCache(max_size, ttl)
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk = None
+        self._disk_lock = threading.Lock()
+        if path:
+            self.disk = sqlite3.connect(path, check_same_thread=False)
+            self.disk.execute('PRAGMA mmap_size=268435456')
+            self.disk.execute('PRAGMA journal_mode=WAL')
+            self.disk.execute('CREATE TABLE IF NOT EXISTS embedding '
+                              '(key TEXT PRIMARY KEY, vector BLOB NOT NULL, created REAL NOT NULL)')
+            self.disk.commit()
+            logger.info(f'embedding cache persisted to {path}')
+
+    @staticmethod
+    def make_key(model_id, text):
+        normalized_text = ' '.join(unicodedata.normalize('NFKC', str(text)).split())
+        return hashlib.sha256(f'{model_id}\n{normalized_text}'.encode('utf-8')).hexdigest()
+
+    def get(self, model_id, text):
+        key = self.make_key(model_id, text)
+        embedding = self.memory.get(key)
+        if embedding is not None:
+            return embedding
+        if self.disk is not None:
+            with self._disk_lock:
+                row = self.disk.execute('SELECT vector, created FROM embedding WHERE key = ?', (key,)).fetchone()
+            if row is not None and (not self.ttl or row[1] + self.ttl > time.time()):
+                embedding = array('d', row[0]).tolist()
+                self.memory.set(key, embedding)
+                self.disk_hits += 1
+                return embedding
+        self.misses += 1
+        return None
+
+    def set(self, model_id, text, embedding):
+        key = self.make_key(model_id, text)
+        self.memory.set(key, embedding)
+        if self.disk is not None:
+            with self._disk_lock:
+                self.disk.execute('INSERT OR REPLACE INTO embedding (key, vector, created) VALUES (?, ?, ?)',
+                                  (key, array('d', embedding).tobytes(), time.time()))
+                self.disk.commit()
+
+    def get_or_create(self, model_id, text, create_embedding):
+        embedding = self.get(model_id, text)
+        if embedding is None:
+            embedding = create_embedding()
+            if embedding:
+                self.set(model_id, text, embedding)
+        return embedding
+
+    def get_stats(self):
+        memory_stats = self.memory.get_stats()
+        return {
+            'size': memory_stats['size'],
+            'max_size': memory_stats['max_size'],
+            'memory_hits': memory_stats['hits'],
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'persistent': self.disk is not None,
+        }
+
+
+class AnswerCache:
+    """
+    Answers keyed by a scope (profile, model, flags) and the normalized question, with a near-duplicate tier that
+    matches question embeddings of the same scope above a similarity threshold.
+    Every entry remembers the profile fingerprint it was built from and is ignored once the profile changes.
+    Near-duplicates only match when both questions hold the same numbers and quoted literals.
+    """
+
+    def __init__(self, max_size=1024, ttl=3600, similarity_threshold=0.95, similarity_max_size=256):
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.similarity_max_size = similarity_max_size
+        self.exact = LRUCache(max_size, ttl)
+        self.similar_hits = 0
+        self.similar_misses = 0
+        # scope -> OrderedDict of normalized question -> (unit embedding, fingerprint, value, expire_at)
+        self._similar = {}
+        self._similar_lock = threading.Lock()
+
+    @property
+    def similarity_enabled(self):
+        return 0 < self.similarity_threshold <= 1
+
+    @staticmethod
+    def make_scope(profile_name, model_id, flags):
+        return profile_name, model_id, tuple(sorted(flags.items()))
+
+    @staticmethod
+    def normalize_query(query):
+        return ' '.join(unicodedata.normalize('NFKC', query).lower().split())
+
+    @staticmethod
+    def get_literals(query):
+        return sorted(LITERAL_PATTERN.findall(query))
+
+    @staticmethod
+    def _unit_vector(embedding):
+        norm = sum(x * x for x in embedding) ** 0.5
+        if norm == 0:
+            return None
+        return [x / norm for x in embedding]
+
+    def get(self, scope, query, fingerprint):
+        key = (scope, self.normalize_query(query))
+        item = self.exact.get(key)
+        if item is None:
+            return None
+        if item[0] != fingerprint:
+            self.exact.delete(key)
+            return None
+        return item[1]
+
+    def get_similar(self, scope, query, embedding, fingerprint):
+        """Return the cached value of the most similar question in the scope, or None below the threshold"""
+        unit_embedding = self._unit_vector(embedding) if embedding else None
+        best_value, best_similarity = None, self.similarity_threshold
+        if unit_embedding is not None:
+            now = time.time()
+            literals = self.get_literals(self.normalize_query(query))
+            with self._similar_lock:
+                entries = list(self._similar.get(scope, {}).items())
+            for entry_query, (entry_embedding, entry_fingerprint, value, expire_at) in entries:
+                if entry_fingerprint != fingerprint or (expire_at and expire_at < now):
+                    continue
+                if self.get_literals(entry_query) != literals:
+                    continue
+                similarity = sum(a * b for a, b in zip(unit_embedding, entry_embedding))
+                if similarity >= best_similarity:
+                    best_value, best_similarity = value, similarity
+        if best_value is None:
+            self.similar_misses += 1
+        else:
+            self.similar_hits += 1
+            logger.info(f'answer cache near-duplicate hit, similarity {best_similarity:.4f}')
+        return best_value
+
+    def set(self, scope, query, fingerprint, value, embedding=None, ttl=None):
+        """ttl overrides the cache's own for this answer, None keeps it"""
+        ttl = self.ttl if ttl is None else ttl
+        normalized_query = self.normalize_query(query)
+        self.exact.set((scope, normalized_query), (fingerprint, value), ttl)
+        unit_embedding = self._unit_vector(embedding) if embedding and self.similarity_enabled else None
+        if unit_embedding is not None:
+            expire_at = time.time() + ttl if ttl else 0
+            with self._similar_lock:
+                entries = self._similar.setdefault(scope, OrderedDict())
+                entries[normalized_query] = (unit_embedding, fingerprint, value, expire_at)
+                entries.move_to_end(normalized_query)
+                while len(entries) > self.similarity_max_size:
+                    entries.popitem(last=False)
+
+    def get_stats(self):
+        exact_stats = self.exact.get_stats()
+        return {
+            'size': exact_stats['size'],
+            'max_size': exact_stats['max_size'],
+            'exact_hits': exact_stats['hits'],
+            'exact_misses': exact_stats['misses'],
+            'similar_hits': self.similar_hits,
+            'similar_misses': self.similar_misses,
+        }
+
+
+class ResultCache:
+    """
+    Byte-budgeted cache of serialized result sets with a TTL per entry.
+    Least recently used entries spill from memory to files under spill_path when it is set,
+    and are dropped for good once the disk budget is exceeded.
+    """
+
+    def __init__(self, memory_budget=256 * 1024 * 1024, spill_path='', disk_budget=1024 * 1024 * 1024):
+        self.memory_budget = memory_budget
+        self.spill_path = spill_path
+        self.disk_budget = disk_budget
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # key -> (data, expire_at) and key -> (size, expire_at), least recently used first
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._lock = threading.Lock()
+        if spill_path:
+            # every process keeps its own spill index in memory, so each gets its own directory, files left there
+            # by a previous process with the same pid are orphans
+            self.spill_path = os.path.join(spill_path, str(os.getpid()))
+            os.makedirs(self.spill_path, exist_ok=True)
+            for file_name in os.listdir(self.spill_path):
+                if file_name.endswith('.bin'):
+                    try:
+                        os.remove(os.path.join(self.spill_path, file_name))
+                    except OSError:
+                        pass
+
+    @staticmethod
+    def make_key(*parts):
+        return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def _spill_file(self, key):
+        return os.path.join(self.spill_path, f'{key}.bin')
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                data, expire_at = item
+                if expire_at > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return data
+                self._remove_memory(key)
+            item = self._disk.get(key)
+            if item is not None:
+                size, expire_at = item
+                data = None
+                if expire_at > now:
+                    try:
+                        with open(self._spill_file(key), 'rb') as f:
+                            data = f.read()
+                    except OSError as e:
+                        logger.warning(f'spilled result {key} unreadable, counted as a miss: {e}')
+                self._remove_disk(key)
+                if data is not None:
+                    self._store_memory(key, data, expire_at)
+                    self.disk_hits += 1
+                    return data
+            self.misses += 1
+            return None
+
+    def set(self, key, data, ttl):
+        if ttl <= 0 or len(data) > max(self.memory_budget, self.disk_budget if self.spill_path else 0):
+            return
+        with self._lock:
+            self._remove_memory(key)
+            self._remove_disk(key)
+            self._store_memory(key, data, time.time() + ttl)
+
+    def _store_memory(self, key, data, expire_at):
+        self._memory[key] = (data, expire_at)
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.memory_budget:
+            evicted_key, (evicted_data, evicted_expire_at) = self._memory.popitem(last=False)
+            self.memory_bytes -= len(evicted_data)
+            self._spill(evicted_key, evicted_data, evicted_expire_at)
+
+    def _spill(self, key, data, expire_at):
+        if not self.spill_path or expire_at <= time.time():
+            return
+        with open(self._spill_file(key), 'wb') as f:
+            f.write(data)
+        self._disk[key] = (len(data), expire_at)
+        self.disk_bytes += len(data)
+        while self.disk_bytes > self.disk_budget:
+            self._remove_disk(next(iter(self._disk)))
+
+    def _remove_memory(self, key):
+        item = self._memory.pop(key, None)
+        if item is not None:
+            self.memory_bytes -= len(item[0])
+
+    def _remove_disk(self, key):
+        item = self._disk.pop(key, None)
+        if item is not None:
+            self.disk_bytes -= item[0]
+            try:
+                os.remove(self._spill_file(key))
+            except OSError as e:
+                logger.warning(f'failed to remove spilled result {key}: {e}')
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self.memory_bytes = 0
+            for key in list(self._disk):
+                self._remove_disk(key)
+
+    def get_stats(self):
+        return {
+            'memory_entries': len(self._memory),
+            'memory_bytes': self.memory_bytes,
+            'memory_budget': self.memory_budget,
+            'disk_entries': len(self._disk),
+            'disk_bytes': self.disk_bytes,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+        }
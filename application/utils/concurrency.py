@@ -0,0 +1,96 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+
+from utils.env_var import PIPELINE_MAX_WORKERS, PIPELINE_LLM_MAX_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# shared pool for the independent retrieval calls of one question.
+# stages running on this pool must not block on other stages submitted to it.
+stage_executor = ThreadPoolExecutor(max_workers=PIPELINE_MAX_WORKERS, thread_name_prefix='genbi-stage')
+# LLM stages may wait long in the rate limiter, on their own pool they cannot delay the retrievals of any question
+llm_stage_executor = ThreadPoolExecutor(max_workers=PIPELINE_LLM_MAX_WORKERS, thread_name_prefix='genbi-llm-stage')
+
+
+class StageTimer:
+    """Runs pipeline stages inline or on the shared pools and records the wall time of each stage in milliseconds"""
+
+    def __init__(self):
+        self.timings = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def run(self, name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def submit(self, name, fn, *args, **kwargs) -> Future:
+        return self._submit(stage_executor, name, fn, *args, **kwargs)
+
+    def submit_llm(self, name, fn, *args, **kwargs) -> Future:
+        return self._submit(llm_stage_executor, name, fn, *args, **kwargs)
+
+    def _submit(self, executor, name, fn, *args, **kwargs) -> Future:
+        # copy the caller's context so context variables (e.g. usage tracking) follow the stage into the pool
+        context = contextvars.copy_context()
+        return executor.submit(context.run, self.run, name, fn, *args, **kwargs)
+
+    def record(self, name, seconds):
+        elapsed_ms = int(seconds * 1000)
+        with self._lock:
+            # stages of the same name may run concurrently, keep the longest one
+            self.timings[name] = max(self.timings.get(name, 0), elapsed_ms)
+
+    def get_timings(self):
+        timings = dict(self.timings)
+        timings['total'] = int((time.perf_counter() - self._start) * 1000)
+        return timings
+
+
+def run_parallel_tasks(tasks, max_workers, timeout=None):
+    """
+    Run callables with at most max_workers at a time, each limited to `timeout` seconds from when it starts.
+    Returns one (result, error) pair per task in the original order, so callers can keep partial results.
+    A timed out task is abandoned, not interrupted.
+    """
+    if not tasks:
+        return []
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks))), thread_name_prefix='genbi-task')
+    start_times = {}
+
+    def run_task(index, task):
+        start_times[index] = time.monotonic()
+        return task()
+
+    futures = {executor.submit(contextvars.copy_context().run, run_task, index, task): index
+               for index, task in enumerate(tasks)}
+    results = [(None, None)] * len(tasks)
+    pending = set(futures)
+    while pending:
+        wait_timeout = None
+        if timeout is not None:
+            now = time.monotonic()
+            running_deadlines = [start_times[futures[f]] + timeout - now for f in pending if futures[f] in start_times]
+            # poll briefly while some tasks have not started yet
+            wait_timeout = max(0, min(running_deadlines)) if len(running_deadlines) == len(pending) else 0.05
+        done, pending = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                results[futures[future]] = (future.result(), None)
+            except Exception as e:
+                results[futures[future]] = (None, e)
+        if timeout is not None:
+            now = time.monotonic()
+            for future in list(pending):
+                index = futures[future]
+                if index in start_times and now - start_times[index] > timeout:
+                    pending.discard(future)
+                    results[index] = (None, TimeoutError(f'task {index} timed out after {timeout}s'))
+    executor.shutdown(wait=False, cancel_futures=True)
+    return results
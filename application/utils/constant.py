@@ -4,4 +4,19 @@ DEFAULT_PROMPT_NAME = 'suggested_question_prompt_default'
 ACTIVE_PROMPT_NAME = 'suggested_question_prompt_active'
 BEDROCK_MODEL_IDS = ['anthropic.claude-3-sonnet-20240229-v1:0', 'anthropic.claude-3-opus-20240229-v1:0',
                  'anthropic.claude-3-haiku-20240307-v1:0', 'mistral.mixtral-8x7b-instruct-v0:1',
-                 'meta.llama3-70b-instruct-v1:0']
\ No newline at end of file
+                 'meta.llama3-70b-instruct-v1:0']
+
+QUERY_INTENTS = ['normal_search', 'reject_search', 'agent_search', 'knowledge_search']
+VISUALIZATION_TYPES = ['table', 'bar', 'pie', 'line']
+# appended to the question in the query log of each agent sub task
+AGENT_SUB_TASK_MARKER = '; The sub task is '
+# on-demand USD per 1000 input / output tokens, used to report the cost of the logged questions
+BEDROCK_MODEL_PRICES = {
+    'anthropic.claude-3-sonnet-20240229-v1:0': (0.003, 0.015),
+    'anthropic.claude-3-opus-20240229-v1:0': (0.015, 0.075),
+    'anthropic.claude-3-haiku-20240307-v1:0': (0.00025, 0.00125),
+    'mistral.mixtral-8x7b-instruct-v0:1': (0.00045, 0.0007),
+    'meta.llama3-70b-instruct-v1:0': (0.00265, 0.0035),
+}
+# model of the intent stage in the query log when the local classifier answered it
+LOCAL_INTENT_MODEL = 'local-knn'
@@ -1,19 +1,27 @@
 import sqlalchemy as db
+from nlq.data_access.database import RelationDatabase
 from utils.env_var import RDS_MYSQL_HOST, RDS_MYSQL_PORT, RDS_MYSQL_USERNAME, RDS_MYSQL_PASSWORD, RDS_MYSQL_DBNAME, \
     RDS_PQ_SCHEMA
 
 
-def get_all_table_names(db_url: str, is_sample_db: bool, schema: str = None):
-    if is_sample_db:
-        print('checking connection...')
-        db_url = db_url.format(
+def get_resolved_db_url(db_url: str) -> str:
+    """Fill in the sample database credentials when the url is a template from config.json"""
+    if '{RDS_MYSQL_USERNAME}' in db_url:
+        return db_url.format(
             RDS_MYSQL_HOST=RDS_MYSQL_HOST,
             RDS_MYSQL_PORT=RDS_MYSQL_PORT,
             RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
             RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
             RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
         )
-    engine = db.create_engine(db_url)
+    return db_url
+
+
+def get_all_table_names(db_url: str, is_sample_db: bool, schema: str = None):
+    if is_sample_db:
+        print('checking connection...')
+        db_url = get_resolved_db_url(db_url)
+    engine = RelationDatabase.get_engine(db_url)
     with engine.connect() as connection:
         print('connected to database')
 
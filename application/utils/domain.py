@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Any
 
 
 @dataclass
@@ -8,3 +9,12 @@ class SearchTextSqlResult:
     retrieve_result: list
     response: str
     sql: str
+
+
+@dataclass
+class ResolvedConnection:
+    conn_name: str
+    db_url: str
+    db_type: str
+    dialect: str
+    engine: Any
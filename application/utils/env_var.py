@@ -11,9 +11,130 @@ RDS_MYSQL_DBNAME = os.getenv('RDS_MYSQL_DBNAME')
 
 RDS_PQ_SCHEMA = os.getenv('RDS_PQ_SCHEMA')
 
-BEDROCK_REGION = os.getenv('BEDROCK_REGION')
+BEDROCK_REGION = os.getenv('BEDROCK_REGION', 'us-west-2')
+# connection pool, timeouts (seconds) and retries of the shared bedrock runtime client
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.getenv('BEDROCK_MAX_POOL_CONNECTIONS', 50))
+BEDROCK_CONNECT_TIMEOUT = int(os.getenv('BEDROCK_CONNECT_TIMEOUT', 10))
+BEDROCK_READ_TIMEOUT = int(os.getenv('BEDROCK_READ_TIMEOUT', 120))
+# throttling is handled by the client side limiter below, keep botocore's retries few
+BEDROCK_MAX_ATTEMPTS = int(os.getenv('BEDROCK_MAX_ATTEMPTS', 3))
+# client side limits per (model id, region): requests and tokens per minute, concurrent calls
+BEDROCK_RATE_LIMIT_ENABLED = os.getenv('BEDROCK_RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+BEDROCK_DEFAULT_RPM = int(os.getenv('BEDROCK_DEFAULT_RPM', 500))
+BEDROCK_DEFAULT_TPM = int(os.getenv('BEDROCK_DEFAULT_TPM', 1000000))
+BEDROCK_MAX_CONCURRENCY = int(os.getenv('BEDROCK_MAX_CONCURRENCY', 32))
+# JSON of per model overrides, e.g. {"anthropic.claude-3-sonnet-20240229-v1:0": {"rpm": 100, "tpm": 200000}}
+BEDROCK_MODEL_QUOTAS = os.getenv('BEDROCK_MODEL_QUOTAS', '')
+# seconds a call may wait for capacity before failing with a model busy error
+BEDROCK_QUEUE_TIMEOUT = float(os.getenv('BEDROCK_QUEUE_TIMEOUT', 30))
+# JSON of pipeline stage -> bedrock model id, e.g. {"intent": "anthropic.claude-3-haiku-20240307-v1:0"};
+# stages without a route, and routed stages whose answer is unusable, use the model of the question
+MODEL_ROUTING = os.getenv('MODEL_ROUTING', '')
+# routed intent answers that report a lower confidence are escalated
+MODEL_ROUTING_MIN_CONFIDENCE = float(os.getenv('MODEL_ROUTING_MIN_CONFIDENCE', 0.5))
+
+# identical LLM, embedding and retrieval calls in flight at the same time share one upstream call
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 2048))
+# seconds, 0 keeps embeddings until they are evicted
+EMBEDDING_CACHE_TTL = int(os.getenv('EMBEDDING_CACHE_TTL', 0))
+# file path of the persistent embedding store, empty keeps the cache in memory only
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', '')
 
 AOS_HOST = os.getenv('AOS_HOST')
 AOS_PORT = os.getenv('AOS_PORT')
 AOS_USER = os.getenv('AOS_USER')
-AOS_PASSWORD = os.getenv('AOS_PASSWORD')
\ No newline at end of file
+AOS_PASSWORD = os.getenv('AOS_PASSWORD')
+AOS_ENDPOINT_TTL = int(os.getenv('AOS_ENDPOINT_TTL', 3600))
+AOS_POOL_MAXSIZE = int(os.getenv('AOS_POOL_MAXSIZE', 10))
+
+PIPELINE_MAX_WORKERS = int(os.getenv('PIPELINE_MAX_WORKERS', 16))
+# workers of the LLM stages run in the background of a question (suggested questions, insights), kept apart from the
+# retrieval stages so LLM calls waiting on the rate limiter do not hold up other questions' retrievals
+PIPELINE_LLM_MAX_WORKERS = int(os.getenv('PIPELINE_LLM_MAX_WORKERS', 16))
+AGENT_TASK_CONCURRENCY = int(os.getenv('AGENT_TASK_CONCURRENCY', 4))
+# seconds for one agent sub task (SQL generation, or execution and visualization)
+AGENT_TASK_TIMEOUT = int(os.getenv('AGENT_TASK_TIMEOUT', 60))
+
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 1024))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 3600))
+# cosine similarity above which a question reuses the answer of a near-duplicate one, e.g. 0.95;
+# 0 disables the near-duplicate tier
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv('ANSWER_CACHE_SIMILARITY_THRESHOLD', 0))
+# near-duplicate hits reuse the generated SQL and re-run it, unless the cached result set may be reused as well
+ANSWER_CACHE_REUSE_RESULT = os.getenv('ANSWER_CACHE_REUSE_RESULT', 'false').lower() == 'true'
+
+# default freshness of cached SQL results in seconds, data profiles may override it, 0 disables the cache
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 300))
+RESULT_CACHE_MEMORY_BYTES = int(os.getenv('RESULT_CACHE_MEMORY_BYTES', 256 * 1024 * 1024))
+# directory cached results spill to once the memory budget is used up, each process under a subdirectory named
+# after its pid, empty keeps them in memory only
+RESULT_CACHE_SPILL_PATH = os.getenv('RESULT_CACHE_SPILL_PATH', '')
+RESULT_CACHE_DISK_BYTES = int(os.getenv('RESULT_CACHE_DISK_BYTES', 1024 * 1024 * 1024))
+
+# upper bounds of a fetched result set, larger results are truncated and flagged
+SQL_RESULT_MAX_ROWS = int(os.getenv('SQL_RESULT_MAX_ROWS', 10000))
+SQL_RESULT_MAX_BYTES = int(os.getenv('SQL_RESULT_MAX_BYTES', 64 * 1024 * 1024))
+SQL_FETCH_CHUNK_ROWS = int(os.getenv('SQL_FETCH_CHUNK_ROWS', 1000))
+# run a COUNT(*) over a truncated query to report its real size, off by default as the count re-runs the whole
+# query without any limit
+SQL_RESULT_COUNT_TOTAL = os.getenv('SQL_RESULT_COUNT_TOTAL', 'false').lower() == 'true'
+
+# LIMIT injected into / clamped on generated SELECTs, one row over the fetch cap so truncation is still detected
+SQL_GUARD_LIMIT = int(os.getenv('SQL_GUARD_LIMIT', SQL_RESULT_MAX_ROWS + 1))
+# check EXPLAIN estimates before running generated sql, budgets of 0 are unlimited
+SQL_GUARD_EXPLAIN = os.getenv('SQL_GUARD_EXPLAIN', 'false').lower() == 'true'
+SQL_GUARD_MAX_COST = int(os.getenv('SQL_GUARD_MAX_COST', 0))
+SQL_GUARD_MAX_SCAN_ROWS = int(os.getenv('SQL_GUARD_MAX_SCAN_ROWS', 0))
+
+# threads the api may block in the question pipeline at once, on top of the default threadpool
+API_BLOCKING_THREADS = int(os.getenv('API_BLOCKING_THREADS', 200))
+
+# seconds between background checks of the profile table for changes made by other processes
+PROFILE_CACHE_REFRESH_INTERVAL = int(os.getenv('PROFILE_CACHE_REFRESH_INTERVAL', 60))
+
+# seconds a resolved connection (url, type, engine) is reused before it is read from DynamoDB again
+CONNECTION_CACHE_TTL = int(os.getenv('CONNECTION_CACHE_TTL', 300))
+
+# rendered per profile prompt fragments (schema, dialect, guidance, system prompt) kept in memory
+PROMPT_CACHE_SIZE = int(os.getenv('PROMPT_CACHE_SIZE', 256))
+
+# prompt size limits in (estimated) tokens, 0 leaves the total to the model's context window
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 0))
+PROMPT_EXAMPLES_TOKEN_BUDGET = int(os.getenv('PROMPT_EXAMPLES_TOKEN_BUDGET', 4000))
+PROMPT_NER_TOKEN_BUDGET = int(os.getenv('PROMPT_NER_TOKEN_BUDGET', 1000))
+# result sets passed for summaries and analysis are cut to this size
+PROMPT_DATA_TOKEN_BUDGET = int(os.getenv('PROMPT_DATA_TOKEN_BUDGET', 8000))
+
+# prune the schema sent to text-to-SQL to the tables and columns closest to the question
+SCHEMA_LINKING_ENABLED = os.getenv('SCHEMA_LINKING_ENABLED', 'true').lower() == 'true'
+# profiles with at most this many tables of at most SCHEMA_LINKING_TOP_COLUMNS columns are sent whole
+SCHEMA_LINKING_TOP_TABLES = int(os.getenv('SCHEMA_LINKING_TOP_TABLES', 8))
+SCHEMA_LINKING_TOP_COLUMNS = int(os.getenv('SCHEMA_LINKING_TOP_COLUMNS', 30))
+# embedding requests in flight while a profile's schema is indexed
+SCHEMA_LINKING_EMBEDDING_CONCURRENCY = int(os.getenv('SCHEMA_LINKING_EMBEDDING_CONCURRENCY', 8))
+
+# answer the intent from the nearest labelled questions of the profile, the LLM is asked when the vote is not clear
+INTENT_CLASSIFIER_ENABLED = os.getenv('INTENT_CLASSIFIER_ENABLED', 'true').lower() == 'true'
+INTENT_CLASSIFIER_K = int(os.getenv('INTENT_CLASSIFIER_K', 7))
+# share of the similarity weighted votes the winning intent needs
+INTENT_CLASSIFIER_MIN_CONFIDENCE = float(os.getenv('INTENT_CLASSIFIER_MIN_CONFIDENCE', 0.8))
+# cosine similarity the nearest example needs, questions unlike every example go to the LLM
+INTENT_CLASSIFIER_MIN_SIMILARITY = float(os.getenv('INTENT_CLASSIFIER_MIN_SIMILARITY', 0.85))
+# profiles with fewer labelled questions always use the LLM
+INTENT_CLASSIFIER_MIN_EXAMPLES = int(os.getenv('INTENT_CLASSIFIER_MIN_EXAMPLES', 20))
+# embedding requests in flight while a profile's labelled questions are indexed
+INTENT_CLASSIFIER_EMBEDDING_CONCURRENCY = int(os.getenv('INTENT_CLASSIFIER_EMBEDDING_CONCURRENCY', 4))
+# seconds before a failed classifier build of a profile is tried again, the LLM answers meanwhile
+INTENT_CLASSIFIER_RETRY_SECONDS = int(os.getenv('INTENT_CLASSIFIER_RETRY_SECONDS', 300))
+
+# query logs are written by a background thread, entries beyond the queue size are dropped
+QUERY_LOG_QUEUE_SIZE = int(os.getenv('QUERY_LOG_QUEUE_SIZE', 10000))
+# seconds the writer waits to fill a batch of 25 before flushing a partial one
+QUERY_LOG_FLUSH_INTERVAL = float(os.getenv('QUERY_LOG_FLUSH_INTERVAL', 1))
+
+SQL_POOL_SIZE = int(os.getenv('SQL_POOL_SIZE', 5))
+SQL_MAX_OVERFLOW = int(os.getenv('SQL_MAX_OVERFLOW', 10))
+SQL_POOL_RECYCLE = int(os.getenv('SQL_POOL_RECYCLE', 1800))
+SQL_POOL_PRE_PING = os.getenv('SQL_POOL_PRE_PING', 'true').lower() == 'true'
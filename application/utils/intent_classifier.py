@@ -0,0 +1,117 @@
+import hashlib
+import json
+import logging
+import threading
+
+from utils.concurrency import run_parallel_tasks
+from utils.constant import QUERY_INTENTS
+from utils.env_var import INTENT_CLASSIFIER_ENABLED, INTENT_CLASSIFIER_K, INTENT_CLASSIFIER_MIN_CONFIDENCE, \
+    INTENT_CLASSIFIER_MIN_SIMILARITY, INTENT_CLASSIFIER_MIN_EXAMPLES, INTENT_CLASSIFIER_EMBEDDING_CONCURRENCY, \
+    INTENT_CLASSIFIER_RETRY_SECONDS
+from utils.lazy import BackgroundBuilder
+from utils.schema_linking import get_embedding
+
+logger = logging.getLogger(__name__)
+
+intent_classifier_stats = {'questions': 0, 'local': 0, 'fallback': 0, 'no_examples': 0, 'not_ready': 0,
+                           'errors': 0}
+intent_classifier_stats_lock = threading.Lock()
+
+
+def count(stat):
+    with intent_classifier_stats_lock:
+        intent_classifier_stats[stat] += 1
+
+
+class IntentClassifier:
+    """Unit vectors of a profile's labelled questions, a question gets the similarity weighted vote of its k nearest"""
+
+    def __init__(self, examples):
+        import numpy as np
+
+        examples = [example for example in examples
+                    if example.get('question') and example.get('intent') in QUERY_INTENTS]
+        results = run_parallel_tasks([lambda question=example['question']: get_embedding(question)
+                                      for example in examples], INTENT_CLASSIFIER_EMBEDDING_CONCURRENCY)
+        self.intents = []
+        vectors = []
+        for example, (embedding, error) in zip(examples, results):
+            if error is not None:
+                raise error
+            vectors.append(embedding)
+            self.intents.append(example['intent'])
+        vectors = np.array(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = vectors / np.where(norms == 0, 1, norms)
+
+    def classify(self, embedding, k=INTENT_CLASSIFIER_K):
+        """(intent, confidence, similarity of the nearest example), intent is None without examples"""
+        import numpy as np
+
+        if not self.intents:
+            return None, 0, 0
+        question_vector = np.array(embedding, dtype=np.float32)
+        question_vector /= np.linalg.norm(question_vector) or 1
+        similarities = self.vectors @ question_vector
+        nearest = np.argsort(-similarities)[:k]
+        votes = {}
+        for index in nearest:
+            votes[self.intents[index]] = votes.get(self.intents[index], 0) + max(float(similarities[index]), 0)
+        intent = max(votes, key=votes.get)
+        total = sum(votes.values())
+        return intent, votes[intent] / total if total else 0, float(similarities[nearest[0]])
+
+
+# classifiers keyed by the hash of their labelled questions
+classifiers = BackgroundBuilder('intent-classifier', IntentClassifier, retry_after=INTENT_CLASSIFIER_RETRY_SECONDS)
+
+
+def get_classifier(examples):
+    """The classifier of the labelled questions, None while it is built in the background"""
+    key = hashlib.sha256(json.dumps(examples, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return classifiers.get(key, examples)
+
+
+def classify_intent(database_profile, search_box):
+    """
+    Intent of the question from the profile's labelled questions, in the format of get_query_intent, or None when
+    the LLM should be asked, also while the profile's classifier is being built. Slots cannot be extracted locally,
+    so a local answer has none and skips the entity retrieval.
+    """
+    if not INTENT_CLASSIFIER_ENABLED:
+        return None
+    count('questions')
+    examples = database_profile.get('intent_examples') or []
+    if len(examples) < INTENT_CLASSIFIER_MIN_EXAMPLES:
+        count('no_examples')
+        return None
+    classifier = get_classifier(examples)
+    if classifier is None:
+        count('not_ready')
+        return None
+    try:
+        # the question embedding is usually cached already by the answer cache lookup
+        intent, confidence, similarity = classifier.classify(get_embedding(search_box))
+    except Exception as e:
+        logger.warning(f'intent classifier failed, asking the LLM: {e}')
+        count('errors')
+        return None
+    if intent is None or confidence < INTENT_CLASSIFIER_MIN_CONFIDENCE or similarity < INTENT_CLASSIFIER_MIN_SIMILARITY:
+        logger.info(f'intent classifier not sure ({intent}, confidence {confidence:.2f}, '
+                    f'similarity {similarity:.2f}), asking the LLM')
+        count('fallback')
+        return None
+    logger.info(f'intent classifier answered {intent}, confidence {confidence:.2f}, similarity {similarity:.2f}')
+    count('local')
+    return {'intent': intent, 'slot': [], 'confidence': confidence}
+
+
+def get_stats():
+    with intent_classifier_stats_lock:
+        stats = dict(intent_classifier_stats)
+    stats['llm_calls_avoided'] = round(stats['local'] / stats['questions'], 4) if stats['questions'] else 0
+    classifier_stats = classifiers.get_stats()
+    stats['classifiers'] = classifier_stats['built']
+    stats['classifiers_building'] = classifier_stats['building']
+    stats['build_failures'] = classifier_stats['failures']
+    return stats
@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# name -> milliseconds it took to build, in initialization order
+initialization_report = {}
+
+
+class LazySingleton:
+    """
+    Class attribute holding a process-wide object (DAO, client) that is only built on first access,
+    so importing a module does not open connections or call AWS.
+    """
+
+    def __init__(self, factory, name=None):
+        self.factory = factory
+        self.name = name or getattr(factory, '__name__', repr(factory))
+        self._value = None
+        self._lock = threading.Lock()
+
+    def __get__(self, instance, owner):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    start = time.perf_counter()
+                    self._value = self.factory()
+                    elapsed_ms = int((time.perf_counter() - start) * 1000)
+                    initialization_report[self.name] = elapsed_ms
+                    logger.info(f'{self.name} initialized in {elapsed_ms} ms')
+        return self._value
+
+
+class BackgroundBuilder:
+    """
+    Objects too slow to build on the request path, e.g. embedding indexes, built one at a time on a background thread.
+    get returns None until the object of a key is built, so callers fall back meanwhile. Concurrent gets of a key
+    start a single build, and a failed build is only retried after retry_after seconds.
+    """
+
+    def __init__(self, name, factory, max_size=64, retry_after=300):
+        self.name = name
+        self.factory = factory
+        self.retry_after = retry_after
+        self.built = LRUCache(max_size)
+        self.failures = 0
+        self._building = set()
+        # key -> monotonic time of its last failed build
+        self._failed_at = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'genbi-{name}')
+
+    def get(self, key, *args):
+        """The object built by factory(*args) for the key, None while it is not built yet"""
+        value = self.built.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            failed_at = self._failed_at.get(key)
+            if key in self._building or (failed_at is not None and time.monotonic() - failed_at < self.retry_after):
+                return None
+            self._building.add(key)
+        self._executor.submit(self._build, key, *args)
+        return None
+
+    def _build(self, key, *args):
+        start = time.perf_counter()
+        try:
+            value = self.factory(*args)
+        except Exception as e:
+            logger.warning(f'{self.name} build failed, retried in {self.retry_after}s: {e}')
+            with self._lock:
+                self.failures += 1
+                self._failed_at[key] = time.monotonic()
+                self._building.discard(key)
+            return
+        self.built.set(key, value)
+        with self._lock:
+            self._failed_at.pop(key, None)
+            self._building.discard(key)
+        logger.info(f'{self.name} built in {int((time.perf_counter() - start) * 1000)} ms')
+
+    def get_stats(self):
+        with self._lock:
+            return {'built': self.built.get_stats()['size'], 'building': len(self._building),
+                    'failures': self.failures}
+
+
+def get_initialization_report():
+    return dict(initialization_report)
@@ -1,12 +1,19 @@
 import json
 import boto3
-from botocore.config import Config
 
 from utils.prompt import POSTGRES_DIALECT_PROMPT_CLAUDE3, MYSQL_DIALECT_PROMPT_CLAUDE3, \
     DEFAULT_DIALECT_PROMPT, SEARCH_INTENT_PROMPT_CLAUDE3, AWS_REDSHIFT_DIALECT_PROMPT_CLAUDE3
 import os
 import logging
-from langchain_core.output_parsers import JsonOutputParser
+from utils.cache import EmbeddingCache
+from utils.constant import QUERY_INTENTS, VISUALIZATION_TYPES
+from utils.env_var import EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL, EMBEDDING_CACHE_PATH, \
+    MODEL_ROUTING_MIN_CONFIDENCE
+from utils.model_adapter import get_bedrock_client, invoke_bedrock, invoke_model, record_usage, start_usage_tracking
+from utils.single_flight import SingleFlight
+from utils.rate_limit import ModelBusyError, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from utils.token_budget import estimate_tokens
+from utils.tool import parse_json_response
 from utils.prompts.generate_prompt import generate_llm_prompt, generate_sagemaker_intent_prompt, \
     generate_sagemaker_sql_prompt, generate_sagemaker_explain_prompt, generate_agent_cot_system_prompt, \
     generate_intent_prompt, generate_knowledge_prompt, generate_data_visualization_prompt, \
@@ -15,122 +22,10 @@ from utils.prompts.generate_prompt import generate_llm_prompt, generate_sagemake
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-BEDROCK_AWS_REGION = os.environ.get('BEDROCK_REGION', 'us-west-2')
-
-config = Config(
-    region_name=BEDROCK_AWS_REGION,
-    signature_version='v4',
-    retries={
-        'max_attempts': 10,
-        'mode': 'standard'
-    }
-)
-# model IDs are here:
-# https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-claude.html
-
-bedrock = None
-json_parse = JsonOutputParser()
 sagemaker_client = None
-
-
-def get_bedrock_client():
-    global bedrock
-    if not bedrock:
-        bedrock = boto3.client(service_name='bedrock-runtime', config=config)
-    return bedrock
-
-
-def invoke_model_claude3(model_id, system_prompt, messages, max_tokens, with_response_stream=False):
-    body = json.dumps(
-        {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": max_tokens,
-            "system": system_prompt,
-            "messages": messages,
-            "temperature": 0.01
-        }
-    )
-
-    if with_response_stream:
-        response = get_bedrock_client().invoke_model_with_response_stream(body=body, modelId=model_id)
-        return response
-    else:
-        response = get_bedrock_client().invoke_model(body=body, modelId=model_id)
-        response_body = json.loads(response.get('body').read())
-        return response_body
-
-
-def invoke_llama_70b(model_id, system_prompt, user_prompt, max_tokens, with_response_stream=False):
-    """
-    Invoke LLama-70B model
-    :param model_id:
-    :param system_prompt:
-    :param messages:
-    :param max_tokens:
-    :param with_response_stream:
-    :return:
-    """
-    try:
-        llama3_prompt = """
-        <|begin_of_text|><|start_header_id|>system<|end_header_id|>
-
-        {system_prompt}<|eot_id|><|start_header_id|>user<|end_header_id|>
-
-        {user_prompt}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
-        """
-        body = {
-            "prompt": llama3_prompt.format(system_prompt=system_prompt, user_prompt=user_prompt),
-            "max_gen_len": 2048,
-            "temperature": 0.01,
-            "top_p": 0.9
-        }
-        if with_response_stream:
-            response = get_bedrock_client().invoke_model_with_response_stream(body=json.dumps(body), modelId=model_id)
-            return response
-        else:
-            response = get_bedrock_client().invoke_model(
-                modelId=model_id, body=json.dumps(body)
-            )
-            response_body = json.loads(response["body"].read())
-            return response_body
-    except Exception as e:
-        logger.error("Couldn't invoke LLama 70B")
-        logger.error(e)
-
-
-def invoke_mixtral_8x7b(model_id, system_prompt, messages, max_tokens, with_response_stream=False):
-    """
-    Invokes the Mixtral 8c7B model to run an inference using the input
-    provided in the request body.
-
-    :param prompt: The prompt that you want Mixtral to complete.
-    :return: List of inference responses from the model.
-    """
-
-    try:
-        instruction = f"<s>[INST] {system_prompt} \n The question you need to answer is: <question> {messages[0]['content']} </question>[/INST]"
-        body = {
-            "prompt": instruction,
-            # "system": system_prompt,
-            # "messages": messages,
-            "max_tokens": max_tokens,
-            "temperature": 0.01,
-        }
-
-        if with_response_stream:
-            response = get_bedrock_client().invoke_model_with_response_stream(body=json.dumps(body), modelId=model_id)
-            return response
-        else:
-            response = get_bedrock_client().invoke_model(
-                modelId=model_id, body=json.dumps(body)
-            )
-            response_body = json.loads(response["body"].read())
-            response_body['content'] = response_body['outputs']
-            return response_body
-    except Exception as e:
-        logger.error("Couldn't invoke Mixtral 8x7B")
-        logger.error(e)
-        raise
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL, EMBEDDING_CACHE_PATH)
+llm_flight = SingleFlight('llm')
+embedding_flight = SingleFlight('embedding')
 
 
 def get_sagemaker_client():
@@ -158,10 +53,6 @@ def invoke_model_sagemaker_endpoint(endpoint_name, body, with_response_stream=Fa
         return response_body
 
 
-def claude_select_table():
-    pass
-
-
 def generate_prompt(ddl, hints, search_box, sql_examples=None, ner_example=None, model_id=None, dialect='mysql'):
     long_string = ""
     for table_name, table_data in ddl.items():
@@ -240,39 +131,37 @@ def generate_prompt(ddl, hints, search_box, sql_examples=None, ner_example=None,
     return claude_prompt, dialect_prompt
 
 
-def invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens=2048, with_response_stream=False):
-    # Prompt with user turn only.
-    user_message = {"role": "user", "content": user_prompt}
-    messages = [user_message]
+def invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens=2048, with_response_stream=False,
+                     priority=PRIORITY_NORMAL):
+    """
+    Text of the model's answer, or a stream of its pieces when streaming.
+    Identical prompts in flight at the same time share one invocation, streams are fanned out to every caller.
+    """
     logger.info(f'{system_prompt=}')
-    logger.info(f'{messages=}')
+    logger.info(f'{user_prompt=}')
     response = ""
+    key = (model_id, system_prompt, user_prompt, max_tokens)
     try:
-        if model_id.startswith('anthropic.claude-3'):
-            response = invoke_model_claude3(model_id, system_prompt, messages, max_tokens, with_response_stream)
-        elif model_id.startswith('mistral.mixtral-8x7b'):
-            response = invoke_mixtral_8x7b(model_id, system_prompt, messages, max_tokens, with_response_stream)
-        elif model_id.startswith('meta.llama3-70b'):
-            response = invoke_llama_70b(model_id, system_prompt, user_prompt, max_tokens, with_response_stream)
         if with_response_stream:
-            return response
-        else:
-            if model_id.startswith('meta.llama3-70b'):
-                return response["generation"]
-            else:
-                final_response = response.get("content")[0].get("text")
-                return final_response
+            return llm_flight.do_stream(key, lambda: invoke_model(model_id, system_prompt, user_prompt, max_tokens,
+                                                                  True, priority))
+        return llm_flight.do(key, lambda: invoke_model(model_id, system_prompt, user_prompt, max_tokens,
+                                                       priority=priority)).text
+    except ModelBusyError:
+        # the caller reports it, an empty answer would read as the model having nothing to say
+        raise
     except Exception as e:
         logger.error("invoke_llm_model error {}".format(e))
     return response
 
 
 def text_to_sql(ddl, hints, prompt_map, search_box, sql_examples=None, ner_example=None, model_id=None, dialect='mysql',
-                model_provider=None, with_response_stream=False):
+                model_provider=None, with_response_stream=False, fingerprint=None):
     user_prompt, system_prompt = generate_llm_prompt(ddl, hints, prompt_map, search_box, sql_examples, ner_example,
-                                                     model_id, dialect=dialect)
+                                                     model_id, dialect=dialect, fingerprint=fingerprint)
     max_tokens = 2048
-    response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, with_response_stream)
+    response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, with_response_stream,
+                                PRIORITY_HIGH)
     return response
 
 
@@ -309,10 +198,10 @@ LIMIT 10;</query>'''
         return final_response
 
 
-def get_agent_cot_task(model_id, prompt_map, search_box, ddl, agent_cot_example=None):
+def get_agent_cot_task(model_id, prompt_map, search_box, ddl, agent_cot_example=None, fingerprint=None):
     default_agent_cot_task = {"task_1": search_box}
     user_prompt, system_prompt = generate_agent_cot_system_prompt(ddl, prompt_map, search_box, model_id,
-                                                                  agent_cot_example)
+                                                                  agent_cot_example, fingerprint)
     try:
         intent_endpoint = os.getenv("SAGEMAKER_ENDPOINT_INTENT")
         if intent_endpoint:
@@ -321,23 +210,21 @@ def get_agent_cot_task(model_id, prompt_map, search_box, ddl, agent_cot_example=
                 {"query": generate_sagemaker_intent_prompt(search_box, meta_instruction=SEARCH_INTENT_PROMPT_CLAUDE3)})
             response = invoke_model_sagemaker_endpoint(intent_endpoint, body)
             logger.info(f'{response=}')
-            intent_result_dict = json_parse.parse(response)
+            intent_result_dict = parse_json_response(response)
             return intent_result_dict
         else:
             max_tokens = 2048
-            user_message = {"role": "user", "content": user_prompt}
-            messages = [user_message]
-            response = invoke_model_claude3(model_id, system_prompt, messages, max_tokens)
-            final_response = response.get("content")[0].get("text")
+            final_response = llm_flight.do((model_id, system_prompt, user_prompt, max_tokens),
+                                           lambda: invoke_model(model_id, system_prompt, user_prompt, max_tokens)).text
             logger.info(f'{final_response=}')
-            intent_result_dict = json_parse.parse(final_response)
+            intent_result_dict = parse_json_response(final_response)
             return intent_result_dict
     except Exception as e:
         logger.error("get_agent_cot_task is error:{}".format(e))
         return default_agent_cot_task
 
 
-def data_analyse_tool(model_id, prompt_map, search_box, sql_data, search_type):
+def data_analyse_tool(model_id, prompt_map, search_box, sql_data, search_type, raise_error=False):
     try:
         max_tokens = 2048
         if search_type == "agent":
@@ -348,11 +235,20 @@ def data_analyse_tool(model_id, prompt_map, search_box, sql_data, search_type):
         logger.info(f'{final_response=}')
         return final_response
     except Exception as e:
+        if raise_error:
+            raise
         logger.error("data_analyse_tool is error")
     return ""
 
 
-def get_query_intent(model_id, search_box, prompt_map):
+def is_usable_intent(intent_result_dict):
+    """A known intent with a list of slots, and when the model gives a confidence, one above the threshold"""
+    return isinstance(intent_result_dict, dict) and intent_result_dict.get('intent') in QUERY_INTENTS \
+        and isinstance(intent_result_dict.get('slot', []), list) \
+        and float(intent_result_dict.get('confidence', 1)) >= MODEL_ROUTING_MIN_CONFIDENCE
+
+
+def get_query_intent(model_id, search_box, prompt_map, raise_error=False):
     default_intent = {"intent": "normal_search"}
     try:
         intent_endpoint = os.getenv("SAGEMAKER_ENDPOINT_INTENT")
@@ -362,32 +258,36 @@ def get_query_intent(model_id, search_box, prompt_map):
                 {"query": generate_sagemaker_intent_prompt(search_box, meta_instruction=SEARCH_INTENT_PROMPT_CLAUDE3)})
             response = invoke_model_sagemaker_endpoint(intent_endpoint, body)
             logger.info(f'{response=}')
-            intent_result_dict = json_parse.parse(response)
+            intent_result_dict = parse_json_response(response)
             return intent_result_dict
         else:
             user_prompt, system_prompt = generate_intent_prompt(prompt_map, search_box, model_id)
             max_tokens = 2048
             final_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False)
             logger.info(f'{final_response=}')
-            intent_result_dict = json_parse.parse(final_response)
+            intent_result_dict = parse_json_response(final_response)
             return intent_result_dict
     except Exception as e:
+        if raise_error:
+            raise
         logger.error("get_query_intent is error:{}".format(e))
         return default_intent
 
 
-def knowledge_search(model_id, search_box, prompt_map):
+def knowledge_search(model_id, search_box, prompt_map, raise_error=False):
     try:
         user_prompt, system_prompt = generate_knowledge_prompt(prompt_map, search_box, model_id)
         max_tokens = 2048
         final_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False)
         return final_response
     except Exception as e:
+        if raise_error:
+            raise
         logger.error("knowledge_search is error")
     return ""
 
 
-def select_data_visualization_type(model_id, search_box, search_data, prompt_map):
+def select_data_visualization_type(model_id, search_box, search_data, prompt_map, raise_error=False):
     default_data_visualization = {
         "show_type": "table",
         "format_data": []
@@ -396,14 +296,20 @@ def select_data_visualization_type(model_id, search_box, search_data, prompt_map
         user_prompt, system_prompt = generate_data_visualization_prompt(prompt_map, search_box, search_data, model_id)
         max_tokens = 2048
         final_response = invoke_llm_model(model_id, system_prompt, user_prompt, max_tokens, False)
-        data_visualization_dict = json_parse.parse(final_response)
+        data_visualization_dict = parse_json_response(final_response)
         return data_visualization_dict
     except Exception as e:
+        if raise_error:
+            raise
         logger.error("select_data_visualization_type is error {}", e)
         return default_data_visualization
 
 
-def data_visualization(model_id, search_box, search_data, prompt_map):
+def is_usable_visualization(visualization):
+    return visualization[0] in VISUALIZATION_TYPES
+
+
+def data_visualization(model_id, search_box, search_data, prompt_map, raise_error=False):
     columns = list(search_data.columns)
     data_list = search_data.values.tolist()
     all_columns_data = [columns] + data_list
@@ -416,33 +322,43 @@ def data_visualization(model_id, search_box, search_data, prompt_map):
             else:
                 if len(all_columns_data) > 10:
                     all_columns_data = all_columns_data[0:5]
-                model_select_type_dict = select_data_visualization_type(model_id, search_box, all_columns_data, prompt_map)
+                model_select_type_dict = select_data_visualization_type(model_id, search_box, all_columns_data,
+                                                                        prompt_map, raise_error)
                 model_select_type = model_select_type_dict["show_type"]
                 model_select_type_columns = model_select_type_dict["format_data"][0]
                 data_list = search_data[model_select_type_columns].values.tolist()
                 return model_select_type, [model_select_type_columns] + data_list
     except Exception as e:
+        if raise_error:
+            raise
         logger.error("data_visualization is error {}", e)
         return "table", all_columns_data
 
 
-def create_vector_embedding_with_bedrock(text, index_name):
+def invoke_bedrock_embedding(text, model_id="amazon.titan-embed-text-v1"):
     payload = {"inputText": f"{text}"}
     body = json.dumps(payload)
-    modelId = "amazon.titan-embed-text-v1"
     accept = "application/json"
     contentType = "application/json"
 
-    response = get_bedrock_client().invoke_model(
-        body=body, modelId=modelId, accept=accept, contentType=contentType
-    )
+    response = invoke_bedrock(model_id, estimate_tokens(text), PRIORITY_NORMAL,
+                              lambda: get_bedrock_client().invoke_model(body=body, modelId=model_id, accept=accept,
+                                                                        contentType=contentType))
+    record_usage(model_id, response)
     response_body = json.loads(response.get("body").read())
 
-    embedding = response_body.get("embedding")
+    return response_body.get("embedding")
+
+
+def create_vector_embedding_with_bedrock(text, index_name):
+    modelId = "amazon.titan-embed-text-v1"
+    key = EmbeddingCache.make_key(modelId, text)
+    embedding = embedding_cache.get_or_create(
+        modelId, text, lambda: embedding_flight.do(key, lambda: invoke_bedrock_embedding(text, modelId)))
     return {"_index": index_name, "text": text, "vector_field": embedding}
 
 
-def create_vector_embedding_with_sagemaker(endpoint_name, text, index_name):
+def invoke_sagemaker_embedding(endpoint_name, text):
     model_kwargs = {}
     model_kwargs["batch_size"] = 12
     model_kwargs["max_length"] = 512
@@ -450,17 +366,23 @@ def create_vector_embedding_with_sagemaker(endpoint_name, text, index_name):
     body = json.dumps({"inputs": [text], **model_kwargs})
     response = invoke_model_sagemaker_endpoint(endpoint_name, body)
     embeddings = response["sentence_embeddings"]
-    return {"_index": index_name, "text": text, "vector_field": embeddings["dense_vecs"][0]}
+    return embeddings["dense_vecs"][0]
+
+
+def create_vector_embedding_with_sagemaker(endpoint_name, text, index_name):
+    key = EmbeddingCache.make_key(endpoint_name, text)
+    embedding = embedding_cache.get_or_create(
+        endpoint_name, text, lambda: embedding_flight.do(key, lambda: invoke_sagemaker_embedding(endpoint_name, text)))
+    return {"_index": index_name, "text": text, "vector_field": embedding}
 
 
 def generate_suggested_question(prompt_map, search_box, model_id=None):
     max_tokens = 2048
     user_prompt, system_prompt = generate_suggest_question_prompt(prompt_map, search_box, model_id)
-    user_message = {"role": "user", "content": user_prompt}
-    messages = [user_message]
     logger.info(f'{system_prompt=}')
-    logger.info(f'{messages=}')
-    response = invoke_model_claude3(model_id, system_prompt, messages, max_tokens)
-    final_response = response.get("content")[0].get("text")
+    logger.info(f'{user_prompt=}')
+    final_response = llm_flight.do((model_id, system_prompt, user_prompt, max_tokens),
+                                   lambda: invoke_model(model_id, system_prompt, user_prompt, max_tokens,
+                                                        priority=PRIORITY_LOW)).text
 
     return final_response
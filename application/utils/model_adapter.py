@@ -0,0 +1,296 @@
+import contextvars
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import boto3
+from botocore.config import Config
+
+from utils.env_var import BEDROCK_CONNECT_TIMEOUT, BEDROCK_READ_TIMEOUT, BEDROCK_MAX_POOL_CONNECTIONS, \
+    BEDROCK_MAX_ATTEMPTS, BEDROCK_REGION
+from utils.rate_limit import get_rate_limiter, is_throttling_error, PRIORITY_NORMAL
+from utils.token_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# the one bedrock runtime client of the process, its connection pool and timeouts are set here
+config = Config(
+    region_name=BEDROCK_REGION,
+    signature_version='v4',
+    connect_timeout=BEDROCK_CONNECT_TIMEOUT,
+    read_timeout=BEDROCK_READ_TIMEOUT,
+    max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+    retries={
+        'max_attempts': BEDROCK_MAX_ATTEMPTS,
+        'mode': 'standard'
+    }
+)
+bedrock = None
+bedrock_lock = threading.Lock()
+
+# bedrock usage of the current question, stage threads share it through the copied context
+llm_usage = contextvars.ContextVar('llm_usage', default=None)
+llm_usage_lock = threading.Lock()
+
+
+def get_bedrock_client():
+    global bedrock
+    if not bedrock:
+        with bedrock_lock:
+            if not bedrock:
+                bedrock = boto3.client(service_name='bedrock-runtime', config=config)
+    return bedrock
+
+
+def start_usage_tracking():
+    usage = {'model_ids': [], 'input_tokens': 0, 'output_tokens': 0, 'model_tokens': {}}
+    llm_usage.set(usage)
+    return usage
+
+
+def add_usage(usage, model_id, input_tokens, output_tokens):
+    if usage is None:
+        return
+    with llm_usage_lock:
+        if model_id not in usage['model_ids']:
+            usage['model_ids'].append(model_id)
+        usage['input_tokens'] += input_tokens
+        usage['output_tokens'] += output_tokens
+        model_tokens = usage['model_tokens'].setdefault(model_id, {'input_tokens': 0, 'output_tokens': 0})
+        model_tokens['input_tokens'] += input_tokens
+        model_tokens['output_tokens'] += output_tokens
+
+
+def get_header_usage(response):
+    """Token counts bedrock reports in the response headers of a non streaming invocation"""
+    headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    return (int(headers.get('x-amzn-bedrock-input-token-count', 0)),
+            int(headers.get('x-amzn-bedrock-output-token-count', 0)))
+
+
+def record_usage(model_id, response):
+    """Add the token counts bedrock reports in the response headers to the usage of the current question"""
+    add_usage(llm_usage.get(), model_id, *get_header_usage(response))
+
+
+def acquire_permit(model_id, estimated_tokens, priority=PRIORITY_NORMAL):
+    """Wait for capacity of the model's rate limiter, None when limiting is disabled"""
+    limiter = get_rate_limiter(model_id, BEDROCK_REGION)
+    return limiter.acquire(estimated_tokens, priority) if limiter else None
+
+
+def release_permit(permit, response=None, error=None):
+    if permit is None:
+        return
+    if error is not None:
+        permit.release(throttled=is_throttling_error(error))
+        return
+    input_tokens, output_tokens = get_header_usage(response)
+    # botocore retried the call, most often because bedrock throttled it
+    retried = response.get('ResponseMetadata', {}).get('RetryAttempts', 0) > 0
+    permit.release(input_tokens + output_tokens, throttled=retried)
+
+
+def invoke_bedrock(model_id, estimated_tokens, priority, call):
+    """Run a non streaming bedrock call within the model's rate limits"""
+    permit = acquire_permit(model_id, estimated_tokens, priority)
+    try:
+        response = call()
+    except Exception as e:
+        release_permit(permit, error=e)
+        raise
+    release_permit(permit, response)
+    return response
+
+
+@dataclass
+class ModelResult:
+    text: str
+    model_id: str
+    stop_reason: Optional[str] = None
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+class ModelAdapter:
+    """
+    Request body and response format of one model family on bedrock.
+    Adapters are matched by model id prefix, see register_model_adapter.
+    """
+    model_id_prefix = ''
+
+    def build_body(self, system_prompt, user_prompt, max_tokens) -> dict:
+        raise NotImplementedError
+
+    def parse_response(self, response_body) -> tuple:
+        """(text, stop_reason) of a complete response"""
+        raise NotImplementedError
+
+    def parse_chunk(self, chunk) -> tuple:
+        """(text, stop_reason) of a streamed chunk, either may be None"""
+        raise NotImplementedError
+
+
+class Claude3Adapter(ModelAdapter):
+    model_id_prefix = 'anthropic.claude-3'
+
+    def build_body(self, system_prompt, user_prompt, max_tokens):
+        return {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": max_tokens,
+            "system": system_prompt,
+            "messages": [{"role": "user", "content": user_prompt}],
+            "temperature": 0.01
+        }
+
+    def parse_response(self, response_body):
+        return response_body["content"][0]["text"], response_body.get("stop_reason")
+
+    def parse_chunk(self, chunk):
+        if chunk.get("type") == "content_block_delta":
+            return chunk["delta"].get("text"), None
+        if chunk.get("type") == "message_delta":
+            return None, chunk["delta"].get("stop_reason")
+        return None, None
+
+
+class MixtralAdapter(ModelAdapter):
+    model_id_prefix = 'mistral.mixtral-8x7b'
+
+    def build_body(self, system_prompt, user_prompt, max_tokens):
+        instruction = f"<s>[INST] {system_prompt} \n The question you need to answer is: <question> {user_prompt} </question>[/INST]"
+        return {
+            "prompt": instruction,
+            "max_tokens": max_tokens,
+            "temperature": 0.01,
+        }
+
+    def parse_response(self, response_body):
+        output = response_body["outputs"][0]
+        return output["text"], output.get("stop_reason")
+
+    def parse_chunk(self, chunk):
+        outputs = chunk.get("outputs") or [{}]
+        return outputs[0].get("text"), outputs[0].get("stop_reason")
+
+
+class Llama3Adapter(ModelAdapter):
+    model_id_prefix = 'meta.llama3'
+    prompt_template = """
+        <|begin_of_text|><|start_header_id|>system<|end_header_id|>
+
+        {system_prompt}<|eot_id|><|start_header_id|>user<|end_header_id|>
+
+        {user_prompt}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
+        """
+
+    def build_body(self, system_prompt, user_prompt, max_tokens):
+        return {
+            "prompt": self.prompt_template.format(system_prompt=system_prompt, user_prompt=user_prompt),
+            "max_gen_len": max_tokens,
+            "temperature": 0.01,
+            "top_p": 0.9
+        }
+
+    def parse_response(self, response_body):
+        return response_body["generation"], response_body.get("stop_reason")
+
+    def parse_chunk(self, chunk):
+        return chunk.get("generation"), chunk.get("stop_reason")
+
+
+model_adapters = []
+
+
+def register_model_adapter(adapter: ModelAdapter):
+    """Add an adapter, later registrations take precedence for overlapping prefixes"""
+    model_adapters.insert(0, adapter)
+
+
+def get_model_adapter(model_id) -> ModelAdapter:
+    for adapter in model_adapters:
+        if model_id.startswith(adapter.model_id_prefix):
+            return adapter
+    raise ValueError(f'No model adapter registered for {model_id}')
+
+
+for model_adapter in (Claude3Adapter(), MixtralAdapter(), Llama3Adapter()):
+    register_model_adapter(model_adapter)
+
+
+class TokenStream:
+    """
+    Text pieces of a streamed invocation, the same for every model. Once iterated to the end, result holds the
+    full text and the usage bedrock reported, which is also added to the usage of the question that started it.
+    """
+
+    def __init__(self, model_id, adapter, response, permit=None):
+        self.model_id = model_id
+        self.adapter = adapter
+        self.response = response
+        self.result = None
+        # the model's capacity is held until the stream is consumed
+        self.permit = permit
+        # streams are usually consumed by another thread than the one that invoked the model
+        self._usage = llm_usage.get()
+
+    def __iter__(self):
+        pieces = []
+        stop_reason = None
+        input_tokens = output_tokens = 0
+        try:
+            for event in self.response['body']:
+                if 'chunk' not in event:
+                    continue
+                chunk = json.loads(event['chunk']['bytes'].decode('utf8'))
+                text, chunk_stop_reason = self.adapter.parse_chunk(chunk)
+                stop_reason = chunk_stop_reason or stop_reason
+                metrics = chunk.get('amazon-bedrock-invocationMetrics')
+                if metrics:
+                    input_tokens = metrics.get('inputTokenCount', 0)
+                    output_tokens = metrics.get('outputTokenCount', 0)
+                if text:
+                    pieces.append(text)
+                    yield text
+        except Exception as e:
+            self.close(error=e)
+            raise
+        self.result = ModelResult(''.join(pieces), self.model_id, stop_reason, input_tokens, output_tokens)
+        add_usage(self._usage, self.model_id, input_tokens, output_tokens)
+        self.close(input_tokens + output_tokens)
+
+    def close(self, used_tokens=None, error=None):
+        if self.permit is not None:
+            self.permit.release(used_tokens, throttled=error is not None and is_throttling_error(error))
+
+    def __del__(self):
+        # a stream dropped before the end must not keep its capacity
+        self.close()
+
+
+def invoke_model(model_id, system_prompt, user_prompt, max_tokens=2048, with_response_stream=False,
+                 priority=PRIORITY_NORMAL):
+    """
+    Invoke a bedrock text model, returns a ModelResult or, when streaming, a TokenStream.
+    Calls wait for the model's rate limits by priority and raise ModelBusyError when the wait is too long.
+    """
+    adapter = get_model_adapter(model_id)
+    body = json.dumps(adapter.build_body(system_prompt, user_prompt, max_tokens))
+    # bedrock counts the requested max tokens against the quota until the call ends
+    estimated_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_prompt) + max_tokens
+    if with_response_stream:
+        permit = acquire_permit(model_id, estimated_tokens, priority)
+        try:
+            response = get_bedrock_client().invoke_model_with_response_stream(body=body, modelId=model_id)
+        except Exception as e:
+            release_permit(permit, error=e)
+            raise
+        return TokenStream(model_id, adapter, response, permit)
+    response = invoke_bedrock(model_id, estimated_tokens, priority,
+                              lambda: get_bedrock_client().invoke_model(body=body, modelId=model_id))
+    input_tokens, output_tokens = get_header_usage(response)
+    add_usage(llm_usage.get(), model_id, input_tokens, output_tokens)
+    text, stop_reason = adapter.parse_response(json.loads(response['body'].read()))
+    return ModelResult(text, model_id, stop_reason, input_tokens, output_tokens)
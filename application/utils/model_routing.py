@@ -0,0 +1,95 @@
+import json
+import logging
+import threading
+import time
+
+from utils.constant import BEDROCK_MODEL_IDS
+from utils.env_var import MODEL_ROUTING
+from utils.rate_limit import ModelBusyError
+
+logger = logging.getLogger(__name__)
+
+# pipeline stages of a question that invoke a text model
+ROUTED_STAGES = ('intent', 'knowledge_search', 'agent_task', 'text_to_sql', 'data_analyse', 'data_visualization',
+                 'suggested_question')
+
+
+def get_routing_config(overrides=None):
+    """Stage -> model id routes of MODEL_ROUTING, overridden by the non-empty values of a profile's model_routing"""
+    routing = {}
+    for stage, model_id in list((json.loads(MODEL_ROUTING) if MODEL_ROUTING else {}).items()) + \
+            list((overrides or {}).items()):
+        if stage not in ROUTED_STAGES:
+            logger.warning(f'unknown stage {stage} in the model routing')
+        elif model_id and model_id not in BEDROCK_MODEL_IDS:
+            logger.warning(f'unsupported model {model_id} for stage {stage} in the model routing')
+        elif model_id:
+            routing[stage] = model_id
+    return routing
+
+
+class ModelRouter:
+    """
+    Model of each pipeline stage of one question. Stages without a route use the question's model, which is also the
+    one a routed model escalates to when its answer fails to parse or is not usable.
+    """
+
+    def __init__(self, default_model_id, routing=None):
+        self.default_model_id = default_model_id
+        self.routing = routing or {}
+        # stage -> model id that produced the stage's answer, and stage -> model id that was escalated from
+        self.choices = {}
+        self.escalations = {}
+        self._lock = threading.Lock()
+
+    @property
+    def routing_key(self):
+        return tuple(sorted(self.routing.items()))
+
+    def get_model(self, stage):
+        model_id = self.routing.get(stage, self.default_model_id)
+        self.record(stage, model_id)
+        return model_id
+
+    def record(self, stage, model_id, escalated_from=None):
+        with self._lock:
+            self.choices[stage] = model_id
+            if escalated_from:
+                self.escalations[stage] = escalated_from
+
+    def run(self, stage, fn, *args, accept=None, **kwargs):
+        """
+        Call fn(model_id, *args, **kwargs) with the stage's model. When the stage is routed to another model than the
+        question's and accept is given, fn must take raise_error: the routed model's answer is retried with the
+        question's model if fn raises or accept(result) is false. A busy model is not escalated, that would only pile
+        its load onto the question's model.
+        """
+        model_id = self.get_model(stage)
+        if accept is None or model_id == self.default_model_id:
+            return fn(model_id, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            result = fn(model_id, *args, raise_error=True, **kwargs)
+            if accept(result):
+                return result
+            reason = 'an unusable answer'
+        except ModelBusyError:
+            raise
+        except Exception as e:
+            reason = f'an error: {e}'
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        logger.warning(f'{stage} escalated from {model_id} to {self.default_model_id} after {reason} '
+                       f'in {elapsed_ms} ms')
+        self.record(stage, self.default_model_id, escalated_from=model_id)
+        return fn(self.default_model_id, *args, **kwargs)
+
+    def get_report(self):
+        with self._lock:
+            report = dict(self.choices)
+            for stage, model_id in self.escalations.items():
+                report[stage] = f'{report[stage]} (escalated from {model_id})'
+            return report
+
+    def log_report(self, stage_timings):
+        logger.info('stage models ' + ', '.join(f'{stage}: {model_id} {stage_timings.get(stage, "-")} ms'
+                                                for stage, model_id in self.get_report().items()))
@@ -1,11 +1,23 @@
+import threading
+import time
 import boto3
 from opensearchpy import OpenSearch, RequestsHttpConnection
 from opensearchpy.helpers import bulk
 import logging
+from utils.env_var import AOS_ENDPOINT_TTL, AOS_POOL_MAXSIZE
 from utils.llm import create_vector_embedding_with_bedrock
+from utils.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+# clients are thread-safe and keep their HTTP connections alive, so one client per endpoint is shared process-wide
+opensearch_clients = {}
+# domain endpoints resolved through the es API, refreshed after AOS_ENDPOINT_TTL seconds
+opensearch_endpoints = {}
+opensearch_client_lock = threading.Lock()
+# callers may modify the retrieved samples, so the ones sharing a retrieval get their own copy
+retrieval_flight = SingleFlight('retrieval', copy_result=True)
+
 def get_opensearch_cluster_client(domain, user, password, region, index_name):
     opensearch_endpoint = get_opensearch_endpoint(domain, region)
     opensearch_client = OpenSearch(
@@ -23,11 +35,42 @@ def get_opensearch_cluster_client(domain, user, password, region, index_name):
     return opensearch_client
     
 def get_opensearch_endpoint(domain, region):
+    cached_endpoint = opensearch_endpoints.get((domain, region))
+    if cached_endpoint is not None and cached_endpoint[1] > time.time():
+        return cached_endpoint[0]
     client = boto3.client('es', region_name=region)
     response = client.describe_elasticsearch_domain(
         DomainName=domain
     )
-    return response['DomainStatus']['Endpoint']
+    endpoint = response['DomainStatus']['Endpoint']
+    opensearch_endpoints[(domain, region)] = (endpoint, time.time() + AOS_ENDPOINT_TTL)
+    return endpoint
+
+
+def get_opensearch_client(host, port, opensearch_user, opensearch_password, domain=None, region_name=None):
+    if not host:
+        host = get_opensearch_endpoint(domain, region_name)
+        port = 443
+    client_key = (host, port, opensearch_user, opensearch_password)
+    opensearch_client = opensearch_clients.get(client_key)
+    if opensearch_client is None:
+        with opensearch_client_lock:
+            opensearch_client = opensearch_clients.get(client_key)
+            if opensearch_client is None:
+                # Create the client with SSL/TLS enabled, but hostname verification disabled.
+                opensearch_client = OpenSearch(
+                    hosts=[{'host': host, 'port': port}],
+                    http_compress=True,  # enables gzip compression for request bodies
+                    http_auth=(opensearch_user, opensearch_password),
+                    use_ssl=True,
+                    verify_certs=False,
+                    ssl_assert_hostname=False,
+                    ssl_show_warn=False,
+                    pool_maxsize=AOS_POOL_MAXSIZE
+                )
+                opensearch_clients[client_key] = opensearch_client
+                logger.info(f"Created OpenSearch client for {host}:{port}")
+    return opensearch_client
 
 def put_bulk_in_opensearch(list, client):
     logger.info(f"Putting {len(list)} documents in OpenSearch")
@@ -82,6 +125,12 @@ def delete_opensearch_index(opensearch_client, index_name):
         return True
 
 def get_retrieve_opensearch(env_vars, query, search_type, selected_profile, top_k, score_threshold=0.7):
+    key = (query, search_type, selected_profile, top_k, score_threshold)
+    return retrieval_flight.do(key, lambda: retrieve_opensearch(env_vars, query, search_type, selected_profile, top_k,
+                                                                score_threshold))
+
+
+def retrieve_opensearch(env_vars, query, search_type, selected_profile, top_k, score_threshold=0.7):
     demo_profile_suffix = '(demo)'
     origin_selected_profile = selected_profile
     selected_profile = "shopping_guide"
@@ -161,21 +210,8 @@ def get_agent_retrieve_opensearch(env_vars, query, search_type, selected_profile
 
 def retrieve_results_from_opensearch(index_name, region_name, domain, opensearch_user, opensearch_password,
                                      query_embedding, top_k=3, host='', port=443, profile_name=None):
-    auth = (opensearch_user, opensearch_password)
-    if len(host) == 0:
-        host = get_opensearch_endpoint(domain, region_name)
-        port = 443
-
-    # Create the client with SSL/TLS enabled, but hostname verification disabled.
-    opensearch_client = OpenSearch(
-        hosts=[{'host': host, 'port': port}],
-        http_compress=True,  # enables gzip compression for request bodies
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=False,
-        ssl_assert_hostname=False,
-        ssl_show_warn=False
-    )
+    opensearch_client = get_opensearch_client(host, port, opensearch_user, opensearch_password, domain,
+                                              region_name)
     search_query = {
         "size": top_k,  # Adjust the size as needed to retrieve more or fewer results
         "query": {
@@ -211,20 +247,8 @@ def retrieve_results_from_opensearch(index_name, region_name, domain, opensearch
 
 def upload_results_to_opensearch(region_name, domain, opensearch_user, opensearch_password, index_name, query, sql,
                                  host='', port=443):
-    auth = (opensearch_user, opensearch_password)
-    if len(host) == 0:
-        host = get_opensearch_endpoint(domain, region_name)
-        port = 443
-    # Create the client with SSL/TLS enabled, but hostname verification disabled.
-    opensearch_client = OpenSearch(
-        hosts=[{'host': host, 'port': port}],
-        http_compress=True,  # enables gzip compression for request bodies
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=False,
-        ssl_assert_hostname=False,
-        ssl_show_warn=False
-    )
+    opensearch_client = get_opensearch_client(host, port, opensearch_user, opensearch_password, domain,
+                                              region_name)
 
     # Vector embedding using Amazon Bedrock Titan text embedding
     logger.info(f"Creating embeddings for records")
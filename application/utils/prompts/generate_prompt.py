@@ -3,6 +3,12 @@ from utils.prompt import POSTGRES_DIALECT_PROMPT_CLAUDE3, MYSQL_DIALECT_PROMPT_C
 from utils.prompts import guidance_prompt
 from utils.prompts import table_prompt
 import logging
+import string
+
+from utils.cache import LRUCache
+from utils.env_var import PROMPT_CACHE_SIZE, PROMPT_EXAMPLES_TOKEN_BUDGET, PROMPT_NER_TOKEN_BUDGET
+from utils.tool import get_profile_fingerprint
+from utils.token_budget import PromptBudget, estimate_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -1450,7 +1456,12 @@ table_prompt_mapper = table_prompt.TablePromptMapper()
 guidance_prompt_mapper = guidance_prompt.GuidancePromptMapper()
 
 
-def generate_llm_prompt(ddl, hints, prompt_map, search_box, sql_examples=None, ner_example=None, model_id=None, dialect='mysql'):
+# compiled prompt fragments keyed by (prompt kind, profile fingerprint, model, dialect)
+prompt_cache = LRUCache(PROMPT_CACHE_SIZE)
+prompt_formatter = string.Formatter()
+
+
+def render_schema(ddl):
     long_string = ""
     for table_name, table_data in ddl.items():
         ddl_string = table_data["col_a"] if 'col_a' in table_data else table_data["ddl"]
@@ -1461,31 +1472,90 @@ def generate_llm_prompt(ddl, hints, prompt_map, search_box, sql_examples=None, n
 
     # trying CREATE TABLE ddl
     # long_string = generate_create_table_ddl(long_string)
-    ddl = long_string
+    return long_string
+
+
+def compile_template(template, static_values):
+    """
+    Split a str.format template into literal text and the names of the fields still to fill.
+    Fields found in static_values are rendered now, so values filled later are never parsed as a template.
+    """
+    parts = []
+    for literal, field_name, format_spec, conversion in prompt_formatter.parse(template):
+        text = literal
+        if field_name is not None and field_name in static_values:
+            value = prompt_formatter.convert_field(static_values[field_name], conversion)
+            text += prompt_formatter.format_field(value, format_spec)
+        if parts and isinstance(parts[-1], str):
+            parts[-1] += text
+        elif text:
+            parts.append(text)
+        if field_name is not None and field_name not in static_values:
+            parts.append((field_name, format_spec, conversion))
+    return parts
+
+
+def render_template(parts, values):
+    rendered = []
+    for part in parts:
+        if isinstance(part, str):
+            rendered.append(part)
+        else:
+            field_name, format_spec, conversion = part
+            value = prompt_formatter.convert_field(values[field_name], conversion)
+            rendered.append(prompt_formatter.format_field(value, format_spec))
+    return ''.join(rendered)
 
-    logger.info(f'{dialect=}')
+
+def get_fixed_tokens(*templates):
+    """Estimated tokens of the rendered parts of prompts or compiled templates"""
+    tokens = 0
+    for template in templates:
+        parts = [template] if isinstance(template, str) else template
+        tokens += sum(estimate_tokens(part) for part in parts if isinstance(part, str))
+    return tokens
+
+
+def render_sql_example(item):
+    return "Q: " + item['_source']['text'] + "\n" + "A: ```sql\n" + item['_source']['sql'] + "```\n"
+
+
+def render_ner_example(item):
+    return "ner: " + item['_source']['entity'] + "\n" + "ner info:" + item['_source']['comment'] + "\n"
+
+
+def render_agent_cot_example(item):
+    return "query: " + item['_source']['query'] + "\n" + "train of thought:" + item['_source']['comment'] + "\n"
+
+
+def get_retrieve_score(item):
+    return item.get('_score', 0)
+
+
+def get_prompt_fingerprint(ddl, prompt_map, fingerprint=None):
+    return fingerprint or get_profile_fingerprint({'tables_info': ddl, 'prompt_map': prompt_map})
+
+
+def get_dialect_prompt(dialect):
     if dialect == 'postgresql':
-        dialect_prompt = POSTGRES_DIALECT_PROMPT_CLAUDE3
+        return POSTGRES_DIALECT_PROMPT_CLAUDE3
     elif dialect == 'mysql':
-        dialect_prompt = MYSQL_DIALECT_PROMPT_CLAUDE3
+        return MYSQL_DIALECT_PROMPT_CLAUDE3
     elif dialect == 'redshift':
-        dialect_prompt = AWS_REDSHIFT_DIALECT_PROMPT_CLAUDE3
+        return AWS_REDSHIFT_DIALECT_PROMPT_CLAUDE3
     else:
-        dialect_prompt = DEFAULT_DIALECT_PROMPT
-
-    example_sql_prompt = ""
-    example_ner_prompt = ""
-    if sql_examples:
-        for item in sql_examples:
-            example_sql_prompt += "Q: " + item['_source']['text'] + "\n"
-            example_sql_prompt += "A: ```sql\n" + item['_source']['sql'] + "```\n"
+        return DEFAULT_DIALECT_PROMPT
 
-    if ner_example:
-        for item in ner_example:
-            example_ner_prompt += "ner: " + item['_source']['entity'] + "\n"
-            example_ner_prompt += "ner info:" + item['_source']['comment'] + "\n"
 
+def get_text2sql_fragments(ddl, prompt_map, model_id, dialect, fingerprint=None):
+    """System prompt and compiled user prompt of a profile, with schema, dialect and guidance already rendered"""
     name = support_model_ids_map[model_id]
+    cache_key = ('text2sql', get_prompt_fingerprint(ddl, prompt_map, fingerprint), name, dialect)
+    fragments = prompt_cache.get(cache_key)
+    if fragments is not None:
+        return fragments
+
+    long_string = render_schema(ddl)
     system_prompt = prompt_map.get('text2sql', {}).get('system_prompt', {}).get(name)
     user_prompt = prompt_map.get('text2sql', {}).get('user_prompt', {}).get(name)
     if long_string == '':
@@ -1499,9 +1569,32 @@ def generate_llm_prompt(ddl, hints, prompt_map, search_box, sql_examples=None, n
     else:
         system_prompt = system_prompt.format(dialect=dialect)
 
-    user_prompt = user_prompt.format(dialect_prompt=dialect_prompt, sql_schema=table_prompt,
-                                     sql_guidance=guidance_prompt, examples=example_sql_prompt,
-                                     ner_info=example_ner_prompt, question=search_box)
+    user_prompt_parts = compile_template(user_prompt, {'dialect_prompt': get_dialect_prompt(dialect),
+                                                       'sql_schema': table_prompt, 'sql_guidance': guidance_prompt})
+    fragments = (system_prompt, user_prompt_parts, get_fixed_tokens(system_prompt, user_prompt_parts))
+    prompt_cache.set(cache_key, fragments)
+    return fragments
+
+
+def generate_llm_prompt(ddl, hints, prompt_map, search_box, sql_examples=None, ner_example=None, model_id=None,
+                        dialect='mysql', fingerprint=None):
+    """fingerprint identifies the profile's tables_info and prompt_map, it is computed when not given"""
+    logger.info(f'{dialect=}')
+    system_prompt, user_prompt_parts, fixed_tokens = get_text2sql_fragments(ddl, prompt_map, model_id, dialect,
+                                                                            fingerprint)
+
+    # schema and question are needed whole, the examples and NER info fill what is left of the budget
+    budget = PromptBudget(support_model_ids_map[model_id])
+    budget.add('template_and_schema', tokens=fixed_tokens)
+    budget.add('question', search_box)
+    example_sql_prompt = budget.fit_items('examples', sql_examples, render_sql_example,
+                                          PROMPT_EXAMPLES_TOKEN_BUDGET, get_retrieve_score)
+    example_ner_prompt = budget.fit_items('ner_info', ner_example, render_ner_example, PROMPT_NER_TOKEN_BUDGET,
+                                          get_retrieve_score)
+    budget.log_report('text2sql')
+
+    user_prompt = render_template(user_prompt_parts, {'examples': example_sql_prompt, 'ner_info': example_ner_prompt,
+                                                      'question': search_box})
 
     return user_prompt, system_prompt
 
@@ -1599,34 +1692,36 @@ def generate_sagemaker_explain_prompt(
     return prompt
 
 
-def generate_agent_cot_system_prompt(ddl, prompt_map, search_box, model_id, agent_cot_example=None):
-    long_string = ""
-    for table_name, table_data in ddl.items():
-        ddl_string = table_data["col_a"] if 'col_a' in table_data else table_data["ddl"]
-        long_string += "{}: {}\n".format(table_name, table_data["tbl_a"] if 'tbl_a' in table_data else table_data[
-            "description"])
-        long_string += ddl_string
-        long_string += "\n"
-
-    # trying CREATE TABLE ddl
-    # long_string = generate_create_table_ddl(long_string)
-    ddl = long_string
-
-    agent_cot_example_str = ""
-    if agent_cot_example:
-        for item in agent_cot_example:
-            agent_cot_example_str += "query: " + item['_source']['query'] + "\n"
-            agent_cot_example_str += "train of thought:" + item['_source']['comment'] + "\n"
-
-    # fetch system/user prompt from DynamoDB prompt map
+def get_agent_cot_fragments(ddl, prompt_map, model_id, fingerprint=None):
     name = support_model_ids_map[model_id]
-    system_prompt = prompt_map.get('agent', {}).get('system_prompt', {}).get(name)
-    user_prompt = prompt_map.get('agent', {}).get('user_prompt', {}).get(name)
+    cache_key = ('agent', get_prompt_fingerprint(ddl, prompt_map, fingerprint), name, None)
+    fragments = prompt_cache.get(cache_key)
+    if fragments is None:
+        system_prompt = prompt_map.get('agent', {}).get('system_prompt', {}).get(name)
+        user_prompt = prompt_map.get('agent', {}).get('user_prompt', {}).get(name)
+        system_prompt_parts = compile_template(system_prompt, {'table_schema_data': render_schema(ddl),
+                                                                'example_data': AGENT_COT_EXAMPLE})
+        user_prompt_parts = compile_template(user_prompt, {})
+        fragments = (system_prompt_parts, user_prompt_parts, get_fixed_tokens(system_prompt_parts, user_prompt_parts))
+        prompt_cache.set(cache_key, fragments)
+    return fragments
+
+
+def generate_agent_cot_system_prompt(ddl, prompt_map, search_box, model_id, agent_cot_example=None,
+                                     fingerprint=None):
+    system_prompt_parts, user_prompt_parts, fixed_tokens = get_agent_cot_fragments(ddl, prompt_map, model_id,
+                                                                                   fingerprint)
+
+    budget = PromptBudget(support_model_ids_map[model_id])
+    budget.add('template_and_schema', tokens=fixed_tokens)
+    budget.add('question', search_box)
+    agent_cot_example_str = budget.fit_items('examples', agent_cot_example, render_agent_cot_example,
+                                             PROMPT_EXAMPLES_TOKEN_BUDGET, get_retrieve_score)
+    budget.log_report('agent_cot')
 
     # reformat prompts
-    system_prompt = system_prompt.format(table_schema_data=ddl, sql_guidance=agent_cot_example_str,
-                                         example_data=AGENT_COT_EXAMPLE)
-    user_prompt = user_prompt.format(question=search_box)
+    system_prompt = render_template(system_prompt_parts, {'sql_guidance': agent_cot_example_str})
+    user_prompt = render_template(user_prompt_parts, {'question': search_box})
 
     return user_prompt, system_prompt
 
@@ -1670,6 +1765,12 @@ def generate_agent_analyse_prompt(prompt_map, search_box, model_id, sql_data):
     system_prompt = prompt_map.get('agent_analyse', {}).get('system_prompt', {}).get(name)
     user_prompt = prompt_map.get('agent_analyse', {}).get('user_prompt', {}).get(name)
 
+    budget = PromptBudget(name)
+    budget.add('template', tokens=get_fixed_tokens(system_prompt, user_prompt))
+    budget.add('question', search_box)
+    sql_data = budget.fit_data('data', sql_data)
+    budget.log_report('agent_analyse')
+
     user_prompt = user_prompt.format(question=search_box, data=sql_data)
 
     return user_prompt, system_prompt
@@ -1681,6 +1782,12 @@ def generate_data_summary_prompt(prompt_map, search_box, model_id, sql_data):
     system_prompt = prompt_map.get('data_summary', {}).get('system_prompt', {}).get(name)
     user_prompt = prompt_map.get('data_summary', {}).get('user_prompt', {}).get(name)
 
+    budget = PromptBudget(name)
+    budget.add('template', tokens=get_fixed_tokens(system_prompt, user_prompt))
+    budget.add('question', search_box)
+    sql_data = budget.fit_data('data', sql_data)
+    budget.log_report('data_summary')
+
     user_prompt = user_prompt.format(question=search_box, data=sql_data)
 
     return user_prompt, system_prompt
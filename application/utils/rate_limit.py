@@ -0,0 +1,182 @@
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+
+from utils.env_var import BEDROCK_RATE_LIMIT_ENABLED, BEDROCK_DEFAULT_RPM, BEDROCK_DEFAULT_TPM, \
+    BEDROCK_MAX_CONCURRENCY, BEDROCK_MODEL_QUOTAS, BEDROCK_QUEUE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+THROTTLING_ERROR_CODES = ('ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException')
+
+
+class ModelBusyError(RuntimeError):
+    pass
+
+
+def is_throttling_error(e):
+    return getattr(e, 'response', {}).get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+class TokenBucket:
+    """Holds up to `capacity` units and refills `capacity` per minute; 0 capacity means unlimited"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.available = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        if self.capacity:
+            self.available = min(self.capacity, self.available + (now - self.updated_at) * self.capacity / 60)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """Seconds until amount units are available, a request larger than the bucket only waits for a full one"""
+        if not self.capacity:
+            return 0
+        missing = min(amount, self.capacity) - self.available
+        return max(missing, 0) * 60 / self.capacity
+
+    def take(self, amount):
+        if self.capacity:
+            self.available -= amount
+
+
+class Permit:
+    def __init__(self, limiter, estimated_tokens):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self.released = False
+
+    def release(self, used_tokens=None, throttled=False):
+        if not self.released:
+            self.released = True
+            self.limiter.release(self, used_tokens, throttled)
+
+
+class ModelRateLimiter:
+    """
+    Client side limits of one model in one region: requests and tokens per minute (token buckets) and an adaptive
+    concurrency limit that grows by one per window of successful calls and halves on throttling (AIMD).
+    Waiting callers are served by priority, then in arrival order, and give up after their deadline.
+    """
+
+    def __init__(self, name, rpm, tpm, max_concurrency, min_concurrency=1):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.throttled = 0
+        self.rejected = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, estimated_tokens, priority=PRIORITY_NORMAL, timeout=BEDROCK_QUEUE_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        waiter = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiters, waiter)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    wait = None
+                    if self._waiters[0] == waiter and self.in_flight < int(self.concurrency_limit):
+                        wait = max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+                        if wait == 0:
+                            self.requests.take(1)
+                            self.tokens.take(estimated_tokens)
+                            self.in_flight += 1
+                            return Permit(self, estimated_tokens)
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise ModelBusyError(f'{self.name} is busy: no capacity within {timeout}s '
+                                             f'({self.in_flight} calls in flight, {len(self._waiters) - 1} waiting)')
+                    self._condition.wait(min(remaining, wait) if wait else remaining)
+            finally:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                # the next waiter may be able to go now
+                self._condition.notify_all()
+
+    def release(self, permit, used_tokens=None, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if used_tokens is not None:
+                # settle the estimate against what the call really used
+                self.tokens.take(used_tokens - permit.estimated_tokens)
+            if throttled:
+                self.throttled += 1
+                self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+                logger.warning(f'{self.name} throttled, concurrency limit lowered to {int(self.concurrency_limit)}')
+            else:
+                self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+            self._condition.notify_all()
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                'concurrency_limit': int(self.concurrency_limit),
+                'in_flight': self.in_flight,
+                'waiting': len(self._waiters),
+                'throttled': self.throttled,
+                'rejected': self.rejected,
+            }
+
+
+rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+
+
+def parse_model_quotas(model_quotas):
+    """Model id -> quota of BEDROCK_MODEL_QUOTAS, empty when it is unset or not a JSON object"""
+    if not model_quotas:
+        return {}
+    try:
+        quotas = json.loads(model_quotas)
+    except ValueError as e:
+        logger.warning(f'BEDROCK_MODEL_QUOTAS is not valid JSON, using the default quotas: {e}')
+        return {}
+    if not isinstance(quotas, dict):
+        logger.warning('BEDROCK_MODEL_QUOTAS is not a JSON object, using the default quotas')
+        return {}
+    return quotas
+
+
+model_quotas = parse_model_quotas(BEDROCK_MODEL_QUOTAS)
+
+
+def get_rate_limiter(model_id, region):
+    """Limiter of a (model id, region), None when rate limiting is disabled"""
+    if not BEDROCK_RATE_LIMIT_ENABLED:
+        return None
+    key = (model_id, region)
+    limiter = rate_limiters.get(key)
+    if limiter is None:
+        with rate_limiters_lock:
+            limiter = rate_limiters.get(key)
+            if limiter is None:
+                quota = model_quotas.get(model_id) or {}
+                limiter = ModelRateLimiter(f'{model_id} ({region})', quota.get('rpm', BEDROCK_DEFAULT_RPM),
+                                           quota.get('tpm', BEDROCK_DEFAULT_TPM),
+                                           quota.get('max_concurrency', BEDROCK_MAX_CONCURRENCY))
+                rate_limiters[key] = limiter
+    return limiter
+
+
+def get_stats():
+    return {limiter.name: limiter.get_stats() for limiter in list(rate_limiters.values())}
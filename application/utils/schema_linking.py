@@ -0,0 +1,256 @@
+import hashlib
+import logging
+import re
+import threading
+
+from utils.concurrency import run_parallel_tasks
+from utils.env_var import SCHEMA_LINKING_ENABLED, SCHEMA_LINKING_TOP_TABLES, SCHEMA_LINKING_TOP_COLUMNS, \
+    SCHEMA_LINKING_EMBEDDING_CONCURRENCY
+from utils.lazy import BackgroundBuilder
+from utils.llm import create_vector_embedding_with_bedrock
+from utils.token_budget import estimate_tokens
+from utils.tool import get_profile_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# col_a entries start with "- name: <column>, datatype: ..." and continue with indented lines
+ANNOTATION_COLUMN_PATTERN = re.compile(r'^\s*-\s*name:\s*([^,\s]+)')
+WORD_PATTERN = re.compile(r'\w+')
+
+schema_linking_stats = {'questions': 0, 'pruned': 0, 'tokens_before': 0, 'tokens_after': 0, 'errors': 0,
+                        'index_not_ready': 0}
+schema_linking_stats_lock = threading.Lock()
+
+
+def get_embedding(text):
+    return create_vector_embedding_with_bedrock(text, index_name="")['vector_field']
+
+
+def unit_vector(embedding):
+    norm = sum(x * x for x in embedding) ** 0.5
+    return [x / norm for x in embedding] if norm else None
+
+
+def parse_columns(table_data):
+    """
+    Split a table's schema text into (column name, lines) in order, plus the lines before and after the columns.
+    The column annotation (col_a) is used when present, otherwise the generated DDL.
+    """
+    if 'col_a' in table_data:
+        header, columns, footer = [], [], []
+        for line in table_data['col_a'].split('\n'):
+            match = ANNOTATION_COLUMN_PATTERN.match(line)
+            if match:
+                columns.append((match.group(1), [line]))
+            elif columns:
+                columns[-1][1].append(line)
+            else:
+                header.append(line)
+        return header, columns, footer
+    lines = table_data['ddl'].split('\n')
+    header, columns, footer = [], [], []
+    in_columns = False
+    for line in lines:
+        stripped = line.strip()
+        if not in_columns and stripped.startswith('('):
+            in_columns = True
+            header.append(line)
+        elif in_columns and stripped.startswith(')'):
+            in_columns = False
+            footer.append(line)
+        elif in_columns and stripped:
+            columns.append((stripped.split(' ')[0], [line.rstrip(',')]))
+        elif columns:
+            footer.append(line)
+        else:
+            header.append(line)
+    return header, columns, footer
+
+
+def render_table(table_data, header, columns, footer):
+    """Table data with its schema text reduced to the given columns"""
+    pruned_table = dict(table_data)
+    if 'col_a' in table_data:
+        pruned_table['col_a'] = '\n'.join(header + [line for _, lines in columns for line in lines] + footer)
+    else:
+        column_lines = [lines[0] for _, lines in columns]
+        pruned_table['ddl'] = '\n'.join(header + [',\n'.join(column_lines)] + footer)
+    return pruned_table
+
+
+def get_table_description(table_data):
+    return table_data.get('tbl_a') or table_data.get('description') or ''
+
+
+class SchemaIndex:
+    """Unit vectors of every table (name and description) and every column (name and comment) of a profile"""
+
+    def __init__(self, tables_info):
+        self.tables = {}
+        texts = {}
+        for table_name, table_data in tables_info.items():
+            header, columns, footer = parse_columns(table_data)
+            self.tables[table_name] = (header, columns, footer)
+            texts[(table_name, None)] = f'{table_name}: {get_table_description(table_data)}'
+            for column_name, lines in columns:
+                texts[(table_name, column_name)] = f'{table_name}.{column_name}: {" ".join(lines).strip()}'
+        keys = list(texts)
+        results = run_parallel_tasks([lambda text=texts[key]: get_embedding(text) for key in keys],
+                                     SCHEMA_LINKING_EMBEDDING_CONCURRENCY)
+        self.vectors = {}
+        for key, (embedding, error) in zip(keys, results):
+            if error is not None:
+                raise error
+            self.vectors[key] = unit_vector(embedding)
+        # columns sharing a name across tables are taken as join keys
+        tables_by_column = {}
+        for table_name, (_, columns, _) in self.tables.items():
+            for column_name, _ in columns:
+                tables_by_column.setdefault(column_name.lower(), set()).add(table_name)
+        self.join_keys = {column_name: table_names for column_name, table_names in tables_by_column.items()
+                          if len(table_names) > 1}
+
+    def similarity(self, key, question_vector):
+        vector = self.vectors.get(key)
+        if vector is None or question_vector is None:
+            return 0
+        return sum(a * b for a, b in zip(vector, question_vector))
+
+
+# column and table vectors of a profile's schema, keyed by profile fingerprint
+schema_indexes = BackgroundBuilder('schema-index', SchemaIndex)
+
+
+def get_schema_index(tables_info, fingerprint):
+    """The schema index of the profile, None while it is built in the background"""
+    return schema_indexes.get(fingerprint, tables_info)
+
+
+def select_schema(schema_index, question, question_vector, top_tables, top_columns):
+    """
+    Return {table name: set of column names} to keep: the top_tables tables by their best table or column similarity,
+    extended with tables that connect them through a join key, and per table the top_columns columns plus the join
+    keys shared with other selected tables. Tables and columns the question names literally are always kept.
+    """
+    question_words = {word.lower() for word in WORD_PATTERN.findall(question)}
+    table_scores = {}
+    column_scores = {}
+    for table_name, (_, columns, _) in schema_index.tables.items():
+        score = schema_index.similarity((table_name, None), question_vector)
+        for column_name, _ in columns:
+            column_score = schema_index.similarity((table_name, column_name), question_vector)
+            if column_name.lower() in question_words:
+                column_score += 1
+            column_scores[(table_name, column_name)] = column_score
+            score = max(score, column_score)
+        if table_name.lower() in question_words:
+            score += 1
+        table_scores[table_name] = score
+
+    ranked_tables = sorted(table_scores, key=table_scores.get, reverse=True)
+    selected_tables = set(ranked_tables[:top_tables])
+    # join-key closure: add the best scored table bridging two selected tables that share no key
+    join_keys = schema_index.join_keys
+    for table_a in list(selected_tables):
+        for table_b in list(selected_tables):
+            if table_a >= table_b or any({table_a, table_b} <= tables for tables in join_keys.values()):
+                continue
+            bridges = [table for table in ranked_tables if table not in selected_tables
+                       and any({table_a, table} <= tables for tables in join_keys.values())
+                       and any({table_b, table} <= tables for tables in join_keys.values())]
+            if bridges:
+                selected_tables.add(bridges[0])
+
+    selection = {}
+    for table_name in selected_tables:
+        _, columns, _ = schema_index.tables[table_name]
+        ranked_columns = sorted((column_name for column_name, _ in columns),
+                                key=lambda column_name: column_scores[(table_name, column_name)], reverse=True)
+        kept_columns = set(ranked_columns[:top_columns])
+        kept_columns.update(column_name for column_name, _ in columns
+                            if len(join_keys.get(column_name.lower(), set()) & selected_tables) > 1
+                            or column_scores[(table_name, column_name)] >= 1)
+        selection[table_name] = kept_columns
+    return selection
+
+
+def link_schema(tables_info, question, fingerprint=None, top_tables=SCHEMA_LINKING_TOP_TABLES,
+                top_columns=SCHEMA_LINKING_TOP_COLUMNS):
+    """
+    Reduce tables_info to the tables and columns relevant to the question.
+    Returns (tables_info, fingerprint, report), the fingerprint identifies the reduced schema for the prompt cache.
+    """
+    fingerprint = fingerprint or get_profile_fingerprint({'tables_info': tables_info})
+    column_counts = [len(parse_columns(table_data)[1]) for table_data in tables_info.values()]
+    report = {'tables_total': len(tables_info), 'tables_kept': len(tables_info),
+              'columns_total': sum(column_counts), 'columns_kept': sum(column_counts)}
+    if len(tables_info) <= top_tables and all(column_count <= top_columns for column_count in column_counts):
+        # small enough to send whole
+        return tables_info, fingerprint, report
+
+    schema_index = get_schema_index(tables_info, fingerprint)
+    if schema_index is None:
+        report['index_ready'] = False
+        return tables_info, fingerprint, report
+    question_vector = unit_vector(get_embedding(question))
+    selection = select_schema(schema_index, question, question_vector, top_tables, top_columns)
+    pruned_tables_info = {}
+    for table_name, table_data in tables_info.items():
+        if table_name not in selection:
+            continue
+        header, columns, footer = schema_index.tables[table_name]
+        kept_columns = [(column_name, lines) for column_name, lines in columns if column_name in selection[table_name]]
+        pruned_tables_info[table_name] = render_table(table_data, header, kept_columns, footer)
+
+    selection_key = ';'.join(f'{table_name}:{",".join(sorted(columns))}' for table_name, columns in
+                             sorted(selection.items()))
+    pruned_fingerprint = hashlib.sha256(f'{fingerprint}\n{selection_key}'.encode('utf-8')).hexdigest()
+    report['tables_kept'] = len(pruned_tables_info)
+    report['columns_kept'] = sum(len(columns) for columns in selection.values())
+    return pruned_tables_info, pruned_fingerprint, report
+
+
+def get_schema_tokens(tables_info):
+    return sum(estimate_tokens(f'{table_name}: {get_table_description(table_data)}\n'
+                               f'{table_data.get("col_a") or table_data["ddl"]}\n')
+               for table_name, table_data in tables_info.items())
+
+
+def link_profile_schema(database_profile, question):
+    """
+    Tables info and fingerprint to build the text-to-SQL prompt of the question with.
+    The whole schema is used when schema linking is disabled or fails, or while the profile's index is built.
+    """
+    tables_info = database_profile['tables_info']
+    fingerprint = database_profile.get('fingerprint')
+    if not SCHEMA_LINKING_ENABLED or not tables_info:
+        return tables_info, fingerprint
+    try:
+        pruned_tables_info, pruned_fingerprint, report = link_schema(tables_info, question, fingerprint)
+    except Exception as e:
+        logger.warning(f'schema linking failed, using the whole schema: {e}')
+        with schema_linking_stats_lock:
+            schema_linking_stats['errors'] += 1
+        return tables_info, fingerprint
+    tokens_before = get_schema_tokens(tables_info)
+    tokens_after = get_schema_tokens(pruned_tables_info) if pruned_tables_info is not tables_info else tokens_before
+    report['tokens_saved'] = tokens_before - tokens_after
+    logger.info(f'schema linking {report}')
+    with schema_linking_stats_lock:
+        schema_linking_stats['questions'] += 1
+        schema_linking_stats['pruned'] += int(pruned_tables_info is not tables_info)
+        schema_linking_stats['index_not_ready'] += int(report.get('index_ready') is False)
+        schema_linking_stats['tokens_before'] += tokens_before
+        schema_linking_stats['tokens_after'] += tokens_after
+    return pruned_tables_info, pruned_fingerprint
+
+
+def get_stats():
+    with schema_linking_stats_lock:
+        stats = dict(schema_linking_stats)
+    stats['tokens_saved'] = stats['tokens_before'] - stats['tokens_after']
+    index_stats = schema_indexes.get_stats()
+    stats['indexed_profiles'] = index_stats['built']
+    stats['indexes_building'] = index_stats['building']
+    stats['index_failures'] = index_stats['failures']
+    return stats
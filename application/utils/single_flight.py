@@ -0,0 +1,163 @@
+import copy
+import logging
+import threading
+import weakref
+from concurrent.futures import Future
+
+from utils.env_var import SINGLE_FLIGHT_ENABLED
+
+logger = logging.getLogger(__name__)
+
+single_flights = []
+
+
+class StreamFanOut:
+    """
+    Replays the pieces of one stream to every subscriber, each iteration is a new subscriber starting from the first
+    piece. Whichever subscriber is ahead pulls the next piece from the source, so a slow one does not hold back the
+    others. An error of the source is raised to every subscriber.
+    """
+
+    def __init__(self, stream, on_done=None):
+        self.stream = stream
+        self.subscribers = 0
+        self._source = None
+        self._pieces = []
+        self._pulling = False
+        self._done = False
+        self._error = None
+        self._on_done = on_done
+        self._condition = threading.Condition()
+
+    @property
+    def result(self):
+        return getattr(self.stream, 'result', None)
+
+    def __iter__(self):
+        with self._condition:
+            self.subscribers += 1
+        index = 0
+        while True:
+            with self._condition:
+                while index == len(self._pieces) and not self._done and self._pulling:
+                    self._condition.wait()
+                if index < len(self._pieces):
+                    piece = self._pieces[index]
+                elif self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                else:
+                    self._pulling = True
+                    piece = None
+            if piece is None:
+                self._pull()
+                continue
+            index += 1
+            yield piece
+
+    def _pull(self):
+        try:
+            if self._source is None:
+                self._source = iter(self.stream)
+            piece = next(self._source)
+        except StopIteration:
+            self._finish()
+        except Exception as e:
+            self._finish(e)
+        else:
+            with self._condition:
+                self._pieces.append(piece)
+                self._pulling = False
+                self._condition.notify_all()
+
+    def _finish(self, error=None):
+        with self._condition:
+            self._done = True
+            self._error = error
+            self._pulling = False
+            self._condition.notify_all()
+        if self._on_done is not None:
+            self._on_done()
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution of the function: the first caller runs it, the others
+    wait for its result or error. Results can be copied for the waiting callers when they may be modified.
+    Streams are shared until they end, so identical requests arriving meanwhile replay the pieces seen so far.
+    """
+
+    def __init__(self, name, copy_result=False):
+        self.name = name
+        self.copy_result = copy_result
+        self.calls = 0
+        self.shared = 0
+        self._in_flight = {}
+        # a stream nobody holds any more is dropped, which releases its rate limit permit
+        self._streams = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        single_flights.append(self)
+
+    def do(self, key, fn):
+        if not SINGLE_FLIGHT_ENABLED:
+            return fn()
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.shared += 1
+        if not leader:
+            result = future.result()
+            return copy.deepcopy(result) if self.copy_result else result
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def do_stream(self, key, open_stream):
+        """A StreamFanOut of the stream open_stream returns, shared with identical calls until the stream ends"""
+        if not SINGLE_FLIGHT_ENABLED:
+            return open_stream()
+        with self._lock:
+            fan_out = self._streams.get(key)
+            if fan_out is not None:
+                self.calls += 1
+                self.shared += 1
+                logger.info(f'{self.name} joined a stream in flight')
+                return fan_out
+        return self.do(('stream', key), lambda: self._open_fan_out(key, open_stream))
+
+    def _open_fan_out(self, key, open_stream):
+        fan_out = StreamFanOut(open_stream(), on_done=lambda: self._forget_stream(key))
+        with self._lock:
+            self._streams[key] = fan_out
+        return fan_out
+
+    def _forget_stream(self, key):
+        with self._lock:
+            self._streams.pop(key, None)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'shared': self.shared,
+                'in_flight': len(self._in_flight),
+                'streams': len(self._streams),
+            }
+
+
+def get_stats():
+    return {single_flight.name: single_flight.get_stats() for single_flight in single_flights}
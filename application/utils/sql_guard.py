@@ -0,0 +1,134 @@
+import json
+import logging
+import re
+
+import sqlparse
+from sqlalchemy import text
+from sqlparse.sql import IdentifierList
+from sqlparse.tokens import Keyword, Number
+
+from utils.env_var import SQL_GUARD_LIMIT, SQL_GUARD_EXPLAIN, SQL_GUARD_MAX_COST, SQL_GUARD_MAX_SCAN_ROWS
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_QUERY_TYPES = ['SELECT']
+# dialects (as in the sqlalchemy url) whose LIMIT and EXPLAIN syntax the guard understands, redshift uses postgresql
+GUARDED_DIALECTS = ['mysql', 'postgresql']
+
+PG_PLAN_COST_PATTERN = re.compile(r'cost=[\d.]+\.\.([\d.]+) rows=(\d+)')
+
+
+class SQLGuardError(ValueError):
+    pass
+
+
+def get_guard_config(overrides=None):
+    """Global guard settings, overridden by the non-empty values of a profile's sql_guard dict"""
+    config = {
+        'limit': SQL_GUARD_LIMIT,
+        'explain': SQL_GUARD_EXPLAIN,
+        'max_cost': SQL_GUARD_MAX_COST,
+        'max_scan_rows': SQL_GUARD_MAX_SCAN_ROWS,
+    }
+    for key, value in (overrides or {}).items():
+        if key in config and value is not None:
+            config[key] = bool(value) if key == 'explain' else int(value)
+    return config
+
+
+def parse_select(sql):
+    statements = [statement for statement in sqlparse.parse(sql) if statement.value.strip(' \t\r\n;')]
+    if len(statements) != 1:
+        raise SQLGuardError('Exactly one SQL statement can be executed.')
+    statement = statements[0]
+    query_type = statement.get_type()
+    if query_type not in ALLOWED_QUERY_TYPES:
+        raise SQLGuardError(f"Query type '{query_type}' is not allowed.")
+    return statement
+
+
+def apply_limit(sql, limit):
+    """Clamp the top level LIMIT of a SELECT to `limit`, or append one when the query has none"""
+    statement = parse_select(sql)
+    tokens = [token for token in statement.tokens if not token.is_whitespace]
+    for i, token in enumerate(tokens):
+        if token.ttype is not Keyword or token.normalized != 'LIMIT':
+            continue
+        limit_value = tokens[i + 1] if i + 1 < len(tokens) else None
+        if isinstance(limit_value, IdentifierList):
+            # mysql "LIMIT offset, count"
+            limit_value = [t for t in limit_value.get_identifiers()][-1]
+        if limit_value is not None and limit_value.ttype in Number:
+            if int(limit_value.value) > limit:
+                limit_value.value = str(limit)
+            return str(statement).strip().rstrip(';')
+        if limit_value is not None and limit_value.normalized == 'ALL':
+            limit_value.value = str(limit)
+            return str(statement).strip().rstrip(';')
+        # an expression we cannot clamp in place, limit the outer query instead
+        return f"SELECT * FROM ({str(statement).strip().rstrip(';')}\n) AS genbi_limited LIMIT {limit}"
+    if any(token.ttype is Keyword and token.normalized in ('FETCH', 'TOP') for token in tokens):
+        return f"SELECT * FROM ({str(statement).strip().rstrip(';')}\n) AS genbi_limited LIMIT {limit}"
+    # the new line keeps the LIMIT out of a trailing line comment
+    return f"{str(statement).strip().rstrip(';')}\nLIMIT {limit}"
+
+
+def explain_sql(connection, dialect, sql):
+    """
+    Return the planner estimates (cost, rows) of a query, either may be None when the plan does not report it.
+    rows is the largest row estimate of any plan node, i.e. roughly the biggest scan.
+    """
+    if dialect == 'postgresql':
+        plan_lines = [row[0] for row in connection.execute(text(f'EXPLAIN {sql}'))]
+        estimates = [PG_PLAN_COST_PATTERN.search(line) for line in plan_lines]
+        estimates = [match for match in estimates if match]
+        if not estimates:
+            return None, None
+        return float(estimates[0].group(1)), max(int(match.group(2)) for match in estimates)
+    elif dialect == 'mysql':
+        plan = json.loads(connection.execute(text(f'EXPLAIN FORMAT=JSON {sql}')).scalar())
+        query_block = plan.get('query_block', {})
+        cost = query_block.get('cost_info', {}).get('query_cost')
+        scan_rows = list(find_values(plan, 'rows_examined_per_scan'))
+        return (float(cost) if cost is not None else None), (max(int(rows) for rows in scan_rows) if scan_rows else None)
+    return None, None
+
+
+def find_values(node, key):
+    if isinstance(node, dict):
+        for k, v in node.items():
+            if k == key:
+                yield v
+            else:
+                yield from find_values(v, key)
+    elif isinstance(node, list):
+        for item in node:
+            yield from find_values(item, key)
+
+
+def guard_sql(engine, dialect, sql, overrides=None):
+    """
+    Check generated sql before it runs: only a single SELECT is allowed, its LIMIT is injected or clamped and,
+    when enabled, the EXPLAIN estimates must stay within the cost / scanned rows budget.
+    Returns the sql to execute or raises SQLGuardError.
+    """
+    config = get_guard_config(overrides)
+    if dialect not in GUARDED_DIALECTS:
+        parse_select(sql)
+        return sql
+    guarded_sql = apply_limit(sql, config['limit']) if config['limit'] > 0 else str(parse_select(sql)).strip()
+    if config['explain'] and (config['max_cost'] > 0 or config['max_scan_rows'] > 0):
+        try:
+            with engine.connect() as connection:
+                cost, scan_rows = explain_sql(connection, dialect, guarded_sql)
+        except Exception as e:
+            # a query the planner rejects fails the same way on execution, let it report the real error there
+            logger.warning(f'failed to explain sql: {e}')
+            return guarded_sql
+        logger.info(f'sql estimate {cost=}, {scan_rows=}')
+        if config['max_cost'] > 0 and cost is not None and cost > config['max_cost']:
+            raise SQLGuardError(f'The estimated query cost {cost:.0f} exceeds the budget of {config["max_cost"]}.')
+        if config['max_scan_rows'] > 0 and scan_rows is not None and scan_rows > config['max_scan_rows']:
+            raise SQLGuardError(
+                f'The query would scan about {scan_rows} rows, more than the budget of {config["max_scan_rows"]}.')
+    return guarded_sql
@@ -1,9 +1,13 @@
 import logging
+from functools import partial
 
 from nlq.business.connection import ConnectionManagement
+from utils.concurrency import StageTimer, run_parallel_tasks
+from utils.env_var import AGENT_TASK_CONCURRENCY, AGENT_TASK_TIMEOUT
 from utils.domain import SearchTextSqlResult
 from utils.llm import text_to_sql
 from utils.opensearch import get_retrieve_opensearch
+from utils.schema_linking import link_profile_schema
 from utils.tool import get_generated_sql
 
 logger = logging.getLogger(__name__)
@@ -11,7 +15,9 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 
 
 def normal_text_search(search_box, model_type, database_profile, entity_slot, env_vars, selected_profile, use_rag,
-                       model_provider=None):
+                       model_provider=None, stage_timer=None):
+    if stage_timer is None:
+        stage_timer = StageTimer()
     entity_slot_retrieve = []
     retrieve_result = []
     response = ""
@@ -20,31 +26,36 @@ def normal_text_search(search_box, model_type, database_profile, entity_slot, en
                                         retrieve_result=retrieve_result, response=response, sql=sql)
     try:
         if database_profile['db_url'] == '':
-            conn_name = database_profile['conn_name']
-            db_url = ConnectionManagement.get_db_url_by_name(conn_name)
-            database_profile['db_url'] = db_url
-            database_profile['db_type'] = ConnectionManagement.get_db_type_by_name(conn_name)
+            resolved_connection = ConnectionManagement.get_resolved_connection(database_profile['conn_name'])
+            database_profile['db_url'] = resolved_connection.db_url
+            database_profile['db_type'] = resolved_connection.db_type
 
-        if len(entity_slot) > 0 and use_rag:
-            for each_entity in entity_slot:
-                entity_retrieve = get_retrieve_opensearch(env_vars, each_entity, "ner",
-                                                          selected_profile, 1, 0.7)
+        schema_future = stage_timer.submit('schema_linking', link_profile_schema, database_profile, search_box)
+        if use_rag:
+            # the entity lookups and the example retrieval do not depend on each other
+            entity_retrieve_futures = [stage_timer.submit('ner_retrieval', get_retrieve_opensearch, env_vars,
+                                                          each_entity, "ner", selected_profile, 1, 0.7)
+                                       for each_entity in entity_slot]
+            retrieve_future = stage_timer.submit('query_retrieval', get_retrieve_opensearch, env_vars, search_box,
+                                                 "query", selected_profile, 3, 0.5)
+            for entity_retrieve_future in entity_retrieve_futures:
+                entity_retrieve = entity_retrieve_future.result()
                 if len(entity_retrieve) > 0:
                     entity_slot_retrieve.extend(entity_retrieve)
+            retrieve_result = retrieve_future.result()
+        tables_info, schema_fingerprint = schema_future.result()
 
-        if use_rag:
-            retrieve_result = get_retrieve_opensearch(env_vars, search_box, "query",
-                                                      selected_profile, 3, 0.5)
-
-        response = text_to_sql(database_profile['tables_info'],
-                               database_profile['hints'],
-                               database_profile['prompt_map'],
-                               search_box,
-                               model_id=model_type,
-                               sql_examples=retrieve_result,
-                               ner_example=entity_slot_retrieve,
-                               dialect=database_profile['db_type'],
-                               model_provider=model_provider)
+        response = stage_timer.run('text_to_sql', text_to_sql,
+                                   tables_info,
+                                   database_profile['hints'],
+                                   database_profile['prompt_map'],
+                                   search_box,
+                                   model_id=model_type,
+                                   sql_examples=retrieve_result,
+                                   ner_example=entity_slot_retrieve,
+                                   dialect=database_profile['db_type'],
+                                   model_provider=model_provider,
+                                   fingerprint=schema_fingerprint)
         sql = get_generated_sql(response)
         search_result = SearchTextSqlResult(search_query=search_box, entity_slot_retrieve=entity_slot_retrieve,
                                             retrieve_result=retrieve_result, response=response, sql="")
@@ -61,32 +72,44 @@ def agent_text_search(search_box, model_type, database_profile, entity_slot, env
                       agent_cot_task_result):
     agent_search_results = []
     try:
-        for each_task in agent_cot_task_result:
-            each_res_dict = {}
-            each_task_query = agent_cot_task_result[each_task]
-            each_res_dict["query"] = each_task_query
-            entity_slot_retrieve = []
-            retrieve_result = []
-            if use_rag:
-                entity_slot_retrieve = get_retrieve_opensearch(env_vars, each_task_query, "ner",
-                                                               selected_profile, 3, 0.5)
-
-                retrieve_result = get_retrieve_opensearch(env_vars, each_task_query, "query",
-                                                          selected_profile, 3, 0.5)
-            each_task_response = text_to_sql(database_profile['tables_info'],
-                                             database_profile['hints'],
-                                             database_profile['prompt_map'],
-                                             each_task_query,
-                                             model_id=model_type,
-                                             sql_examples=retrieve_result,
-                                             ner_example=entity_slot_retrieve,
-                                             dialect=database_profile['db_type'],
-                                             model_provider=None)
-            each_task_sql = get_generated_sql(each_task_response)
-            each_res_dict["response"] = each_task_response
-            each_res_dict["sql"] = each_task_sql
-            if each_res_dict["sql"] != "":
+        each_task_queries = list(agent_cot_task_result.values())
+        # sub tasks are independent, generate their SQL concurrently and keep whatever finished in time
+        each_task_results = run_parallel_tasks(
+            [partial(agent_sub_task_text_search, each_task_query, model_type, database_profile, env_vars,
+                     selected_profile, use_rag) for each_task_query in each_task_queries],
+            AGENT_TASK_CONCURRENCY, AGENT_TASK_TIMEOUT)
+        for each_task_query, (each_res_dict, error) in zip(each_task_queries, each_task_results):
+            if error is not None:
+                logger.error(f"agent sub task {each_task_query} is error: {error}")
+            elif each_res_dict["sql"] != "":
                 agent_search_results.append(each_res_dict)
     except Exception as e:
         logger.error(e)
     return agent_search_results
+
+
+def agent_sub_task_text_search(each_task_query, model_type, database_profile, env_vars, selected_profile, use_rag):
+    each_res_dict = {"query": each_task_query}
+    entity_slot_retrieve = []
+    retrieve_result = []
+    if use_rag:
+        entity_slot_retrieve = get_retrieve_opensearch(env_vars, each_task_query, "ner",
+                                                       selected_profile, 3, 0.5)
+
+        retrieve_result = get_retrieve_opensearch(env_vars, each_task_query, "query",
+                                                  selected_profile, 3, 0.5)
+    tables_info, schema_fingerprint = link_profile_schema(database_profile, each_task_query)
+    each_task_response = text_to_sql(tables_info,
+                                     database_profile['hints'],
+                                     database_profile['prompt_map'],
+                                     each_task_query,
+                                     model_id=model_type,
+                                     sql_examples=retrieve_result,
+                                     ner_example=entity_slot_retrieve,
+                                     dialect=database_profile['db_type'],
+                                     model_provider=None,
+                                     fingerprint=schema_fingerprint)
+    each_task_sql = get_generated_sql(each_task_response)
+    each_res_dict["response"] = each_task_response
+    each_res_dict["sql"] = each_task_sql
+    return each_res_dict
@@ -0,0 +1,163 @@
+import json
+import logging
+import re
+
+from utils.env_var import PROMPT_TOKEN_BUDGET, PROMPT_DATA_TOKEN_BUDGET
+
+logger = logging.getLogger(__name__)
+
+# rough stand-in for the model tokenizers: short runs of letters or digits and single other characters,
+# so CJK text counts one token per character
+TOKEN_PATTERN = re.compile(r'[A-Za-z]{1,5}|\d{1,3}|[^\sA-Za-z\d]')
+
+# context window in tokens by model name, as in support_model_ids_map
+MODEL_CONTEXT_TOKENS = {
+    'haiku-20240307v1-0': 200000,
+    'sonnet-20240229v1-0': 200000,
+    'mixtral-8x7b-instruct-0': 32000,
+    'llama3-70b-instruct-0': 8000,
+}
+DEFAULT_CONTEXT_TOKENS = 8000
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def get_prompt_budget(model_name, max_output_tokens=2048):
+    """Tokens the prompt may use: the model context minus the answer, capped by PROMPT_TOKEN_BUDGET when set"""
+    budget = MODEL_CONTEXT_TOKENS.get(model_name, DEFAULT_CONTEXT_TOKENS) - max_output_tokens
+    if PROMPT_TOKEN_BUDGET > 0:
+        budget = min(budget, PROMPT_TOKEN_BUDGET)
+    return budget
+
+
+def summarize_records(records):
+    """min / max / mean of the numeric columns over all records"""
+    stats = {}
+    for column in records[0].keys() if isinstance(records[0], dict) else []:
+        values = [record.get(column) for record in records]
+        values = [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        if values:
+            stats[column] = {'min': min(values), 'max': max(values), 'mean': round(sum(values) / len(values), 4)}
+    return stats
+
+
+def truncate_records(records, max_tokens):
+    """
+    JSON of the records when it fits max_tokens, otherwise of the first rows that fit together with the total
+    row count and column statistics computed over all rows
+    """
+    data = json.dumps(records, ensure_ascii=False, default=str)
+    if estimate_tokens(data) <= max_tokens or not records:
+        return data
+    note = 'Only the first {} of {} rows are included, column_stats cover all rows.'
+    # the note is sized for the largest row count while searching
+    summary = {'note': note.format(len(records), len(records)), 'column_stats': summarize_records(records)}
+    low, high = 0, len(records)
+    while low < high:
+        # the largest row count whose payload fits
+        middle = (low + high + 1) // 2
+        summary['rows'] = records[:middle]
+        if estimate_tokens(json.dumps(summary, ensure_ascii=False, default=str)) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    summary['rows'] = records[:low]
+    summary['note'] = note.format(low, len(records))
+    return json.dumps(summary, ensure_ascii=False, default=str)
+
+
+def truncate_data(data, max_tokens):
+    """
+    Fit a result set payload into max_tokens. data is the JSON of a list of records, or of the agent sub-tasks
+    each holding its records as JSON in data_result, which then share the budget.
+    """
+    if estimate_tokens(data) <= max_tokens:
+        return data
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        payload = None
+    if isinstance(payload, list) and payload and all(isinstance(item, dict) and 'data_result' in item
+                                                     for item in payload):
+        task_budget = max(max_tokens // len(payload), 1)
+        for item in payload:
+            item_tokens = estimate_tokens(json.dumps({k: v for k, v in item.items() if k != 'data_result'},
+                                                     ensure_ascii=False))
+            item['data_result'] = truncate_data(item['data_result'], max(task_budget - item_tokens, 1))
+        return json.dumps(payload, ensure_ascii=False)
+    if isinstance(payload, list):
+        return truncate_records(payload, max_tokens)
+    # not a record list, cut the text
+    return data[:max_tokens * 4] + '...'
+
+
+class PromptBudget:
+    """
+    Token budget of one prompt. Sections are added in priority order: fixed parts first, then the trimmable ones,
+    each limited by its own budget and by what is left of the total.
+    """
+
+    def __init__(self, model_name, max_output_tokens=2048):
+        self.total = get_prompt_budget(model_name, max_output_tokens)
+        self.sections = {}
+        self.trimmed = {}
+
+    @property
+    def remaining(self):
+        return max(self.total - sum(self.sections.values()), 0)
+
+    def add(self, section, text=None, tokens=None):
+        self.sections[section] = self.sections.get(section, 0) + (estimate_tokens(text) if tokens is None else tokens)
+
+    def fit_items(self, section, items, render, max_tokens, score=None):
+        """
+        Render the items that fit the section budget, dropping the lowest scoring ones first.
+        The kept items stay in their original order.
+        """
+        if not items:
+            self.add(section, tokens=0)
+            return ''
+        budget = min(max_tokens, self.remaining)
+        rendered = [render(item) for item in items]
+        tokens = [estimate_tokens(text) for text in rendered]
+        order = range(len(items))
+        if score is not None:
+            order = sorted(order, key=lambda i: score(items[i]), reverse=True)
+        kept = set()
+        used = 0
+        for i in order:
+            if used + tokens[i] <= budget:
+                kept.add(i)
+                used += tokens[i]
+        if len(kept) < len(items):
+            self.trimmed[section] = f'kept {len(kept)} of {len(items)}'
+        self.add(section, tokens=used)
+        return ''.join(rendered[i] for i in range(len(items)) if i in kept)
+
+    def fit_data(self, section, data, max_tokens=PROMPT_DATA_TOKEN_BUDGET):
+        budget = min(max_tokens, self.remaining)
+        fitted = truncate_data(data, budget)
+        if fitted is not data:
+            self.trimmed[section] = f'{estimate_tokens(data)} tokens truncated'
+        self.add(section, fitted)
+        return fitted
+
+    def get_report(self):
+        report = dict(self.sections)
+        report['total'] = sum(self.sections.values())
+        report['budget'] = self.total
+        if self.trimmed:
+            report['trimmed'] = dict(self.trimmed)
+        return report
+
+    def log_report(self, prompt_name):
+        report = self.get_report()
+        if report['total'] > self.total:
+            logger.warning(f'{prompt_name} prompt exceeds the token budget {report}')
+        else:
+            logger.info(f'{prompt_name} prompt tokens {report}')
+        return report
@@ -1,8 +1,14 @@
+import hashlib
+import json
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+JSON_CODE_BLOCK_PATTERN = re.compile(r'```(?:json)?\s*(.*?)```', re.DOTALL)
+JSON_START_PATTERN = re.compile(r'[{\[]')
+
 
 
 
@@ -14,4 +20,33 @@ def get_generated_sql(generated_sql_response):
     except IndexError:
         logger.error("No SQL found in the LLM's response")
         logger.error(generated_sql_response)
-    return sql
\ No newline at end of file
+    return sql
+
+
+def parse_json_response(response):
+    """
+    Parse the JSON object an LLM answered with. The JSON may be wrapped in a markdown code block or surrounded
+    by text, the first value that decodes is returned. Raises ValueError when there is none.
+    """
+    response = response.strip()
+    code_block = JSON_CODE_BLOCK_PATTERN.search(response)
+    if code_block:
+        response = code_block.group(1).strip()
+    try:
+        return json.loads(response)
+    except ValueError:
+        pass
+    decoder = json.JSONDecoder()
+    for match in JSON_START_PATTERN.finditer(response):
+        try:
+            return decoder.raw_decode(response, match.start())[0]
+        except ValueError:
+            continue
+    raise ValueError(f'No JSON found in the LLM response: {response}')
+
+
+def get_profile_fingerprint(profile):
+    """Hash of the profile parts that shape generated answers, used to tell when cached answers went stale"""
+    content = json.dumps({'tables_info': profile.get('tables_info'), 'hints': profile.get('hints'),
+                          'prompt_map': profile.get('prompt_map')}, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
@@ -34,6 +34,8 @@ sed -i "s|DYNAMODB_AWS_REGION=us-west-2|AWS_DEFAULT_REGION=$ec2_region|g" $file_
 
 # docker exec nlq-mysql sh -c "mysql -u root -ppassword -D llm  < /opt/data/init_mysql_db.sql" 
 
+# docker exec nlq-webserver python bootstrap_tables.py
+
 # docker exec nlq-webserver python opensearch_deploy.py
 
 # echo "All services are started successfully. Please access the application at http://<ec2-public-ip>"
\ No newline at end of file
@@ -24,6 +24,8 @@ unzip init_mysql_db.sql.zip && cd ..
 
 docker exec nlq-mysql sh -c "mysql -u root -ppassword -D llm  < /opt/data/init_mysql_db.sql" 
 
+docker exec nlq-webserver python bootstrap_tables.py
+
 docker exec nlq-webserver python opensearch_deploy.py
 
 echo "All services are started successfully. Please access the application at http://<ec2-public-ip>"
\ No newline at end of file